@@ -0,0 +1,158 @@
+"""答题记录统计：每次作答增量更新按天分桶的计数、最近作答环形缓冲区（滚动正确率）和连续天数/连对统计
+
+统计按用户存为一行 JSON（本地 SQLite），图表只读取预先累计好的分桶，不回扫作答历史。
+"""
+import json
+import os
+import time
+
+import local_store
+
+KEEP_DAYS = 90  # 按天分桶保留的天数
+RING_SIZE = 100  # 最近作答环形缓冲区大小（滚动正确率的窗口）
+# 按该时区划分"一天"（默认北京时间），可用环境变量覆盖
+UTC_OFFSET_HOURS = float(os.environ.get("QUIZ_UTC_OFFSET_HOURS", 8))
+
+
+def day_number(ts=None):
+    "时间戳所在的日期编号（自 1970-01-01 起的天数，按 UTC_OFFSET_HOURS 时区）"
+    ts = time.time() if ts is None else ts
+    return int((ts + UTC_OFFSET_HOURS * 3600) // 86400)
+
+
+def day_label(day):
+    return time.strftime("%m-%d", time.gmtime(day * 86400))
+
+
+def empty_stats():
+    return {
+        'days': {},  # 日期编号 -> [答题数, 答对数]
+        'ring': [],  # 最近作答 [时间戳, 题目ID, 是否答对]，写满后循环覆盖
+        'pos': 0,  # 环形缓冲区下一个写入位置
+        'ring_correct': 0,  # 缓冲区内答对数（随写入增减，不重新统计）
+        'run': 0, 'best_run': 0,  # 当前/最长连对题数
+        'streak': 0, 'best_streak': 0, 'last_day': None,  # 当前/最长连续答题天数
+        'total': 0, 'total_correct': 0
+    }
+
+
+def apply(stats, question_id, is_correct, ts=None):
+    "把一次作答增量计入统计（原地修改并返回 stats）"
+    ts = time.time() if ts is None else ts
+    ok = 1 if is_correct else 0
+    day = day_number(ts)
+
+    bucket = stats['days'].setdefault(str(day), [0, 0])
+    bucket[0] += 1
+    bucket[1] += ok
+    if len(stats['days']) > KEEP_DAYS:
+        for key in sorted(stats['days'], key=int)[:len(stats['days']) - KEEP_DAYS]:
+            del stats['days'][key]
+
+    entry = [round(ts, 1), question_id, ok]
+    ring = stats['ring']
+    if len(ring) < RING_SIZE:
+        ring.append(entry)
+    else:
+        stats['ring_correct'] -= ring[stats['pos']][2]
+        ring[stats['pos']] = entry
+    stats['pos'] = (stats['pos'] + 1) % RING_SIZE
+    stats['ring_correct'] += ok
+
+    stats['run'] = stats['run'] + 1 if ok else 0
+    stats['best_run'] = max(stats['best_run'], stats['run'])
+
+    last_day = stats['last_day']
+    if last_day is None or day > last_day:
+        stats['streak'] = stats['streak'] + 1 if last_day == day - 1 else 1
+        stats['last_day'] = day
+        stats['best_streak'] = max(stats['best_streak'], stats['streak'])
+
+    stats['total'] += 1
+    stats['total_correct'] += ok
+    return stats
+
+
+# --- 读取（只看分桶和计数器）---
+def current_streak(stats, today=None):
+    "当前连续答题天数；昨天和今天都没有答题时已中断"
+    today = day_number() if today is None else today
+    last_day = stats['last_day']
+    return stats['streak'] if last_day is not None and last_day >= today - 1 else 0
+
+
+def rolling_accuracy(stats):
+    "最近 RING_SIZE 次作答的正确率；没有作答时为 None"
+    return stats['ring_correct'] / len(stats['ring']) if stats['ring'] else None
+
+
+def today_counts(stats, today=None):
+    today = day_number() if today is None else today
+    return tuple(stats['days'].get(str(today), [0, 0]))
+
+
+def daily_series(stats, days=14, today=None):
+    "最近 days 天的 (日期标签, 答题数, 正确率百分比)，没有答题的日期正确率为 None"
+    today = day_number() if today is None else today
+    labels, answers, accuracy = [], [], []
+    for day in range(today - days + 1, today + 1):
+        count, correct = stats['days'].get(str(day), [0, 0])
+        labels.append(day_label(day))
+        answers.append(count)
+        accuracy.append(round(correct / count * 100, 1) if count else None)
+    return labels, answers, accuracy
+
+
+def recent_timeline(stats, limit=20):
+    "最近 limit 次作答（新的在前），按环形缓冲区的写入顺序展开"
+    ring = stats['ring']
+    ordered = ring[stats['pos']:] + ring[:stats['pos']] if len(ring) == RING_SIZE else ring
+    return list(reversed(ordered[-limit:]))
+
+
+# --- 持久化 ---
+class AnswerHistoryStore:
+    "每个用户一行统计；更新在 SQLite 写事务内完成，多进程、多会话同时作答时不会丢失计数"
+
+    DB_NAME = "history.sqlite3"
+
+    def __init__(self):
+        self._ready = False
+
+    def _conn(self):
+        conn = local_store.connect(self.DB_NAME)
+        if not self._ready:
+            with local_store.db_lock(self.DB_NAME):
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS answer_stats ("
+                    "user_id TEXT PRIMARY KEY, stats TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+            self._ready = True
+        return conn
+
+    def load(self, user_id):
+        conn = self._conn()
+        with local_store.db_lock(self.DB_NAME):
+            row = conn.execute("SELECT stats FROM answer_stats WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else empty_stats()
+
+    def record(self, user_id, question_id, is_correct, ts=None):
+        "计入一次作答，返回更新后的统计"
+        conn = self._conn()
+        with local_store.db_lock(self.DB_NAME):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT stats FROM answer_stats WHERE user_id = ?", (user_id,)).fetchone()
+                stats = apply(json.loads(row[0]) if row else empty_stats(), question_id, is_correct, ts)
+                conn.execute(
+                    "INSERT OR REPLACE INTO answer_stats (user_id, stats, updated_at) VALUES (?, ?, ?)",
+                    (user_id, json.dumps(stats, separators=(",", ":")), time.time())
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return stats
+
+
+history = AnswerHistoryStore()
@@ -0,0 +1,10 @@
+"""进程级后台线程池：云端同步等不阻塞页面渲染的任务"""
+from concurrent.futures import ThreadPoolExecutor
+
+# Streamlit 每次重跑都会重新执行主脚本，线程池必须放在独立模块中才能在进程内复用
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quiz-background")
+
+
+def submit(fn, *args, **kwargs):
+    "提交后台任务，返回 Future"
+    return executor.submit(fn, *args, **kwargs)
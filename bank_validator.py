@@ -0,0 +1,307 @@
+"""题库校验：逐题检查题干、选项前缀、答案字母和序号唯一性，输出机器可读的诊断信息
+
+单题检查的结果按题目内容哈希缓存，题库修改后只重新检查变化的题目；跨题检查（序号重复、内容重复）每次全量进行。
+构建题库索引前先经过校验，存在错误级别的诊断时拒绝加载（热加载时保留旧索引）。
+
+用法：
+    python bank_validator.py [题库文件] [--format text|json] [--no-cache]
+退出码：0 无错误，1 存在错误，2 文件无法读取或不是 JSON 数组
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+from pathlib import Path
+
+# 检查规则变化时递增，使缓存的单题结果失效
+CHECKS_VERSION = 1
+
+ERROR = "error"
+WARNING = "warning"
+
+# 评分依赖 opt.split(".")[0].strip().upper() 取得选项字母，前缀必须是"字母."
+OPTION_PREFIX = re.compile(r"^\s*([A-Za-z])\s*\.\s*(.*)$", re.S)
+
+
+def diagnostic(index, seq, code, severity, message):
+    return {'index': index, 'seq': seq, 'code': code, 'severity': severity, 'message': message}
+
+
+def item_hash(item):
+    "题目内容哈希（与键顺序和空白无关），作为单题检查结果的缓存键"
+    raw = json.dumps(item, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(f"{CHECKS_VERSION}:{raw}".encode("utf-8")).hexdigest()
+
+
+def iter_items(text):
+    "流式解析题库 JSON 数组，逐个产出 (下标, 题目)，不需要先构建整个列表"
+    decoder = json.JSONDecoder()
+    pos = 0
+    length = len(text)
+
+    def skip(pos):
+        while pos < length and text[pos] in " \t\r\n":
+            pos += 1
+        return pos
+
+    pos = skip(pos)
+    if pos >= length or text[pos] != "[":
+        raise ValueError("题库文件必须是JSON数组格式！")
+    pos = skip(pos + 1)
+    if pos < length and text[pos] == "]":
+        return
+    index = 0
+    while True:
+        item, pos = decoder.raw_decode(text, pos)
+        yield index, item
+        index += 1
+        pos = skip(pos)
+        if pos < length and text[pos] == ",":
+            pos = skip(pos + 1)
+        elif pos < length and text[pos] == "]":
+            return
+        else:
+            raise ValueError(f"题库 JSON 在第 {pos} 个字符附近格式错误")
+
+
+# --- 单题检查（结果可缓存）---
+def check_item(index, item):
+    "检查单道题，返回诊断列表（不含跨题检查）"
+    if not isinstance(item, dict):
+        return [diagnostic(index, None, "E101", ERROR, "题目不是 JSON 对象")]
+    seq = item.get('序号', item.get('id'))
+    found = []
+
+    def report(code, severity, message):
+        found.append(diagnostic(index, seq, code, severity, message))
+
+    q_text = item.get('question') or item.get('题干')
+    options = item.get('options') or item.get('选项')
+    answer = item.get('answer') or item.get('正确答案')
+
+    if not q_text or not str(q_text).strip():
+        report("E102", ERROR, "缺少题干")
+    if not isinstance(options, list) or len(options) == 0:
+        report("E103", ERROR, "缺少选项或选项不是非空数组")
+        options = []
+    if not answer:
+        report("E104", ERROR, "缺少正确答案")
+
+    letters = []
+    for pos, opt in enumerate(options):
+        match = OPTION_PREFIX.match(str(opt))
+        if match is None:
+            report("E105", ERROR, f"第 {pos + 1} 个选项缺少“字母.”前缀: {str(opt)[:30]!r}")
+            continue
+        letter = match.group(1).upper()
+        if not match.group(2).strip():
+            report("W203", WARNING, f"选项 {letter} 内容为空")
+        if letter in letters:
+            report("E106", ERROR, f"选项字母 {letter} 重复")
+        letters.append(letter)
+    if letters and letters != [chr(ord("A") + i) for i in range(len(letters))]:
+        report("W201", WARNING, f"选项字母不是从 A 开始依次排列: {''.join(letters)}")
+
+    if answer:
+        if isinstance(answer, list):
+            answer_letters = [str(a).strip().upper() for a in answer if str(a).strip()]
+            is_multiple = True
+        elif "|" in str(answer):
+            answer_letters = [a.strip().upper() for a in str(answer).split("|") if a.strip()]
+            is_multiple = True
+        else:
+            answer_letters = [str(answer).strip().upper()]
+            is_multiple = False
+        if not is_multiple and len(answer_letters[0]) != 1:
+            report("E108", ERROR, f"单选题答案应为单个字母: {answer!r}（多选题请用数组或“|”分隔）")
+        elif is_multiple and len(set(answer_letters)) < 2:
+            report("W202", WARNING, f"多选题答案少于两个选项: {answer!r}")
+        missing = [a for a in answer_letters if len(a) == 1 and a not in letters]
+        if missing and letters:
+            report("E107", ERROR, f"答案 {''.join(missing)} 不在选项中（选项为 {''.join(letters)}）")
+
+    try:
+        if seq is None or int(seq) < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        report("W204", WARNING, f"序号缺失或不是非负整数: {seq!r}（将使用内容哈希作为题目ID）")
+    return found
+
+
+class ValidationCache:
+    "单题检查结果缓存（SQLite，按内容哈希）"
+
+    DB_NAME = "validation.sqlite3"
+
+    def __init__(self):
+        self._ready = False
+
+    def _conn(self):
+        import local_store  # 延迟导入：local_store 依赖 question_index，而 question_index 构建索引时依赖本模块
+        conn = local_store.connect(self.DB_NAME)
+        if not self._ready:
+            with local_store.db_lock(self.DB_NAME):
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS item_checks (item_hash TEXT PRIMARY KEY, diagnostics TEXT NOT NULL)"
+                )
+            self._ready = True
+        return conn, local_store.db_lock(self.DB_NAME)
+
+    def get_many(self, hashes):
+        conn, lock = self._conn()
+        found = {}
+        hashes = list(hashes)
+        with lock:
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT item_hash, diagnostics FROM item_checks WHERE item_hash IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((h, json.loads(d)) for h, d in rows)
+        return found
+
+    def put_many(self, results):
+        conn, lock = self._conn()
+        with lock:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO item_checks (item_hash, diagnostics) VALUES (?, ?)",
+                [(h, json.dumps(d, ensure_ascii=False)) for h, d in results.items()]
+            )
+            conn.execute("COMMIT")
+
+
+cache = ValidationCache()
+
+
+# --- 全题库校验 ---
+CHUNK_SIZE = 500  # 每次从缓存查询的题目数（同时也是遍历时同时保留在内存中的题目数上限）
+
+
+def content_digest(item):
+    "跨题内容重复检查用的摘要（题干+选项），只保留定长摘要而不是整道题的内容"
+    stem = str(item.get('question') or item.get('题干') or "").strip()
+    options = item.get('options') or item.get('选项')
+    if not stem or not isinstance(options, list):
+        return None
+    raw = json.dumps([stem, [str(opt).strip() for opt in options]], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).digest()
+
+
+def checked_items(items, report, use_cache=True):
+    """边校验边产出 (下标, 题目)：按块哈希、查询缓存、检查，调用方（如构建索引）在同一遍中处理每道题，
+    题库不需要先整体载入。遍历结束后 report 中有 'diagnostics' 和 'stats'（与 validate_items 的返回值相同）"""
+    diagnostics = report['diagnostics'] = []
+    seen_seq = {}
+    seen_content = {}
+    total = rechecked = 0
+    chunk = []
+    items = iter(items)
+    while True:
+        chunk.clear()
+        for index, item in items:
+            chunk.append((index, item, item_hash(item)))
+            if len(chunk) >= CHUNK_SIZE:
+                break
+        if not chunk:
+            break
+        cached = {}
+        if use_cache:
+            try:
+                cached = cache.get_many({h for _, _, h in chunk})
+            except Exception:
+                cached = {}  # 缓存不可用时全量检查
+        fresh = {}
+        for index, item, h in chunk:
+            if h in cached:
+                item_diagnostics = [dict(d, index=index) for d in cached[h]]
+            else:
+                item_diagnostics = check_item(index, item)
+                fresh[h] = item_diagnostics
+                rechecked += 1
+            diagnostics.extend(item_diagnostics)
+            total += 1
+
+            if isinstance(item, dict):
+                seq = item.get('序号', item.get('id'))
+                if seq is not None:
+                    if seq in seen_seq:
+                        diagnostics.append(diagnostic(index, seq, "E301", ERROR, f"序号 {seq} 与第 {seen_seq[seq] + 1} 题重复"))
+                    else:
+                        seen_seq[seq] = index
+                digest = content_digest(item)
+                if digest is not None:
+                    if digest in seen_content:
+                        diagnostics.append(diagnostic(index, seq, "W302", WARNING, f"与第 {seen_content[digest] + 1} 题内容完全相同"))
+                    else:
+                        seen_content[digest] = index
+            yield index, item
+        if use_cache and fresh:
+            try:
+                cache.put_many(fresh)
+            except Exception:
+                pass
+
+    report['stats'] = {
+        'items': total,
+        'rechecked': rechecked,
+        'errors': sum(1 for d in diagnostics if d['severity'] == ERROR),
+        'warnings': sum(1 for d in diagnostics if d['severity'] == WARNING)
+    }
+
+
+def validate_items(items, use_cache=True):
+    """对 (下标, 题目) 序列做一次流式遍历校验，返回 (诊断列表, 统计)。
+    单题诊断按内容哈希缓存（缓存中的下标按当前位置改写），序号重复和内容重复每次检查"""
+    report = {}
+    for _ in checked_items(items, report, use_cache):
+        pass
+    return report['diagnostics'], report['stats']
+
+
+def validate_file(path, use_cache=True):
+    "流式读取并校验题库文件"
+    text = Path(path).read_text(encoding="utf-8")
+    return validate_items(iter_items(text), use_cache=use_cache)
+
+
+def summarize(diagnostics, limit=5):
+    "错误摘要（用于加载失败时的提示）"
+    errors = [d for d in diagnostics if d['severity'] == ERROR]
+    lines = [f"第 {d['index'] + 1} 题（序号 {d['seq']}）[{d['code']}] {d['message']}" for d in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f"……共 {len(errors)} 个错误")
+    return "；".join(lines)
+
+
+def main(argv=None):
+    import question_index
+
+    parser = argparse.ArgumentParser(description="校验题库文件")
+    parser.add_argument("path", nargs="?", default=str(question_index.QUESTION_BANK_PATH), help="题库 JSON 文件")
+    parser.add_argument("--format", choices=("text", "json"), default="text", help="json 为每行一条诊断（JSON Lines）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用单题检查缓存")
+    args = parser.parse_args(argv)
+
+    try:
+        diagnostics, stats = validate_file(args.path, use_cache=not args.no_cache)
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        print(f"无法读取题库: {e}", file=sys.stderr)
+        return 2
+
+    if args.format == "json":
+        for d in diagnostics:
+            print(json.dumps(d, ensure_ascii=False))
+    else:
+        for d in diagnostics:
+            print(f"{args.path} 第{d['index'] + 1}题: {d['severity']} {d['code']} (序号 {d['seq']}) {d['message']}")
+    print(
+        f"共 {stats['items']} 题，重新检查 {stats['rechecked']} 题：{stats['errors']} 个错误，{stats['warnings']} 个警告",
+        file=sys.stderr
+    )
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""冷启动基准测试：每项测量都在新的 Python 进程中进行（模块未导入、题库未解析），重复多次取中位数
+
+用法：
+    python bench_startup.py                      # 登录页首屏、题库冷/热构建
+    python bench_startup.py --user 张三123        # 另外测量登录到出题（需要可用的服务账号凭据）
+    python bench_startup.py --repeat 5 --json     # 输出 JSON，便于记录到基准结果中对比
+
+测量项：
+    login_form        新进程中渲染登录页的耗时，以及此时已导入的重型库（应为空：gspread/oauth2client/numpy 都延迟到首次使用时导入）
+    index_build_cold  无本地校验缓存、无共享编译索引时构建题库索引
+    index_build_warm  校验缓存已就绪时再次构建（只重新检查变化的题目）
+    first_question    登录到显示第一题（应用自身记录的 time_to_first_question）
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+APP_PATH = Path(__file__).with_name("quiz_app.py")
+HEAVY_MODULES = ("gspread", "oauth2client", "numpy", "pandas")
+
+
+# --- 子进程中执行的测量 ---
+def child_login_form():
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    at = AppTest.from_file(str(APP_PATH), default_timeout=60)
+    at.run()
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"登录页渲染失败: {at.exception}")
+    return {'seconds': elapsed, 'heavy_modules': [m for m in HEAVY_MODULES if m in sys.modules]}
+
+
+def child_index_build():
+    import question_index
+
+    started = time.perf_counter()
+    question_index.build_index()
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    index = question_index.build_index()
+    warm = time.perf_counter() - started
+    return {'cold': cold, 'warm': warm, 'total': index['total']}
+
+
+def child_first_question(user_id):
+    import sheets_scheduler
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=120)
+    at.secrets['google_credentials'] = json.dumps(sheets_scheduler.load_credentials())
+    at.run()
+    at.text_input[0].input(user_id)
+    at.button[0].click()
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"登录失败: {at.exception}")
+    if 'time_to_first_question' not in at.session_state:
+        raise RuntimeError("登录后没有显示题目")
+    return {'seconds': at.session_state['time_to_first_question']}
+
+
+CHILDREN = {
+    'login_form': child_login_form,
+    'index_build': child_index_build,
+    'first_question': child_first_question
+}
+
+
+def run_child(name, *args, env=None):
+    "在新进程中执行一项测量，返回其 JSON 结果"
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", name, *args],
+        capture_output=True, text=True, env=env, cwd=str(APP_PATH.parent), check=False
+    )
+    lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+    if output.returncode != 0 or not lines:
+        raise RuntimeError(f"{name} 测量失败:\n{output.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="刷题系统冷启动基准测试")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取中位数）")
+    parser.add_argument("--user", help="测量登录到出题的用户ID（需要服务账号凭据）")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("child_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(CHILDREN[args.child](*args.child_args)))
+        return 0
+
+    results = {'login_form': [], 'index_build_cold': [], 'index_build_warm': [], 'first_question': []}
+    heavy = set()
+    for _ in range(args.repeat):
+        # 每轮使用新的本地缓存目录，题库校验缓存和共享编译索引都从零开始
+        with tempfile.TemporaryDirectory(prefix="quiz-bench-") as cache_dir:
+            env = dict(os.environ, QUIZ_CACHE_DIR=cache_dir)
+            env.pop("QUIZ_SHARED_INDEX_DIR", None)
+            login = run_child('login_form', env=env)
+            results['login_form'].append(login['seconds'])
+            heavy.update(login['heavy_modules'])
+            build = run_child('index_build', env=env)
+            results['index_build_cold'].append(build['cold'])
+            results['index_build_warm'].append(build['warm'])
+            if args.user:
+                results['first_question'].append(run_child('first_question', args.user, env=env)['seconds'])
+
+    summary = {
+        name: {'median_s': round(statistics.median(values), 4), 'min_s': round(min(values), 4), 'runs': len(values)}
+        for name, values in results.items() if values
+    }
+    summary['login_form']['heavy_modules'] = sorted(heavy)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False))
+    else:
+        for name, item in summary.items():
+            print(f"{name:<18} 中位数 {item['median_s'] * 1000:8.1f} ms   最快 {item['min_s'] * 1000:8.1f} ms   （{item['runs']} 次）")
+        print(f"登录页已导入的重型库：{', '.join(summary['login_form']['heavy_modules']) or '无'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
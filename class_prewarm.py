@@ -0,0 +1,188 @@
+"""课前预热：按上课名单和开课时间，提前一次批量读取全班的进度行写入本地进度缓存，并构建共享题库索引，
+开课时集中登录不再每人查找并读取整行：修订号校验按整列读取，几秒内全班共用一次读取；新学员直接按新用户处理
+
+用法：
+    python class_prewarm.py --roster roster.txt --start 08:00            # 今天 08:00 开课（已过则为明天），提前 5 分钟预热
+    python class_prewarm.py --roster roster.txt --start "2026-10-20 08:00" --lead 3
+    python class_prewarm.py --roster roster.txt --now                    # 立即预热
+
+名单文件每行一个用户ID（CSV 取第一列，# 开头为注释）。命令行预热写入本机的本地缓存目录（QUIZ_CACHE_DIR），
+应用各进程共用（修订号未变时直接使用预热的行，变了才重新读取）；
+管理面板中也可以在应用进程内安排预热（同时预热该进程内存中的题库索引和难度排序）。
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import progress_cache
+import progress_rows
+import question_index
+import sheets_scheduler
+
+DEFAULT_LEAD_MINUTES = 5
+# 新学员的“不存在”记录要在开课后的登录高峰内保持新鲜，提前量不能超过它的新鲜期
+MAX_LEAD_MINUTES = progress_cache.ABSENT_FRESH_SECONDS // 60 - 5
+PROGRESS_RANGE = "A:H"
+
+
+def read_roster(path):
+    "读取名单文件，返回去重后的用户ID列表（保持原顺序）"
+    user_ids = []
+    for line in Path(path).read_text(encoding="utf-8-sig").splitlines():
+        user_id = line.split(",")[0].strip()
+        if user_id and not user_id.startswith("#"):
+            user_ids.append(user_id)
+    return list(dict.fromkeys(user_ids))
+
+
+def parse_start(text, now=None):
+    "解析开课时间：HH:MM（今天，已过则为明天）或 YYYY-MM-DD HH:MM"
+    now = now or datetime.now()
+    try:
+        return datetime.strptime(text, "%Y-%m-%d %H:%M")
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(text, "%H:%M")
+    except ValueError:
+        raise ValueError(f"无法解析开课时间: {text}（格式为 HH:MM 或 YYYY-MM-DD HH:MM）")
+    start = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    return start if start > now else start + timedelta(days=1)
+
+
+# --- 预热 ---
+def warm_progress(sheet, user_ids):
+    """一次区域读取整张进度表，把名单中用户的进度行写入本地进度缓存；云端没有记录的用户记为“不存在”，
+    登录时直接按新用户处理。返回 (已缓存的用户数, 新用户列表)"""
+    wanted = set(user_ids)
+    found = set()
+    for row_number, row in enumerate(sheet.get(PROGRESS_RANGE), start=1):
+        user_id = row[0] if row else ""
+        if user_id in wanted and user_id not in found:
+            progress_cache.cache.put(user_id, row_number, row)
+            found.add(user_id)
+    new_users = [user_id for user_id in user_ids if user_id not in found]
+    for user_id in new_users:
+        progress_cache.cache.put_absent(user_id)
+    return len(found), new_users
+
+
+def warm_index(in_process):
+    """构建题库索引：写入题库校验缓存，多进程部署时发布共享编译索引；
+    in_process 为 True 时（在应用进程内预热）同时加载本进程的共享索引和难度排序"""
+    index = question_index.get_index() if in_process else question_index.build_index()
+    if in_process:
+        import difficulty_model
+        model = difficulty_model.load_model()
+        if model is not None:
+            for pool_name in ('all', 'single_choice', 'multiple_choice'):
+                difficulty_model.sorted_pool(index, pool_name, model)
+    return index
+
+
+def prewarm(sheet, user_ids, in_process=False):
+    "预热一个班级，返回统计"
+    started = time.time()
+    with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+        cached, new_users = warm_progress(sheet, user_ids)
+    index = warm_index(in_process)
+    return {
+        'users': len(user_ids),
+        'cached': cached,
+        'new_users': new_users,
+        'questions': index['total'],
+        'seconds': round(time.time() - started, 2)
+    }
+
+
+# --- 应用进程内的预热安排 ---
+class PrewarmScheduler:
+    "管理面板安排的课前预热：每个安排一个后台线程，等到开课前的提前量时执行"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = []  # {'users', 'start_at', 'run_at', 'status', 'result', 'error'}
+
+    def schedule(self, user_ids, start_at, open_sheet, lead_minutes=DEFAULT_LEAD_MINUTES):
+        "安排一次预热；open_sheet() 返回进度工作表。start_at 为开课时间的时间戳"
+        lead_minutes = min(lead_minutes, MAX_LEAD_MINUTES)
+        job = {
+            'users': list(user_ids),
+            'start_at': start_at,
+            'run_at': start_at - lead_minutes * 60,
+            'status': "等待",
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._jobs.append(job)
+        threading.Thread(target=self._run, args=(job, open_sheet), name="class-prewarm", daemon=True).start()
+        return job
+
+    def _run(self, job, open_sheet):
+        delay = job['run_at'] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        job['status'] = "预热中"
+        try:
+            job['result'] = prewarm(open_sheet(), job['users'], in_process=True)
+            job['status'] = "已完成"
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = "失败"
+
+    def jobs(self):
+        "最近的安排（管理面板展示），已结束超过一天的不再列出"
+        cutoff = time.time() - 24 * 3600
+        with self._lock:
+            self._jobs = [job for job in self._jobs if job['start_at'] > cutoff]
+            return list(self._jobs)
+
+
+scheduler = PrewarmScheduler()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按上课名单提前预热进度缓存和题库索引")
+    parser.add_argument("--roster", required=True, help="名单文件（每行一个用户ID）")
+    parser.add_argument("--start", help="开课时间：HH:MM 或 YYYY-MM-DD HH:MM")
+    parser.add_argument("--now", action="store_true", help="立即预热")
+    parser.add_argument("--lead", type=int, default=DEFAULT_LEAD_MINUTES, help=f"提前多少分钟预热（最多 {MAX_LEAD_MINUTES}）")
+    parser.add_argument("--credentials", help="服务账号 JSON 文件（默认读取环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml）")
+    parser.add_argument("--spreadsheet", default=progress_rows.SPREADSHEET_ID, help="进度表 ID")
+    args = parser.parse_args(argv)
+
+    if not args.now and not args.start:
+        parser.error("需要 --start 或 --now")
+    if args.lead > MAX_LEAD_MINUTES:
+        parser.error(f"--lead 最多 {MAX_LEAD_MINUTES} 分钟：更早预热的新学员记录在登录高峰到来前就会过期")
+    user_ids = read_roster(args.roster)
+    if not user_ids:
+        print("名单为空", file=sys.stderr)
+        return 2
+
+    if not args.now:
+        try:
+            start = parse_start(args.start)
+        except ValueError as e:
+            parser.error(str(e))
+        run_at = start - timedelta(minutes=args.lead)
+        delay = (run_at - datetime.now()).total_seconds()
+        if delay > 0:
+            print(f"{len(user_ids)} 名学员，{start:%Y-%m-%d %H:%M} 开课，将于 {run_at:%H:%M} 预热")
+            time.sleep(delay)
+
+    creds_dict = sheets_scheduler.load_credentials(args.credentials)
+    # 命令行预热不经过边车进程，直接访问云端（只有一次读取）
+    sheet = sheets_scheduler.authorize(creds_dict, use_sidecar=False).open_by_key(args.spreadsheet).sheet1
+    result = prewarm(sheet, user_ids)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
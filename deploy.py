@@ -0,0 +1,196 @@
+"""多进程部署：启动多个 Streamlit 工作进程、一个 Google Sheets 边车进程和本地负载均衡器（按客户端 IP 粘性分配）
+
+用法：
+    python deploy.py --workers 4 --port 8501
+
+- 负载均衡器监听 --port，按客户端 IP 的哈希把连接（包括 WebSocket）固定转发到同一个工作进程，会话状态留在该进程内；
+  工作进程不可用时顺延到下一个，会话可从共享的本地检查点恢复；
+- 题库索引只编译一次，放在共享内存（/dev/shm）中本次部署私有的临时目录里并签名，各工作进程校验后映射读取；
+- 边车进程独占 Sheets 连接：只认证一次、所有进程共用一份配额调度，并负责重试队列的写回；
+- 进度缓存、会话检查点和重试队列都在共享的 SQLite 文件中（.quiz_cache），各进程共用；
+- 任一子进程退出时自动重启，Ctrl+C 结束全部进程。
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import local_store
+import question_index
+import sheets_sidecar
+
+APP_PATH = Path(__file__).with_name("quiz_app.py")
+SIDECAR_PATH = Path(__file__).with_name("sheets_sidecar.py")
+RESTART_DELAY = 2  # 秒，子进程退出后等待多久重启
+
+
+def shared_index_dir(port):
+    """在 /dev/shm（内存文件系统）中创建本次部署私有的临时目录（mkdtemp 创建，权限 0700，名称不可预测），
+    没有 /dev/shm 时退回本地缓存目录"""
+    base = Path("/dev/shm") if Path("/dev/shm").is_dir() else local_store.CACHE_DIR
+    base.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f"quiz-index-{port}-", dir=base))
+
+
+# --- 粘性负载均衡（TCP 层转发，WebSocket 同样适用）---
+class StickyProxy:
+    def __init__(self, backends):
+        self.backends = backends  # [(host, port)]
+        self.connections = 0
+
+    def pick(self, client_ip):
+        "按客户端 IP 的哈希选择工作进程（不用内置 hash()，其结果在各进程间不一致）"
+        start = zlib.crc32(client_ip.encode()) % len(self.backends)
+        return [self.backends[(start + i) % len(self.backends)] for i in range(len(self.backends))]
+
+    async def handle(self, client_reader, client_writer):
+        client_ip = client_writer.get_extra_info("peername")[0]
+        for host, port in self.pick(client_ip):
+            try:
+                backend_reader, backend_writer = await asyncio.open_connection(host, port)
+                break
+            except OSError:
+                continue  # 该工作进程正在重启，顺延到下一个
+        else:
+            client_writer.close()
+            return
+        self.connections += 1
+        await asyncio.gather(
+            self._pipe(client_reader, backend_writer),
+            self._pipe(backend_reader, client_writer)
+        )
+
+    @staticmethod
+    async def _pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+
+# --- 子进程管理 ---
+class Supervisor:
+    "启动并看护子进程，退出的子进程自动重启"
+
+    def __init__(self, env):
+        self.env = env
+        self.commands = {}  # 名称 -> 命令行
+        self.processes = {}
+        self.restarts = {}
+
+    def add(self, name, command):
+        self.commands[name] = command
+        self.restarts[name] = 0
+        self._start(name)
+
+    def _start(self, name):
+        self.processes[name] = subprocess.Popen(self.commands[name], env=self.env)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(RESTART_DELAY)
+            for name, process in list(self.processes.items()):
+                if process.poll() is not None:
+                    print(f"{name} 已退出（返回码 {process.returncode}），正在重启", file=sys.stderr, flush=True)
+                    self.restarts[name] += 1
+                    self._start(name)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.time() + 10
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def serve(args, supervisor, backends):
+    proxy = StickyProxy(backends)
+    server = await asyncio.start_server(proxy.handle, args.host, args.port)
+    print(f"负载均衡器已启动：http://{args.host}:{args.port} -> {len(backends)} 个工作进程", flush=True)
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopped.set)
+        except NotImplementedError:
+            pass  # Windows 上由 KeyboardInterrupt 结束
+    async with server:
+        watcher = asyncio.create_task(supervisor.watch())
+        await stopped.wait()
+        watcher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程部署刷题系统")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Streamlit 工作进程数（默认 CPU 核数）")
+    parser.add_argument("--host", default="0.0.0.0", help="负载均衡器监听地址")
+    parser.add_argument("--port", type=int, default=8501, help="负载均衡器监听端口")
+    parser.add_argument("--worker-base-port", type=int, default=8600, help="工作进程从该端口起依次监听 127.0.0.1")
+    parser.add_argument("--credentials", help="服务账号 JSON 文件（默认读取环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml）")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    # 题库索引只编译一次并用随机密钥签名，工作进程启动时校验签名后直接映射读取
+    index_dir = shared_index_dir(args.port)
+    env[question_index.SHARED_INDEX_ENV] = str(index_dir)
+    env[question_index.SHARED_INDEX_KEY_ENV] = os.urandom(32).hex()
+    for name in (question_index.SHARED_INDEX_ENV, question_index.SHARED_INDEX_KEY_ENV):
+        os.environ[name] = env[name]
+    index = question_index.get_index()
+    print(f"题库索引已编译：{index['total']} 道题，版本 {index['version']}", flush=True)
+
+    # 进度缓存的内存层是进程私有的，多进程时会读到其他进程已更新的旧数据，只保留共享的 SQLite 层
+    env["QUIZ_PROGRESS_MEMORY_CACHE"] = "0"
+
+    socket_dir = tempfile.mkdtemp(prefix="quiz-sidecar-")
+    env[sheets_sidecar.ADDRESS_ENV] = os.path.join(socket_dir, "sheets.sock")
+    env[sheets_sidecar.AUTHKEY_ENV] = os.urandom(16).hex()
+
+    supervisor = Supervisor(env)
+    sidecar_command = [sys.executable, str(SIDECAR_PATH), "--address", env[sheets_sidecar.ADDRESS_ENV]]
+    if args.credentials:
+        sidecar_command += ["--credentials", args.credentials]
+    supervisor.add("sheets-sidecar", sidecar_command)
+
+    backends = []
+    for i in range(args.workers):
+        port = args.worker_base_port + i
+        backends.append(("127.0.0.1", port))
+        supervisor.add(f"worker-{i}", [
+            sys.executable, "-m", "streamlit", "run", str(APP_PATH),
+            "--server.address", "127.0.0.1", "--server.port", str(port), "--server.headless", "true"
+        ])
+
+    try:
+        asyncio.run(serve(args, supervisor, backends))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        shutil.rmtree(index_dir, ignore_errors=True)  # 释放共享内存中的编译索引
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
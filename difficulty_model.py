@@ -0,0 +1,230 @@
+"""自适应难度：离线从全员进度拟合题目难度（Rasch/IRT 单参数模型），在线按用户能力挑选难度相近的题目
+
+离线拟合（可放入 cron 每晚执行，结果写在题库旁边）：
+    python difficulty_model.py --credentials service_account.json
+    python difficulty_model.py --snapshot exports/progress-latest.npz   # 直接使用已导出的进度快照，不读取表格
+
+模型：用户 u 答对题目 q 的概率 P = sigmoid(能力θ_u - 难度b_q)。每个用户-题目对的观测取自进度：
+错题次数（error_counts）记为失败次数，已掌握再记一次成功；θ 和 b 都带标准正态先验，交替做牛顿迭代。
+
+模型文件只保存题目参数（不含用户ID），题目按难度升序排列：
+question_ids、difficulty（float32）、responses（作答人数），以及能力分布的均值和标准差（在线估计能力时作为先验）。
+"""
+import argparse
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import progress_export
+import progress_rows
+import question_index
+import sheets_scheduler
+
+MODEL_PATH = question_index.QUESTION_BANK_PATH.with_name("question_bank.difficulty.npz")
+PRIOR_PRECISION = 1.0  # 先验 N(0, 1) 的精度（方差的倒数）
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-4
+# 在线挑题：目标答对率约 70%，即难度比能力低 logit(0.7)；每道题的目标难度再加随机抖动，避免每批都是同一段题目
+TARGET_SUCCESS = 0.7
+TARGET_SPREAD = 0.6
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+# --- 离线拟合 ---
+def observations(status, error_counts):
+    "由进度快照的状态矩阵和错题次数矩阵得到 (成功次数, 失败次数) 矩阵（用户×题目）"
+    failures = error_counts.astype(np.float64)
+    # 错题本中但错题次数缺失（如旧版记录）至少算一次失败
+    failures[(status == progress_export.WRONG) & (failures == 0)] = 1.0
+    successes = (status == progress_export.MASTERED).astype(np.float64)
+    return successes, failures
+
+
+def fit(successes, failures, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    "交替牛顿迭代拟合 Rasch 模型（带先验的最大后验估计），返回 (能力, 难度)"
+    totals = successes + failures
+    ability = np.zeros(totals.shape[0])
+    difficulty = np.zeros(totals.shape[1])
+    for _ in range(max_iterations):
+        p = _sigmoid(ability[:, None] - difficulty[None, :])
+        info = totals * p * (1 - p)
+        step_ability = ((successes - totals * p).sum(axis=1) - PRIOR_PRECISION * ability) / (info.sum(axis=1) + PRIOR_PRECISION)
+        ability += step_ability
+
+        p = _sigmoid(ability[:, None] - difficulty[None, :])
+        info = totals * p * (1 - p)
+        step_difficulty = ((totals * p - successes).sum(axis=0) - PRIOR_PRECISION * difficulty) / (info.sum(axis=0) + PRIOR_PRECISION)
+        difficulty += step_difficulty
+
+        if max(np.abs(step_ability).max(initial=0), np.abs(step_difficulty).max(initial=0)) < tolerance:
+            break
+    return ability, difficulty
+
+
+def build_model(snapshot):
+    "由进度快照拟合模型，返回按难度升序排列的模型数组"
+    successes, failures = observations(snapshot['status'], snapshot['error_counts'])
+    ability, difficulty = fit(successes, failures)
+    # 只统计有作答记录的用户，避免新用户（全为先验 0）压低能力分布的方差
+    active = (successes + failures).sum(axis=1) > 0
+    order = np.argsort(difficulty, kind="stable")
+    return {
+        'question_ids': snapshot['question_ids'][order].astype(np.int64),
+        'difficulty': difficulty[order].astype(np.float32),
+        'responses': ((successes + failures) > 0).sum(axis=0)[order].astype(np.int32),
+        'ability_mean': np.array(float(ability[active].mean()) if active.any() else 0.0),
+        'ability_std': np.array(float(ability[active].std()) if active.sum() > 1 else 1.0),
+        'users': np.array(int(active.sum())),
+        'index_version': snapshot['index_version'],
+        'fitted_at': np.array(time.time())
+    }
+
+
+def save_model(path, model):
+    "先写临时文件再原子替换，运行中的进程按修改时间重新加载"
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **model)
+    os.replace(tmp_path, path)
+
+
+# --- 在线使用 ---
+_model_lock = threading.Lock()
+_loaded = {'mtime': None, 'model': None}
+_pools = {}  # (索引版本, 模型修改时间, 题目池名称) -> (按难度排序的题目, 难度列表)
+
+
+def load_model(path=MODEL_PATH):
+    "读取模型文件（进程内缓存，文件更新后自动重新加载）；没有模型文件时返回 None"
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    with _model_lock:
+        if _loaded['mtime'] != mtime:
+            with np.load(path, allow_pickle=False) as data:
+                model = {key: data[key] for key in data.files}
+            model['by_id'] = dict(zip(model['question_ids'].tolist(), model['difficulty'].tolist()))
+            _loaded['model'] = model
+            _loaded['mtime'] = mtime
+            _pools.clear()
+        return _loaded['model']
+
+
+def sorted_pool(index, pool_name, model):
+    """题目池（all / single_choice / multiple_choice）按难度升序排列，返回 (题目列表, 难度列表)。
+    每个索引版本只排序一次；模型中没有的新题按平均难度 0 处理"""
+    key = (index['version'], _loaded['mtime'], pool_name)
+    cached = _pools.get(key)
+    if cached is None:
+        by_id = model['by_id']
+        ranked = sorted(index[pool_name], key=lambda q: by_id.get(q['id'], 0.0))
+        cached = (ranked, [by_id.get(q['id'], 0.0) for q in ranked])
+        with _model_lock:
+            _pools[key] = cached
+    return cached
+
+
+def estimate_ability(model, correct_ids, error_counts, incorrect_ids=()):
+    "固定题目难度，由用户自己的进度估计能力（以全员能力分布为先验的牛顿迭代）"
+    by_id = model['by_id']
+    answered = set(correct_ids) | set(incorrect_ids) | {int(k) for k in error_counts if str(k).isdigit()}
+    answered = [q_id for q_id in answered if q_id in by_id]
+    mean = float(model['ability_mean'])
+    precision = 1.0 / max(float(model['ability_std']), 0.1) ** 2
+    if not answered:
+        return mean
+    difficulty = np.array([by_id[q_id] for q_id in answered])
+    failures = np.array([float(error_counts.get(str(q_id), 0)) for q_id in answered])
+    failures[(failures == 0) & np.array([q_id in incorrect_ids for q_id in answered])] = 1.0
+    successes = np.array([1.0 if q_id in correct_ids else 0.0 for q_id in answered])
+    totals = successes + failures
+    ability = mean
+    for _ in range(20):
+        p = _sigmoid(ability - difficulty)
+        step = ((successes - totals * p).sum() - precision * (ability - mean)) / ((totals * p * (1 - p)).sum() + precision)
+        ability += step
+        if abs(step) < TOLERANCE:
+            break
+    return float(ability)
+
+
+def target_difficulty(ability):
+    "让答对率约为 TARGET_SUCCESS 的题目难度"
+    return ability - math.log(TARGET_SUCCESS / (1 - TARGET_SUCCESS))
+
+
+def _free(links, i):
+    "沿已选位置的跳转链找到最近的未选位置，并把路径压缩为直接指向它（并查集）"
+    root = i
+    while root in links:
+        root = links[root]
+    while i != root:
+        links[i], i = root, links[i]
+    return root
+
+
+def pick_near(questions, difficulties, target, count, rng):
+    """从按难度排序的题目中挑出 count 道难度接近 target 的题：每道题在难度列表上二分查找一次（抖动后的目标难度），
+    取两侧最近的未选题目。已选位置用两个带路径压缩的并查集（向左、向右的下一个未选位置）跳过，
+    不会在已选的连续区间上逐个走过，总复杂度约 O(count·log n)"""
+    if count >= len(questions):
+        return list(questions)
+    next_left = {}  # 已选位置 -> 其左侧的候选位置
+    next_right = {}  # 已选位置 -> 其右侧的候选位置
+    picked = []
+    for _ in range(count):
+        wanted = rng.gauss(target, TARGET_SPREAD)
+        right = bisect.bisect_left(difficulties, wanted)
+        left = _free(next_left, right - 1) if right > 0 else -1
+        right = _free(next_right, right) if right < len(questions) else right
+        # 两侧取难度更接近的一侧
+        if right >= len(questions) or (left >= 0 and wanted - difficulties[left] <= difficulties[right] - wanted):
+            choice = left
+        else:
+            choice = right
+        next_left[choice] = choice - 1
+        next_right[choice] = choice + 1
+        picked.append(questions[choice])
+    return picked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="由全员进度离线拟合题目难度模型")
+    parser.add_argument("--credentials", help="服务账号 JSON 文件（默认读取环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml）")
+    parser.add_argument("--spreadsheet", default=progress_rows.SPREADSHEET_ID, help="进度表 ID")
+    parser.add_argument("--snapshot", help="使用 progress_export.py 导出的快照文件，不读取表格")
+    parser.add_argument("--out", default=str(MODEL_PATH), help="模型文件路径（默认放在题库旁边）")
+    args = parser.parse_args(argv)
+
+    index = question_index.get_index()
+    started = time.time()
+    if args.snapshot:
+        snapshot = progress_export.load_snapshot(args.snapshot)
+    else:
+        with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+            sheet = progress_export.open_progress_sheet(args.credentials, args.spreadsheet)
+            snapshot, _ = progress_export.full_export(sheet, index)
+
+    model = build_model(snapshot)
+    save_model(args.out, model)
+    print(
+        f"已拟合 {len(model['question_ids'])} 道题的难度（{int(model['users'])} 名用户），"
+        f"能力均值 {float(model['ability_mean']):.2f}，标准差 {float(model['ability_std']):.2f}，"
+        f"用时 {time.time() - started:.1f} 秒 -> {args.out}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
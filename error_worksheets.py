@@ -0,0 +1,266 @@
+"""错题练习卷批量生成：一次读取全员进度，为每名学员生成可打印的错题练习卷（按错误次数排序，答案单独成页），
+在进程池中并行渲染，边生成边写入同一个 zip 文件，不在内存中保留全部文档
+
+用法：
+    python error_worksheets.py --credentials service_account.json --out worksheets.zip
+    python error_worksheets.py --snapshot exports/progress-latest.npz --roster roster.txt --max-questions 40
+    python error_worksheets.py --snapshot exports/progress-latest.npz --format pdf     # 需要安装 weasyprint
+
+zip 中每名学员一个文件（<用户ID>-<行号>.html/.pdf），另有 index.csv 列出每个文件的学员和题数；
+结束时输出吞吐量（份/秒、MB/秒）以及主进程和工作进程的内存峰值。
+"""
+import argparse
+import csv
+import html
+import io
+import json
+import os
+import re
+import resource
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import progress_export
+import progress_rows
+import question_index
+import render_cache
+import sheets_scheduler
+
+IN_FLIGHT_PER_WORKER = 2  # 每个工作进程最多排队的文档数，限制已渲染未写出的文档占用的内存
+_UNSAFE_NAME = re.compile(r'[\\/:*?"<>|\s]+')
+
+PAGE_STYLE = """
+@page { size: A4; margin: 16mm 14mm; }
+body { font-family: "Noto Sans CJK SC", "Microsoft YaHei", sans-serif; font-size: 11pt; line-height: 1.5; color: #222; }
+h1 { font-size: 16pt; margin: 0 0 4pt; }
+.meta { color: #555; margin: 0 0 12pt; }
+.question { page-break-inside: avoid; margin-bottom: 10pt; }
+.stem { margin: 0 0 3pt; }
+.tag { font-size: 9pt; color: #a33; margin-left: 6pt; }
+.options { list-style: none; margin: 0; padding-left: 14pt; }
+.blank { margin: 3pt 0 0 14pt; color: #777; }
+.key { page-break-before: always; }
+table { border-collapse: collapse; width: 100%; font-size: 10pt; }
+th, td { border: 1px solid #bbb; padding: 2pt 6pt; text-align: left; }
+"""
+
+
+# --- 任务准备（主进程）---
+def iter_tasks(snapshot, user_filter=None, max_questions=0):
+    """逐个产出学员的渲染任务 (用户ID, 行号, [(题目ID, 错误次数, 上次错误答案), ...])，
+    错题按错误次数降序、同次数按题库顺序；错题本为空的学员跳过"""
+    question_ids = snapshot['question_ids'].tolist()
+    wrong_by_user = {}
+    for user_idx, col, answer in zip(
+        snapshot['last_wrong_user'].tolist(), snapshot['last_wrong_question'].tolist(), snapshot['last_wrong_answer'].tolist()
+    ):
+        wrong_by_user.setdefault(user_idx, {})[col] = answer
+    for user_idx, user_id in enumerate(snapshot['users'].tolist()):
+        if user_filter is not None and user_id not in user_filter:
+            continue
+        counts = snapshot['error_counts'][user_idx]
+        cols = np.flatnonzero(counts)
+        if not len(cols):
+            continue
+        # 稳定排序：错误次数降序，同次数保持题库顺序
+        cols = cols[np.argsort(-counts[cols].astype(np.int64), kind="stable")]
+        if max_questions:
+            cols = cols[:max_questions]
+        last_wrong = wrong_by_user.get(user_idx, {})
+        items = [(question_ids[col], int(counts[col]), last_wrong.get(col, "")) for col in cols.tolist()]
+        yield user_id, int(snapshot['rows'][user_idx]), items
+
+
+def document_name(user_id, row_number, fmt):
+    "zip 内的文件名（用户ID中的路径分隔符等字符替换为下划线，加行号避免重名）"
+    return f"{_UNSAFE_NAME.sub('_', user_id).strip('._') or 'user'}-{row_number}.{fmt}"
+
+
+# --- 渲染（工作进程）---
+_index = None
+
+
+def _init_worker():
+    global _index
+    _index = question_index.get_index()
+
+
+def answer_letters(question):
+    return "".join(sorted(question['answer']))
+
+
+def wrong_letters(last_wrong):
+    "快照中的上次错误答案（单选为选项文本，多选为选项列表的 JSON）转为选项字母"
+    if not last_wrong:
+        return ""
+    if last_wrong.startswith("["):
+        try:
+            return "".join(sorted(render_cache.option_letter(opt) for opt in json.loads(last_wrong)))
+        except (ValueError, TypeError, AttributeError):
+            return last_wrong
+    return render_cache.option_letter(last_wrong)
+
+
+def render_html(user_id, items, index, generated_at):
+    "渲染一名学员的练习卷 HTML（题目页 + 答案页），items 中不在当前题库的题目跳过"
+    questions = []
+    for q_id, count, last_wrong in items:
+        question = index['by_id'].get(q_id)
+        if question is not None:
+            questions.append((question, count, last_wrong))
+    parts = [
+        '<!DOCTYPE html><html lang="zh-CN"><head><meta charset="utf-8">',
+        f"<title>错题练习卷 - {html.escape(user_id)}</title><style>{PAGE_STYLE}</style></head><body>",
+        "<h1>错题练习卷</h1>",
+        f'<p class="meta">学员：{html.escape(user_id)}　生成日期：{generated_at}　共 {len(questions)} 题（按错误次数从多到少排列）</p>'
+    ]
+    for number, (question, count, _) in enumerate(questions, start=1):
+        kind = "多选" if question['is_multiple'] else "单选"
+        parts.append(
+            f'<div class="question"><p class="stem"><b>{number}.</b> [{kind}] {html.escape(question["question"])}'
+            f'<span class="tag">错 {count} 次</span></p><ul class="options">'
+        )
+        parts.extend(f"<li>{html.escape(opt)}</li>" for opt in question['options'])
+        parts.append('</ul><p class="blank">答：________</p></div>')
+    parts.append('<section class="key"><h1>答案页</h1><table><tr><th>题号</th><th>正确答案</th><th>上次错选</th><th>解析</th></tr>')
+    for number, (question, _, last_wrong) in enumerate(questions, start=1):
+        parts.append(
+            f"<tr><td>{number}</td><td>{answer_letters(question)}</td>"
+            f"<td>{html.escape(wrong_letters(last_wrong))}</td><td>{html.escape(question.get('explanation') or '')}</td></tr>"
+        )
+    parts.append("</table></section></body></html>")
+    return "".join(parts), len(questions)
+
+
+def render_task(task, fmt, generated_at):
+    "渲染一份文档，返回 (文件名, 用户ID, 题数, 文档字节, 本工作进程内存峰值KB)"
+    user_id, row_number, items = task
+    page, count = render_html(user_id, items, _index, generated_at)
+    if fmt == "pdf":
+        import weasyprint
+        data = weasyprint.HTML(string=page).write_pdf()
+    else:
+        data = page.encode("utf-8")
+    return document_name(user_id, row_number, fmt), user_id, count, data, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# --- 生成 zip ---
+def _write_archive(tmp_path, tasks, fmt, jobs, generated_at, stats):
+    "进程池渲染并逐份写入 zip，只保留有限个已提交未写出的任务"
+    listing = []
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        pending = set()
+        tasks = iter(tasks)
+        exhausted = False
+
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) < jobs * IN_FLIGHT_PER_WORKER:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    return
+                pending.add(pool.submit(render_task, task, fmt, generated_at))
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                name, user_id, count, data, worker_peak = future.result()
+                archive.writestr(name, data)
+                listing.append((name, user_id, count))
+                stats['documents'] += 1
+                stats['questions'] += count
+                stats['raw_bytes'] += len(data)
+                stats['worker_peak_kb'] = max(stats['worker_peak_kb'], worker_peak)
+            fill()
+
+        index_csv = io.StringIO()
+        writer = csv.writer(index_csv)
+        writer.writerow(["file", "user_id", "questions"])
+        writer.writerows(sorted(listing, key=lambda item: item[1]))
+        archive.writestr("index.csv", "\ufeff" + index_csv.getvalue())  # 带 BOM，Excel 可直接打开
+
+
+def write_zip(tasks, out_path, fmt="html", jobs=None):
+    """在进程池中渲染 tasks，按完成顺序流式写入 zip；同时在途的文档数有上限，内存占用与学员总数无关。
+    返回统计"""
+    jobs = jobs or os.cpu_count() or 1
+    generated_at = time.strftime("%Y-%m-%d")
+    stats = {'documents': 0, 'questions': 0, 'raw_bytes': 0, 'worker_peak_kb': 0}
+    started = time.time()
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        _write_archive(tmp_path, tasks, fmt, jobs, generated_at, stats)
+    except BaseException:
+        # 渲染失败或被中断时不留下不完整的 zip
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+
+    stats['seconds'] = time.time() - started
+    stats['zip_bytes'] = os.path.getsize(out_path)
+    stats['main_peak_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成全员错题练习卷（进程池渲染，流式写入 zip）")
+    parser.add_argument("--credentials", help="服务账号 JSON 文件（默认读取环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml）")
+    parser.add_argument("--spreadsheet", default=progress_rows.SPREADSHEET_ID, help="进度表 ID")
+    parser.add_argument("--snapshot", help="使用 progress_export.py 导出的快照文件，不读取表格")
+    parser.add_argument("--roster", help="只为名单中的学员生成（每行一个用户ID）")
+    parser.add_argument("--max-questions", type=int, default=0, help="每份练习卷最多题数（0 为全部错题）")
+    parser.add_argument("--format", choices=("html", "pdf"), default="html", help="文档格式（pdf 需要安装 weasyprint）")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="渲染进程数")
+    parser.add_argument("--out", default="worksheets.zip", help="输出 zip 文件")
+    args = parser.parse_args(argv)
+
+    if args.format == "pdf":
+        try:
+            import weasyprint  # noqa: F401
+        except ImportError:
+            parser.error("生成 PDF 需要安装 weasyprint（pip install weasyprint），或使用 --format html 后由浏览器打印")
+
+    index = question_index.get_index()
+    started = time.time()
+    if args.snapshot:
+        snapshot = progress_export.load_snapshot(args.snapshot)
+    else:
+        # 一次读取整张进度表，流式解码为快照
+        with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+            sheet = progress_export.open_progress_sheet(args.credentials, args.spreadsheet)
+            snapshot, _ = progress_export.full_export(sheet, index)
+    if str(snapshot['index_version']) != index['version']:
+        print("快照与当前题库版本不同，已不在题库中的题目将被跳过", file=sys.stderr)
+    loaded = time.time() - started
+
+    user_filter = None
+    if args.roster:
+        import class_prewarm
+        user_filter = set(class_prewarm.read_roster(args.roster))
+    tasks = iter_tasks(snapshot, user_filter, args.max_questions)
+    stats = write_zip(tasks, args.out, args.format, args.jobs)
+
+    seconds = max(stats['seconds'], 1e-9)
+    print(
+        f"读取进度 {len(snapshot['users'])} 名学员用时 {loaded:.1f} 秒；生成 {stats['documents']} 份练习卷"
+        f"（{stats['questions']} 题）用时 {stats['seconds']:.1f} 秒 -> {args.out}"
+    )
+    print(
+        f"吞吐量：{stats['documents'] / seconds:.1f} 份/秒，{stats['raw_bytes'] / seconds / 1024 / 1024:.2f} MB/秒"
+        f"（文档合计 {stats['raw_bytes'] / 1024 / 1024:.1f} MB，压缩后 {stats['zip_bytes'] / 1024 / 1024:.1f} MB）"
+    )
+    print(f"内存峰值：主进程 {stats['main_peak_kb'] / 1024:.0f} MB，单个工作进程 {stats['worker_peak_kb'] / 1024:.0f} MB（{args.jobs} 个）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
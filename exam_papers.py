@@ -0,0 +1,211 @@
+"""模拟考试：按约束组卷、后台预生成试卷缓存、整卷向量化评分"""
+import random
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# --- 考试配置 ---
+# size: 每卷题数; multiple_count: 其中多选题数; segments: 无章节字段时按题号顺序划分的覆盖段数;
+# history_depth: 不与最近N套试卷重复; time_limit_min: 考试时长（分钟）
+ExamConfig = namedtuple("ExamConfig", "size multiple_count segments history_depth time_limit_min")
+DEFAULT_EXAM_CONFIG = ExamConfig(size=100, multiple_count=10, segments=10, history_depth=3, time_limit_min=90)
+
+PREFETCH_PER_USER = 2  # 每个用户预生成的试卷数量
+MAX_CACHED_USERS = 200  # 预生成缓存和最近试卷记录最多保留的用户数
+
+
+# --- 答案编码（字母 -> 位掩码，便于整卷向量化比较）---
+def letters_to_mask(letters):
+    "把答案字母（字符串或集合）编码为位掩码：A=1, B=2, C=4 ..."
+    if isinstance(letters, str):
+        letters = [letters]
+    mask = 0
+    for letter in letters:
+        letter = str(letter).strip().upper()
+        if len(letter) == 1 and "A" <= letter <= "Z":
+            mask |= 1 << (ord(letter) - ord("A"))
+    return mask
+
+
+# --- 组卷 ---
+def _strata(questions, segments):
+    "按章节字段分层；题库没有章节时按题号顺序等分为若干段，保证各部分都有覆盖"
+    if any(q.get('topic') for q in questions):
+        groups = OrderedDict()
+        for q in questions:
+            groups.setdefault(q.get('topic') or '', []).append(q)
+        return list(groups.values())
+    ordered = sorted(questions, key=lambda q: q['id'])
+    segments = max(1, min(segments, len(ordered)))
+    step = len(ordered) / segments
+    return [ordered[int(i * step):int((i + 1) * step)] for i in range(segments)]
+
+
+def _stratified_sample(pool, count, segments, rng):
+    "按各层大小比例（最大余数法）分配题数后在层内随机抽样"
+    count = min(count, len(pool))
+    if count <= 0:
+        return []
+    strata = [s for s in _strata(pool, segments) if s]
+    total = sum(len(s) for s in strata)
+    quotas = [count * len(s) / total for s in strata]
+    alloc = [int(x) for x in quotas]
+    by_remainder = sorted(range(len(strata)), key=lambda i: quotas[i] - alloc[i], reverse=True)
+    for i in by_remainder[:count - sum(alloc)]:
+        alloc[i] += 1
+    picked = []
+    for stratum, n in zip(strata, alloc):
+        picked.extend(rng.sample(stratum, min(n, len(stratum))))
+    return picked
+
+
+def generate_paper(index, config=DEFAULT_EXAM_CONFIG, exclude_ids=(), seed=None):
+    "生成一套试卷：满足单选/多选配比和覆盖面约束，尽量避开 exclude_ids 中的题目"
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    rng = random.Random(seed)
+    exclude_ids = set(exclude_ids)
+
+    multiple_count = min(config.multiple_count, config.size)
+    picked = []
+    for pool, count in ((index['multiple_choice'], multiple_count),
+                        (index['single_choice'], config.size - multiple_count)):
+        fresh = [q for q in pool if q['id'] not in exclude_ids]
+        chosen = _stratified_sample(fresh, count, config.segments, rng)
+        if len(chosen) < count:
+            # 新题不足时才用最近试卷中出现过的题目补齐
+            chosen_ids = {q['id'] for q in chosen}
+            reused = [q for q in pool if q['id'] not in chosen_ids]
+            chosen.extend(rng.sample(reused, min(count - len(chosen), len(reused))))
+        picked.extend(chosen)
+
+    # 按题号排序，单选在前、多选在后，与正式考试卷面一致
+    picked.sort(key=lambda q: (q['is_multiple'], q['id']))
+    return build_paper(index, [q['id'] for q in picked], f"{index['version']}-{seed:08x}", seed, config)
+
+
+def build_paper(index, question_ids, paper_id, seed, config=DEFAULT_EXAM_CONFIG):
+    "由题目ID列表组装试卷（评分用的题型和答案掩码取自索引）；也用于从会话检查点恢复进行中的考试"
+    picked = [index['by_id'][q_id] for q_id in question_ids if q_id in index['by_id']]
+    return {
+        'paper_id': paper_id,
+        'index_version': index['version'],
+        'seed': seed,
+        'question_ids': [q['id'] for q in picked],
+        'is_multiple': np.array([q['is_multiple'] for q in picked], dtype=bool),
+        'answer_masks': np.array([letters_to_mask(q['answer']) for q in picked], dtype=np.uint32),
+        'config': config,
+        'created_at': time.time()
+    }
+
+
+# --- 评分 ---
+def grade_paper(paper, answers):
+    "整卷一次性评分：answers 为 {题目ID: 选中的字母或字母集合}，未作答视为错误"
+    user_masks = np.fromiter(
+        (letters_to_mask(answers.get(q_id, ())) for q_id in paper['question_ids']),
+        dtype=np.uint32, count=len(paper['question_ids'])
+    )
+    correct = user_masks == paper['answer_masks']
+    answered = user_masks != 0
+    is_multiple = paper['is_multiple']
+    total = len(correct)
+    score = int(correct.sum())
+    return {
+        'paper_id': paper['paper_id'],
+        'total': total,
+        'score': score,
+        'accuracy': round(score / total * 100, 1) if total else 0.0,
+        'answered': int(answered.sum()),
+        'single_correct': int((correct & ~is_multiple).sum()),
+        'single_total': int((~is_multiple).sum()),
+        'multiple_correct': int((correct & is_multiple).sum()),
+        'multiple_total': int(is_multiple.sum()),
+        'wrong_ids': [q_id for q_id, ok in zip(paper['question_ids'], correct.tolist()) if not ok]
+    }
+
+
+# --- 后台预生成试卷池 ---
+class PaperPool:
+    "按（用户, 题库版本, 配置）预生成试卷，开始考试时直接取用"
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="exam-paper")
+        self._lock = threading.Lock()
+        self._ready = OrderedDict()  # (user_id, version, config) -> deque[Future]
+        self._history = OrderedDict()  # user_id -> deque[set(题目ID)]（最近N套试卷），按最近使用排序
+        self._history_loading = {}  # user_id -> Future（只保留尚未完成的读取）
+
+    def _remember_history(self, user_id, recent):
+        "记入用户的最近试卷（调用方持有锁），超过 MAX_CACHED_USERS 时淘汰最久未用的用户"
+        self._history[user_id] = recent
+        self._history.move_to_end(user_id)
+        while len(self._history) > MAX_CACHED_USERS:
+            self._history.popitem(last=False)
+
+    def _history_exclude(self, user_id, config):
+        recent = self._history.get(user_id, ())
+        if not recent or config.history_depth <= 0:
+            return set()
+        return set().union(*list(recent)[-config.history_depth:])
+
+    def _submit(self, user_id, index, config, ahead):
+        "提交一个组卷任务；ahead 为队列中排在前面的试卷，本卷同样避开它们"
+        history_future = self._history_loading.get(user_id)
+        ahead = list(ahead)
+
+        def _job():
+            if history_future is not None:
+                history_future.result()
+            exclude = set()
+            for future in ahead:
+                exclude.update(future.result()['question_ids'])
+            with self._lock:
+                exclude |= self._history_exclude(user_id, config)
+            return generate_paper(index, config, exclude)
+        return self._executor.submit(_job)
+
+    def prefetch(self, user_id, index, config=DEFAULT_EXAM_CONFIG, history_loader=None):
+        "为用户预生成试卷；history_loader 按时间顺序返回最近试卷的题目ID列表，只在首次调用时后台执行一次"
+        key = (user_id, index['version'], config)
+        with self._lock:
+            if history_loader is not None and user_id not in self._history and user_id not in self._history_loading:
+                def _load_history():
+                    try:
+                        papers = history_loader()
+                    except Exception:
+                        papers = []
+                    with self._lock:
+                        recent = deque((set(ids) for ids in papers), maxlen=max(config.history_depth, 1))
+                        recent.extend(self._history.get(user_id, ()))
+                        self._remember_history(user_id, recent)
+                        self._history_loading.pop(user_id, None)
+                self._history_loading[user_id] = self._executor.submit(_load_history)
+            queue = self._ready.setdefault(key, deque())
+            self._ready.move_to_end(key)
+            while len(queue) < PREFETCH_PER_USER:
+                queue.append(self._submit(user_id, index, config, queue))
+            while len(self._ready) > MAX_CACHED_USERS:
+                self._ready.popitem(last=False)
+
+    def take(self, user_id, index, config=DEFAULT_EXAM_CONFIG):
+        "取出一套已生成的试卷（缓存为空时同步生成），并补充预生成队列"
+        key = (user_id, index['version'], config)
+        with self._lock:
+            queue = self._ready.get(key)
+            future = queue.popleft() if queue else None
+            recent_ids = self._history_exclude(user_id, config)
+        paper = future.result() if future is not None else generate_paper(index, config, recent_ids)
+        with self._lock:
+            # 记入最近试卷；队列中剩余的试卷生成时已避开本卷，可继续使用
+            recent = self._history.get(user_id) or deque(maxlen=max(config.history_depth, 1))
+            recent.append(set(paper['question_ids']))
+            self._remember_history(user_id, recent)
+        self.prefetch(user_id, index, config)
+        return paper
+
+
+paper_pool = PaperPool()
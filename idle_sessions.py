@@ -0,0 +1,144 @@
+"""空闲会话回收：超时后保存进度、把紧凑会话状态落盘并释放内存"""
+import threading
+import time
+import weakref
+
+import local_store
+
+# 回收后仍保留在会话中的键：保留登录状态和设备ID，用户返回时直接从本设备的本地检查点恢复
+KEEP_KEYS = ("user_id", "device_id")
+
+
+class StateView:
+    "为 Streamlit 内部的 SafeSessionState 提供与 st.session_state 一致的字典接口，供后台线程使用"
+
+    def __init__(self, state):
+        self._state = state
+
+    def __getitem__(self, key):
+        return self._state[key]
+
+    def __setitem__(self, key, value):
+        self._state[key] = value
+
+    def __delitem__(self, key):
+        del self._state[key]
+
+    def __contains__(self, key):
+        return key in self._state
+
+    def get(self, key, default=None):
+        try:
+            return self._state[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._state.filtered_state.keys())
+
+
+class IdleSessionManager:
+    "记录各会话最近活跃时间，后台线程定期回收超时的会话"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # session_id -> {'user_id', 'last_active', 'state_ref'}
+        self._thread = None
+        self._timeout = None
+        self._flush = None
+        self._on_evicted = None
+        self.evicted_count = 0
+
+    def start(self, timeout, flush, on_evicted=None, interval=60):
+        "启动回收线程；flush(state_view) 负责把进度强制保存到云端，成功返回 True"
+        with self._lock:
+            self._timeout = timeout
+            self._flush = flush
+            self._on_evicted = on_evicted
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="idle-session-sweeper", daemon=True)
+            self._thread.start()
+
+    def touch(self, session_id, user_id, state):
+        """会话每次重跑开始时（读取任何会话状态之前）调用，刷新最近活跃时间；
+        该会话正在被回收时等待回收完成，之后本次重跑看到的是已回收的状态（从本地检查点恢复）"""
+        while True:
+            with self._lock:
+                entry = self._sessions.get(session_id)
+                if entry is None or entry['state_ref']() is not state:
+                    entry = {'state_ref': weakref.ref(state), 'guard': threading.Lock(), 'user_id': user_id, 'last_active': time.time()}
+                    self._sessions[session_id] = entry
+            with entry['guard']:
+                with self._lock:
+                    if self._sessions.get(session_id) is not entry:
+                        continue  # 等待期间该会话已被回收，重新登记
+                    entry['user_id'] = user_id
+                    entry['last_active'] = time.time()
+                return
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def active_count(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.sweep()
+
+    def sweep(self):
+        "回收所有超时会话，返回本次回收的数量"
+        if self._timeout is None:
+            return 0
+        cutoff = time.time() - self._timeout
+        with self._lock:
+            idle = [(sid, e) for sid, e in self._sessions.items() if e['last_active'] < cutoff]
+        evicted = 0
+        for session_id, entry in idle:
+            if self._evict(session_id, entry):
+                evicted += 1
+        self.evicted_count += evicted
+        return evicted
+
+    def _evict(self, session_id, entry):
+        state = entry['state_ref']()
+        if state is None:
+            # 会话已被 Streamlit 销毁
+            self.forget(session_id)
+            return False
+        view = StateView(state)
+        if 'all_questions' not in view:
+            self.forget(session_id)
+            return False
+        # 持有会话的回收锁直到删除完成：期间开始的重跑在 touch 中等待，不会读到删除了一半的状态
+        with entry['guard']:
+            if entry['last_active'] >= time.time() - self._timeout:
+                return False  # 进入回收前会话已有新操作
+            try:
+                # 先强制保存进度，保存失败则保留会话在内存中，下次再试
+                if not self._flush(view):
+                    return False
+                device_id = local_store.ensure_device_id(view)
+                local_store.checkpoints.snapshot(entry["user_id"], device_id, local_store.pack_session(view))
+            except Exception:
+                return False
+            with self._lock:
+                if self._sessions.get(session_id) is not entry:
+                    return False
+                self._sessions.pop(session_id, None)
+            for key in view.keys():
+                if key not in KEEP_KEYS:
+                    try:
+                        del view[key]
+                    except KeyError:
+                        pass
+        if self._on_evicted is not None:
+            self._on_evicted(session_id)
+        return True
+
+
+manager = IdleSessionManager()
@@ -0,0 +1,404 @@
+"""本地持久化存储（SQLite）：会话检查点的写入与恢复、保存失败的进度重试队列"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import progress_crdt
+import question_index
+
+CACHE_DIR = Path(os.environ.get("QUIZ_CACHE_DIR") or Path(__file__).with_name(".quiz_cache"))
+
+PROGRESS_KEYS = ("correct_ids", "incorrect_ids", "error_counts", "last_wrong_answers")
+
+
+# --- SQLite 连接 ---
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def connect(name):
+    "获取指定数据库文件的共享连接（进程内复用，调用方需持有 db_lock(name)）"
+    with _connections_lock:
+        if name not in _connections:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(CACHE_DIR / name, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _connections[name] = (conn, threading.Lock())
+        return _connections[name][0]
+
+
+def db_lock(name):
+    connect(name)
+    return _connections[name][1]
+
+
+def ensure_device_id(state):
+    "会话的设备ID（CRDT 作答记录和本地检查点都按设备区分），没有时生成"
+    if not state.get('device_id'):
+        state['device_id'] = uuid.uuid4().hex[:8]
+    return state['device_id']
+
+
+# --- 作答结果应用 ---
+def apply_answer(progress, question_id, is_correct, user_answer):
+    "把一次作答结果应用到进度数据上（progress 可以是会话状态或进度字典）"
+    q_key = str(question_id)
+    if is_correct:
+        progress["correct_ids"].add(question_id)
+        progress["incorrect_ids"].discard(question_id)
+        progress["error_counts"].pop(q_key, None)
+        progress["last_wrong_answers"].pop(q_key, None)
+    else:
+        progress["incorrect_ids"].add(question_id)
+        progress["correct_ids"].discard(question_id)
+        progress["error_counts"][q_key] = progress["error_counts"].get(q_key, 0) + 1
+        progress["last_wrong_answers"][q_key] = user_answer
+
+
+def replay_event(payload, event):
+    "把检查点事件重放到打包的会话状态上（'a' 为作答，按事件记录的设备记入 CRDT 状态；'p' 为翻页）"
+    if event['t'] == 'a':
+        progress = payload['progress']
+        for key in ("correct_ids", "incorrect_ids"):
+            if not isinstance(progress[key], set):
+                progress[key] = set(progress[key])
+        apply_answer(progress, event['q'], event['ok'], event['ans'])
+        if payload.get('crdt') is not None:
+            progress_crdt.record(payload['crdt'], event['q'], event['ok'], event.get('d') or payload['device_id'], event.get('ts'))
+        payload['submitted_answers'].append([event['q'], event['ans']])
+        payload['answer_count'] += 1
+    elif event['t'] == 'p':
+        payload['current_question_idx'] = event['i']
+
+
+# --- 紧凑会话状态（批次ID、答题位置、已提交答案和进度）---
+def pack_exam(exam):
+    "进行中的模拟考试只存试卷题目ID、时间和截止前记录的答案（评分数据恢复时由题库索引重建）"
+    if not exam:
+        return None
+    paper = exam['paper']
+    return {
+        'paper_id': paper['paper_id'],
+        'seed': paper['seed'],
+        'question_ids': list(paper['question_ids']),
+        'started_at': exam['started_at'],
+        'deadline': exam['deadline'],
+        'answers': [[q_id, letters] for q_id, letters in exam['answers'].items()]
+    }
+
+
+def unpack_exam(packed, index, mapping):
+    if not packed:
+        return None
+    import exam_papers  # 延迟导入（依赖 NumPy），只有考试进行中被回收的会话需要
+    question_ids = [mapping.get(q_id, q_id) for q_id in packed['question_ids']]
+    return {
+        'paper': exam_papers.build_paper(index, question_ids, packed['paper_id'], packed['seed']),
+        'started_at': packed['started_at'],
+        'deadline': packed['deadline'],
+        'answers': {mapping.get(q_id, q_id): letters for q_id, letters in packed['answers']}
+    }
+
+
+def pack_session(state):
+    "把会话状态压缩为可落盘的字典：批次只存题目ID，不存题目内容"
+    return {
+        'user_id': state['user_id'],
+        'user_row_id': state.get('user_row_id'),
+        'index_version': state.get('index_version'),
+        'current_mode': state.get('current_mode', "normal"),
+        'question_type': state.get('question_type_select', '全部题目'),
+        'batch_ids': [q['id'] for q in state.get('current_batch', [])],
+        'current_question_idx': state.get('current_question_idx', 0),
+        'quiz_finished': state.get('quiz_finished', False),
+        'submitted_answers': [[q_id, answer] for q_id, answer in state.get('submitted_answers', {}).items()],
+        'answer_count': state.get('answer_count', 0),
+        'last_saved_fingerprint': state.get('last_saved_fingerprint'),
+        'progress_revision': state.get('progress_revision', 0),
+        'device_id': state.get('device_id'),
+        'crdt': state.get('progress_crdt'),
+        'exam': pack_exam(state.get('exam')),
+        'exam_result': state.get('exam_result'),
+        'progress': {
+            "correct_ids": sorted(state["correct_ids"]),
+            "incorrect_ids": sorted(state["incorrect_ids"]),
+            "error_counts": state["error_counts"],
+            "last_wrong_answers": state["last_wrong_answers"]
+        },
+        'saved_at': time.time()
+    }
+
+
+def unpack_session(state, payload, index):
+    "把落盘的会话状态恢复到会话中；题库版本变化时按迁移映射改写题目ID"
+    mapping = {}
+    if payload.get('index_version') != index['version']:
+        mapping = question_index.migration_map(payload.get('index_version'))
+
+    progress_data = {
+        "correct_ids": set(payload['progress']["correct_ids"]),
+        "incorrect_ids": set(payload['progress']["incorrect_ids"]),
+        "error_counts": dict(payload['progress']["error_counts"]),
+        "last_wrong_answers": dict(payload['progress']["last_wrong_answers"])
+    }
+    question_index.remap_progress(progress_data, mapping)
+    for key in PROGRESS_KEYS:
+        state[key] = progress_data[key]
+    # 旧检查点没有 CRDT 状态时由进度数据转换
+    if payload.get('crdt') is not None:
+        state['progress_crdt'] = progress_crdt.remap(payload['crdt'], mapping)
+    else:
+        state['progress_crdt'] = progress_crdt.from_progress(progress_data)
+
+    by_id = index['by_id']
+    batch_ids = [mapping.get(q_id, q_id) for q_id in payload['batch_ids']]
+    state['current_batch'] = [by_id[q_id] for q_id in batch_ids if q_id in by_id]
+    state['current_question_idx'] = min(payload['current_question_idx'], len(state['current_batch']))
+    state['submitted_answers'] = {mapping.get(q_id, q_id): answer for q_id, answer in payload['submitted_answers']}
+    state['quiz_finished'] = payload['quiz_finished']
+    state['current_mode'] = payload['current_mode']
+    state['user_row_id'] = payload['user_row_id']
+    state['answer_count'] = payload['answer_count']
+    state['last_saved_fingerprint'] = payload['last_saved_fingerprint']
+    state['progress_revision'] = payload.get('progress_revision', 0)
+    state['index_version'] = index['version']
+    # 同一会话（空闲回收后恢复）沿用原设备ID；新会话已分配自己的设备ID，只继承检查点的内容
+    if not state.get('device_id') and payload.get('device_id'):
+        state['device_id'] = payload['device_id']
+    state['exam'] = unpack_exam(payload.get('exam'), index, mapping)
+    state['exam_result'] = payload.get('exam_result')
+    if 'question_type_select' not in state:
+        state['question_type_select'] = payload['question_type']
+    return state
+
+
+# --- 会话检查点存储（快照 + 追加式作答事件）---
+class SessionCheckpointStore:
+    """按（用户, 设备）保存会话检查点：批次变化时写完整快照，每次作答只追加一条小事件，恢复时重放。
+    同一用户在多台设备上同时答题时各写各的检查点，互不覆盖"""
+
+    DB_NAME = "sessions.sqlite3"
+    SNAPSHOT_EVERY = 20  # 事件累积到该数量后由调用方写新快照，控制重放长度
+
+    def __init__(self):
+        self._ready = False
+
+    def _conn(self):
+        conn = connect(self.DB_NAME)
+        if not self._ready:
+            with db_lock(self.DB_NAME):
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(session_snapshot)")]
+                if columns and "device_id" not in columns:
+                    # 旧版只按用户保存的检查点无法区分设备；检查点本身只是临时数据，直接丢弃
+                    conn.execute("DROP TABLE session_snapshot")
+                    conn.execute("DROP TABLE IF EXISTS session_events")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS session_snapshot ("
+                    "user_id TEXT NOT NULL, device_id TEXT NOT NULL, payload TEXT NOT NULL, updated_at REAL NOT NULL, "
+                    "PRIMARY KEY (user_id, device_id))"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS session_events ("
+                    "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, device_id TEXT NOT NULL, "
+                    "event TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_session_events_device ON session_events (user_id, device_id, seq)"
+                )
+            self._ready = True
+        return conn
+
+    def snapshot(self, user_id, device_id, payload):
+        "写入该设备的完整快照，并清除该设备此前的事件"
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT OR REPLACE INTO session_snapshot (user_id, device_id, payload, updated_at) VALUES (?, ?, ?, ?)",
+                (user_id, device_id, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            conn.execute("DELETE FROM session_events WHERE user_id = ? AND device_id = ?", (user_id, device_id))
+            conn.execute("COMMIT")
+
+    def append_event(self, user_id, device_id, event):
+        "追加一条作答/翻页事件（单行插入，开销很小）；事件记下设备ID，重放时按该设备记入 CRDT"
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            conn.execute(
+                "INSERT INTO session_events (user_id, device_id, event, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, device_id, json.dumps(dict(event, d=device_id), ensure_ascii=False), time.time())
+            )
+
+    def load(self, user_id, device_id=None, max_age=None):
+        """读取快照并重放其后的事件；最近一次写入超过 max_age 秒的检查点视为过期。
+        device_id 为空时（新会话登录）取该用户最近写入的检查点"""
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            if device_id is None:
+                latest = conn.execute(
+                    "SELECT s.device_id FROM session_snapshot s WHERE s.user_id = ? "
+                    "ORDER BY MAX(s.updated_at, COALESCE((SELECT MAX(e.created_at) FROM session_events e "
+                    "WHERE e.user_id = s.user_id AND e.device_id = s.device_id), 0)) DESC LIMIT 1",
+                    (user_id,)
+                ).fetchone()
+                device_id = latest[0] if latest else None
+            row = conn.execute(
+                "SELECT payload, updated_at FROM session_snapshot WHERE user_id = ? AND device_id = ?",
+                (user_id, device_id)
+            ).fetchone()
+            events = conn.execute(
+                "SELECT event, created_at FROM session_events WHERE user_id = ? AND device_id = ? ORDER BY seq",
+                (user_id, device_id)
+            ).fetchall()
+        if row is None:
+            return None
+        updated_at = max([row[1]] + [created_at for _, created_at in events])
+        if max_age is not None and time.time() - updated_at > max_age:
+            return None
+        payload = json.loads(row[0])
+        for event, _ in events:
+            replay_event(payload, json.loads(event))
+        return payload
+
+    def delete(self, user_id):
+        "删除该用户所有设备的检查点（重置进度时调用）"
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            conn.execute("DELETE FROM session_snapshot WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM session_events WHERE user_id = ?", (user_id,))
+
+    def purge_older_than(self, seconds):
+        conn = self._conn()
+        cutoff = time.time() - seconds
+        with db_lock(self.DB_NAME):
+            conn.execute("DELETE FROM session_snapshot WHERE updated_at < ?", (cutoff,))
+            conn.execute("DELETE FROM session_events WHERE created_at < ?", (cutoff,))
+
+
+checkpoints = SessionCheckpointStore()
+
+
+# --- 待重试的云端保存（持久化队列）---
+class PendingSaveQueue:
+    "保存到云端失败的进度按用户落盘（每个用户只保留最新一份），后台线程按退避时间重试，成功后删除"
+
+    DB_NAME = "pending_saves.sqlite3"
+    RETRY_BASE = 30  # 秒，第 n 次失败后等待 RETRY_BASE * 2^n 秒再重试
+    RETRY_MAX = 30 * 60
+
+    def __init__(self):
+        self._ready = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._replay = None
+        self.replayed_count = 0
+
+    def _conn(self):
+        conn = connect(self.DB_NAME)
+        if not self._ready:
+            with db_lock(self.DB_NAME):
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS pending_saves ("
+                    "user_id TEXT PRIMARY KEY, payload TEXT NOT NULL, enqueued_at REAL NOT NULL, "
+                    "attempts INTEGER NOT NULL, next_attempt_at REAL NOT NULL, last_error TEXT)"
+                )
+            self._ready = True
+        return conn
+
+    def put(self, user_id, payload, error=""):
+        """加入一个用户待保存的进度 {'row', 'revision', 'crdt', 'last_wrong'}；
+        已有待保存进度时（如多个设备都保存失败）与之合并，不互相覆盖"""
+        conn = self._conn()
+        now = time.time()
+        with db_lock(self.DB_NAME):
+            row = conn.execute("SELECT payload FROM pending_saves WHERE user_id = ?", (user_id,)).fetchone()
+            if row is not None:
+                queued = json.loads(row[0])
+                crdt_state, last_wrong = progress_crdt.merge(queued['crdt'], payload['crdt'], queued['last_wrong'], payload['last_wrong'])
+                payload = {
+                    'row': payload['row'] or queued['row'],
+                    'revision': max(payload['revision'], queued['revision']),
+                    'crdt': crdt_state,
+                    'last_wrong': last_wrong
+                }
+            conn.execute(
+                "INSERT OR REPLACE INTO pending_saves (user_id, payload, enqueued_at, attempts, next_attempt_at, last_error) "
+                "VALUES (?, ?, ?, 0, ?, ?)",
+                (user_id, json.dumps(payload, ensure_ascii=False), now, now + self.RETRY_BASE, str(error))
+            )
+
+    def get(self, user_id):
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            row = conn.execute("SELECT payload FROM pending_saves WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def discard(self, user_id, enqueued_before=None):
+        "删除用户的待保存进度（会话已成功保存更新的进度时调用）"
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            if enqueued_before is None:
+                conn.execute("DELETE FROM pending_saves WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute("DELETE FROM pending_saves WHERE user_id = ? AND enqueued_at <= ?", (user_id, enqueued_before))
+
+    def due(self, limit=20):
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            rows = conn.execute(
+                "SELECT user_id, payload, enqueued_at, attempts FROM pending_saves WHERE next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?", (time.time(), limit)
+            ).fetchall()
+        return [(user_id, json.loads(payload), enqueued_at, attempts) for user_id, payload, enqueued_at, attempts in rows]
+
+    def _failed(self, user_id, attempts, error):
+        delay = min(self.RETRY_MAX, self.RETRY_BASE * 2 ** attempts)
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            conn.execute(
+                "UPDATE pending_saves SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE user_id = ?",
+                (attempts + 1, time.time() + delay, str(error), user_id)
+            )
+
+    def stats(self):
+        conn = self._conn()
+        with db_lock(self.DB_NAME):
+            count, oldest = conn.execute("SELECT COUNT(*), MIN(enqueued_at) FROM pending_saves").fetchone()
+        return {'pending': count, 'oldest_age_s': round(time.time() - oldest) if oldest else 0, 'replayed': self.replayed_count}
+
+    def start(self, replay, interval=15):
+        "启动后台重试线程；replay(user_id, payload) 负责写回云端，抛出异常表示仍然失败"
+        with self._lock:
+            self._replay = replay
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="pending-save-replayer", daemon=True)
+            self._thread.start()
+
+    def drain(self):
+        "重试所有到期的待保存进度"
+        for user_id, payload, enqueued_at, attempts in self.due():
+            try:
+                self._replay(user_id, payload)
+            except Exception as e:
+                self._failed(user_id, attempts, e)
+            else:
+                # 重试期间用户可能又有新的失败保存入队，只删除本次重试的那一份
+                self.discard(user_id, enqueued_before=enqueued_at)
+                self.replayed_count += 1
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.drain()
+            except Exception:
+                pass  # 重试线程不能退出，下一轮继续
+
+
+pending_saves = PendingSaveQueue()
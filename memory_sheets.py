@@ -0,0 +1,162 @@
+"""进程内存中的表格存储，接口与应用用到的 gspread 客户端/表格/工作表方法一致。
+用于会话重放（replay_traces.py）和离线压测：设置环境变量 QUIZ_SHEETS_BACKEND=memory 后，
+sheets_scheduler.authorize 返回本模块的客户端，不访问 Google，也不经过配额调度（重放需要全速执行）。
+"""
+import re
+import threading
+
+import gspread
+
+_A1_CELL = re.compile(r"^([A-Z]+)(\d+)$")
+_A1_RANGE = re.compile(r"^([A-Z]+)(\d*):([A-Z]+)(\d*)$")
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+class Cell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class MemoryWorksheet:
+    def __init__(self, title):
+        self.title = title
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def _cells(self):
+        for r, row in enumerate(self._rows, start=1):
+            for c, value in enumerate(row, start=1):
+                yield Cell(r, c, value)
+
+    def find(self, query, in_row=None, in_column=None):
+        with self._lock:
+            for cell in self._cells():
+                if cell.value == query and in_row in (None, cell.row) and in_column in (None, cell.col):
+                    return cell
+        return None
+
+    def findall(self, query, in_row=None, in_column=None):
+        with self._lock:
+            return [
+                cell for cell in self._cells()
+                if cell.value == query and in_row in (None, cell.row) and in_column in (None, cell.col)
+            ]
+
+    def row_values(self, row):
+        with self._lock:
+            values = list(self._rows[row - 1]) if row <= len(self._rows) else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def get_all_values(self):
+        with self._lock:
+            width = max((len(row) for row in self._rows), default=0)
+            return [list(row) + [""] * (width - len(row)) for row in self._rows]
+
+    def _get_range(self, range_name):
+        "返回 A1 区域的值（二维列表，与 gspread 一样省略末尾的空行和空单元格）"
+        cell = _A1_CELL.match(range_name)
+        if cell:
+            first_col = last_col = _column_index(cell.group(1))
+            first_row = last_row = int(cell.group(2))
+        else:
+            match = _A1_RANGE.match(range_name)
+            if match is None:
+                raise ValueError(f"不支持的区域: {range_name}")
+            first_col, last_col = _column_index(match.group(1)), _column_index(match.group(3))
+            first_row = int(match.group(2)) if match.group(2) else 1
+            last_row = int(match.group(4)) if match.group(4) else len(self._rows)
+        values = []
+        for row in self._rows[first_row - 1:last_row]:
+            cells = [str(v) for v in row[first_col:last_col + 1]]
+            while cells and cells[-1] == "":
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        with self._lock:
+            return [self._get_range(range_name) for range_name in ranges]
+
+    def get(self, range_name=None, **kwargs):
+        if range_name is None:
+            return self.get_all_values()
+        with self._lock:
+            return self._get_range(range_name)
+
+    def update(self, range_name, values, value_input_option=None, **kwargs):
+        "按区域左上角写入（应用只写整行）"
+        start = range_name.split(":")[0]
+        cell = _A1_CELL.match(start)
+        first_col, first_row = _column_index(cell.group(1)), int(cell.group(2))
+        with self._lock:
+            for offset, row_values in enumerate(values):
+                row_number = first_row + offset
+                while len(self._rows) < row_number:
+                    self._rows.append([])
+                row = self._rows[row_number - 1]
+                row.extend([""] * (first_col + len(row_values) - len(row)))
+                row[first_col:first_col + len(row_values)] = [str(v) for v in row_values]
+        return {'updatedRange': f"'{self.title}'!{range_name}"}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        with self._lock:
+            self._rows.append([str(v) for v in values])
+            row_number = len(self._rows)
+        return {'updates': {'updatedRange': f"'{self.title}'!A{row_number}:{chr(ord('A') + len(values) - 1)}{row_number}"}}
+
+    def append_rows(self, rows, value_input_option=None, **kwargs):
+        for values in rows:
+            self.append_row(values)
+
+
+class MemorySpreadsheet:
+    def __init__(self, spreadsheet_id):
+        self.id = spreadsheet_id
+        self._worksheets = {}
+        self._lock = threading.Lock()
+        self.sheet1 = self.add_worksheet("Sheet1", rows=1000, cols=8)
+
+    def worksheet(self, title):
+        with self._lock:
+            if title not in self._worksheets:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self._worksheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        with self._lock:
+            worksheet = self._worksheets.setdefault(title, MemoryWorksheet(title))
+        return worksheet
+
+
+class MemoryClient:
+    def __init__(self):
+        self._spreadsheets = {}
+        self._lock = threading.Lock()
+
+    def open_by_key(self, spreadsheet_id):
+        with self._lock:
+            if spreadsheet_id not in self._spreadsheets:
+                self._spreadsheets[spreadsheet_id] = MemorySpreadsheet(spreadsheet_id)
+            return self._spreadsheets[spreadsheet_id]
+
+
+client = MemoryClient()
+
+
+def reset():
+    "清空所有表格（重放下一个会话前调用）"
+    global client
+    client = MemoryClient()
+    return client
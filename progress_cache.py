@@ -0,0 +1,172 @@
+"""用户进度的本地读穿缓存：内存 LRU + SQLite 持久层，按行修订号判断是否过期"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import local_store
+import progress_rows
+
+# 内存中最多缓存的用户数；多进程部署时设为 0，只用各进程共享的 SQLite 层，避免进程间内存层互相过期
+MEMORY_CAPACITY = int(os.environ.get("QUIZ_PROGRESS_MEMORY_CACHE", 256))
+# 同一次登录内的重复读取（登录读取与后台对账）直接使用缓存；超过该时间的条目先校验云端修订号，
+# 其他设备在此期间保存过的进度不会被当作最新
+FRESH_SECONDS = 10
+# “不存在”的记录无法按修订号校验（需要完整查找），在该时间内直接信任（课前预热的新学员）
+ABSENT_FRESH_SECONDS = 15 * 60
+MAX_AGE_SECONDS = 7 * 24 * 3600  # 超过该时间的缓存不再用于校验，直接重新读取
+ABSENT_ROW = 0  # 行号为 0 的条目表示云端没有该用户的记录
+
+
+class ProgressCache:
+    "进度行缓存：读取时先查内存再查磁盘，保存成功后写穿更新"
+
+    DB_NAME = "progress.sqlite3"
+
+    def __init__(self, capacity=MEMORY_CAPACITY):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # user_id -> {'row', 'values', 'revision', 'cached_at'}
+        self._ready = False
+        self.hits = 0  # 新鲜缓存直接命中
+        self.revalidated = 0  # 过了新鲜期，但云端修订号未变，继续使用
+        self.misses = 0  # 无缓存或已过期，完整读取云端
+
+    def _conn(self):
+        conn = local_store.connect(self.DB_NAME)
+        if not self._ready:
+            with local_store.db_lock(self.DB_NAME):
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS progress_rows ("
+                    "user_id TEXT PRIMARY KEY, row_number INTEGER NOT NULL, "
+                    "row_values TEXT NOT NULL, revision INTEGER NOT NULL, cached_at REAL NOT NULL)"
+                )
+            self._ready = True
+        return conn
+
+    def _remember(self, user_id, entry):
+        with self._lock:
+            self._memory[user_id] = entry
+            self._memory.move_to_end(user_id)
+            while len(self._memory) > self._capacity:
+                self._memory.popitem(last=False)
+
+    def lookup(self, user_id):
+        "查找缓存条目（内存未命中时读磁盘并提升到内存），不存在返回 None"
+        with self._lock:
+            entry = self._memory.get(user_id)
+            if entry is not None:
+                self._memory.move_to_end(user_id)
+                return entry
+        conn = self._conn()
+        with local_store.db_lock(self.DB_NAME):
+            row = conn.execute(
+                "SELECT row_number, row_values, revision, cached_at FROM progress_rows WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = {'row': row[0], 'values': json.loads(row[1]), 'revision': row[2], 'cached_at': row[3]}
+        self._remember(user_id, entry)
+        return entry
+
+    def put(self, user_id, row_number, values, cached_at=None):
+        "写入（或写穿更新）一个用户的进度行"
+        entry = {
+            'row': row_number,
+            'values': list(values),
+            'revision': progress_rows.row_revision(values),
+            'cached_at': time.time() if cached_at is None else cached_at
+        }
+        self._remember(user_id, entry)
+        conn = self._conn()
+        with local_store.db_lock(self.DB_NAME):
+            conn.execute(
+                "INSERT OR REPLACE INTO progress_rows (user_id, row_number, row_values, revision, cached_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, row_number, json.dumps(entry['values'], ensure_ascii=False), entry['revision'], entry['cached_at'])
+            )
+        return entry
+
+    def put_absent(self, user_id, cached_at=None):
+        "记录云端没有该用户（课前预热名单中的新学员），新鲜期内登录无需再查找"
+        return self.put(user_id, ABSENT_ROW, [], cached_at)
+
+    def read_through(self, user_id, fetch, revalidate):
+        """读穿缓存：几秒的新鲜期内直接返回缓存；之后用 revalidate(entry) 比较云端修订号（见 RevisionSnapshot），
+        未变化则继续使用缓存；否则调用 fetch() 完整读取云端并写入缓存。
+        fetch 返回 (行号, 行数据)，用户不存在时行号为 None；本方法返回缓存条目或 None"""
+        entry = self.lookup(user_id)
+        if entry is not None:
+            age = time.time() - entry['cached_at']
+            if entry['row'] == ABSENT_ROW:
+                if age <= ABSENT_FRESH_SECONDS:
+                    self.hits += 1
+                    return None
+                # “不存在”的记录过了新鲜期不再可信（可能已在其他设备上创建），重新查找
+            elif age <= FRESH_SECONDS:
+                self.hits += 1
+                return entry
+            elif age <= MAX_AGE_SECONDS and revalidate(entry):
+                self.revalidated += 1
+                return self.put(user_id, entry['row'], entry['values'])
+        self.misses += 1
+        row_number, values = fetch()
+        if row_number is None:
+            return None
+        return self.put(user_id, row_number, values)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._memory.pop(user_id, None)
+        conn = self._conn()
+        with local_store.db_lock(self.DB_NAME):
+            conn.execute("DELETE FROM progress_rows WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        "命中率统计"
+        total = self.hits + self.revalidated + self.misses
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.revalidated) / total * 100, 1) if total else 0.0,
+            'memory_entries': len(self._memory)
+        }
+
+
+cache = ProgressCache()
+
+
+class RevisionSnapshot:
+    """整列读取的各行（用户ID, 修订号）快照：一次区域读取即可校验所有用户的缓存行。
+    快照在 FRESH_SECONDS 内复用，登录高峰中并发的校验在锁上等待并共用同一次读取"""
+
+    def __init__(self, max_age=FRESH_SECONDS):
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._rows = {}  # 行号 -> (用户ID, 修订号字符串)
+        self._taken_at = 0.0
+        self.reads = 0
+
+    def lookup(self, row_number, read_columns):
+        "返回该行在云端的 (用户ID, 修订号)；快照过期时先调用 read_columns() 重新读取，它返回 (用户ID列, 修订号列)"
+        with self._lock:
+            if time.time() - self._taken_at > self._max_age:
+                taken_at = time.time()
+                user_column, revision_column = read_columns()
+                rows = {}
+                for number, user_cells in enumerate(user_column, start=1):
+                    revision_cells = revision_column[number - 1] if number <= len(revision_column) else []
+                    rows[number] = (
+                        user_cells[0] if user_cells else "",
+                        revision_cells[0] if revision_cells else ""
+                    )
+                self._rows = rows
+                self._taken_at = taken_at
+                self.reads += 1
+            return self._rows.get(row_number)
+
+
+revisions = RevisionSnapshot()
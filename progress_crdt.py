@@ -0,0 +1,179 @@
+"""进度的无冲突合并（CRDT）：同一用户多个设备同时答题时合并，而不是后写覆盖先写
+
+每道题一个条目 [状态, 时间戳, 设备, 计数纪元, {设备: 错误次数}]：
+- 状态（'c' 已掌握 / 'i' 错题）按 (时间戳, 设备) 取最后写入者（LWW 寄存器）；
+- 错误次数是按设备分开的只增计数器，合并时逐设备取最大值，总数为各设备之和；
+- 答对会开启新的计数纪元（错误次数清零），合并时纪元取最大值，旧纪元的计数作废；
+- 重置进度记录一个重置时间，早于该时间的条目全部作废。
+合并满足交换律、结合律和幂等性，各设备无论以什么顺序保存都会收敛到同一结果。
+"""
+import base64
+import json
+import time
+import zlib
+
+# 时间戳从 2024-01-01 起按秒计，缩短存储长度
+TS_BASE = 1704067200
+# 单元格最多 50000 个字符，编码结果超过该长度时压缩存储
+COMPRESS_OVER = 40000
+
+
+def now_ts():
+    return int(time.time()) - TS_BASE
+
+
+def new_state():
+    return {'r': 0, 'q': {}}
+
+
+def from_progress(progress_data, device="legacy", ts=0):
+    "把普通进度数据（B~E 列）转换为 CRDT 状态，用于没有 H 列的旧记录"
+    state = new_state()
+    for q_id in progress_data["correct_ids"]:
+        state['q'][str(q_id)] = ['c', ts, device, ts, {}]
+    wrong_ids = {str(q_id) for q_id in progress_data["incorrect_ids"]} | set(progress_data["error_counts"].keys())
+    for q_key in wrong_ids - set(state['q']):
+        count = progress_data["error_counts"].get(q_key, 1)
+        state['q'][q_key] = ['i', ts, device, 0, {device: count}]
+    return state
+
+
+def record(state, question_id, is_correct, device, ts=None):
+    "记录本设备的一次作答（或标记为已掌握）"
+    q_key = str(question_id)
+    entry = state['q'].get(q_key)
+    ts = now_ts() if ts is None else ts
+    # 保证本设备的新写入晚于它已经看到的条目和重置时间，不受设备间时钟偏差影响
+    ts = max(ts, state['r'] + 1, entry[1] + 1 if entry else 0)
+    if is_correct:
+        state['q'][q_key] = ['c', ts, device, ts, {}]
+    else:
+        epoch, counts = (entry[3], dict(entry[4])) if entry else (state['r'], {})
+        counts[device] = counts.get(device, 0) + 1
+        state['q'][q_key] = ['i', ts, device, epoch, counts]
+    return state
+
+
+def reset(state, ts=None):
+    "重置全部进度：记录重置时间，之前的条目全部作废"
+    ts = now_ts() if ts is None else ts
+    state['r'] = max(ts, state['r'] + 1)
+    state['q'] = {}
+    return state
+
+
+def _write_order(entry):
+    # (时间戳, 设备, 状态) 构成全序，保证平局时双方选出同一个最后写入者
+    return entry[1], entry[2], entry[0]
+
+
+def _merge_entry(a, b):
+    winner = a if _write_order(a) >= _write_order(b) else b
+    if a[3] == b[3]:
+        counts = dict(a[4])
+        for device, count in b[4].items():
+            counts[device] = max(counts.get(device, 0), count)
+    else:
+        counts = dict(a[4] if a[3] > b[3] else b[4])
+    return [winner[0], winner[1], winner[2], max(a[3], b[3]), counts]
+
+
+def _normalize(entry, reset_ts):
+    "重置之前写入的条目作废；重置之后写入、但计数属于重置前纪元的条目，计数清零"
+    if entry is None or entry[1] <= reset_ts:
+        return None
+    if entry[3] < reset_ts:
+        return [entry[0], entry[1], entry[2], reset_ts, {}]
+    return entry
+
+
+def merge(a, b, wrong_a=None, wrong_b=None):
+    """合并两个状态，返回 (合并后的状态, 最近错误答案)；
+    最近错误答案跟随每道题状态的最后写入者取自 wrong_a 或 wrong_b"""
+    wrong_a = wrong_a or {}
+    wrong_b = wrong_b or {}
+    reset_ts = max(a['r'], b['r'])
+    merged = {'r': reset_ts, 'q': {}}
+    last_wrong = {}
+    for q_key in set(a['q']) | set(b['q']):
+        entry_a = _normalize(a['q'].get(q_key), reset_ts)
+        entry_b = _normalize(b['q'].get(q_key), reset_ts)
+        if entry_a is None and entry_b is None:
+            continue
+        if entry_a is None:
+            entry, source = entry_b, wrong_b
+        elif entry_b is None:
+            entry, source = entry_a, wrong_a
+        else:
+            entry = _merge_entry(entry_a, entry_b)
+            source = wrong_a if _write_order(entry_a) >= _write_order(entry_b) else wrong_b
+        merged['q'][q_key] = entry
+        if entry[0] == 'i' and q_key in source:
+            last_wrong[q_key] = source[q_key]
+    return merged, last_wrong
+
+
+def materialize(state, last_wrong_answers):
+    "由 CRDT 状态生成普通进度数据（会话和 B~E 列使用的格式）"
+    progress_data = {"correct_ids": set(), "incorrect_ids": set(), "error_counts": {}, "last_wrong_answers": {}}
+    for q_key, entry in state['q'].items():
+        q_id = int(q_key) if q_key.isdigit() else q_key
+        if entry[0] == 'c':
+            progress_data["correct_ids"].add(q_id)
+        else:
+            progress_data["incorrect_ids"].add(q_id)
+            progress_data["error_counts"][q_key] = max(sum(entry[4].values()), 1)
+            if q_key in last_wrong_answers:
+                progress_data["last_wrong_answers"][q_key] = last_wrong_answers[q_key]
+    return progress_data
+
+
+def remap(state, mapping):
+    "题库热加载后按ID映射改写题目键"
+    if not mapping:
+        return state
+    remapped = {}
+    for q_key, entry in state['q'].items():
+        if q_key.isdigit():
+            q_key = str(mapping.get(int(q_key), int(q_key)))
+        remapped[q_key] = entry
+    state['q'] = remapped
+    return state
+
+
+# --- 紧凑编码（H 列）：设备ID换成下标，已掌握条目省略纪元和计数 ---
+def encode(state):
+    devices = []
+    device_index = {}
+
+    def index_of(device):
+        if device not in device_index:
+            device_index[device] = len(devices)
+            devices.append(device)
+        return device_index[device]
+
+    entries = {}
+    for q_key, (status, ts, device, epoch, counts) in state['q'].items():
+        if status == 'c' and epoch == ts and not counts:
+            entries[q_key] = [status, ts, index_of(device)]
+        else:
+            entries[q_key] = [status, ts, index_of(device), epoch, {str(index_of(d)): n for d, n in counts.items()}]
+    text = json.dumps({'r': state['r'], 'd': devices, 'q': entries}, separators=(",", ":"))
+    if len(text) > COMPRESS_OVER:
+        text = "z:" + base64.b64encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+    return text
+
+
+def decode(text):
+    if text.startswith("z:"):
+        text = zlib.decompress(base64.b64decode(text[2:])).decode("utf-8")
+    data = json.loads(text)
+    devices = data['d']
+    state = {'r': data['r'], 'q': {}}
+    for q_key, entry in data['q'].items():
+        device = devices[entry[2]]
+        if len(entry) == 3:
+            state['q'][q_key] = [entry[0], entry[1], device, entry[1], {}]
+        else:
+            state['q'][q_key] = [entry[0], entry[1], device, entry[3], {devices[int(i)]: n for i, n in entry[4].items()}]
+    return state
@@ -0,0 +1,230 @@
+"""全员进度快照导出：一次批量读取进度表，流式解码后写成列式 NumPy 文件（.npz），供审计和培训档案使用
+
+用法（可放入 cron 每晚执行）：
+    python progress_export.py --credentials service_account.json            # 完整快照
+    python progress_export.py --credentials service_account.json --incremental  # 只读取修订号变化的行
+
+输出目录中的文件：
+    progress-latest.npz          最新完整快照（增量导出时在上一份基础上修补）
+    progress-<时间>.npz          每次完整导出的快照
+    progress-delta-<时间>.npz    每次增量导出的变化部分（变化/新增的用户及已删除的用户）
+
+快照内容：users / rows / revisions（每个用户一项）、question_ids（题库顺序）、
+status（用户×题目，0 未作答 / 1 已掌握 / 2 错题）、error_counts（用户×题目）、
+last_wrong_user / last_wrong_question / last_wrong_answer（最近错误答案，稀疏坐标格式）
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import progress_rows
+import question_index
+import sheets_scheduler
+
+NOT_ANSWERED, MASTERED, WRONG = 0, 1, 2
+LATEST_NAME = "progress-latest.npz"
+BATCH_GET_CHUNK = 200  # 增量导出时每次 batch_get 请求的行数
+
+
+# --- 流式解码管道 ---
+def iter_progress_rows(values, first_row=1):
+    "逐行产出 (行号, 行数据)，跳过空行"
+    for offset, row in enumerate(values):
+        if row and row[0]:
+            yield first_row + offset, row
+
+
+def decode_rows(rows, legacy_ids):
+    "逐行解码为 (用户ID, 行号, 修订号, 进度)"
+    for row_number, row in rows:
+        progress_data, _ = progress_rows.decode_progress_row(row, legacy_ids)
+        yield row[0], row_number, progress_rows.row_revision(row), progress_data
+
+
+def build_snapshot(records, index):
+    "把解码后的记录逐条填入用户×题目矩阵，返回快照字典和不在当前题库中的题目数"
+    question_ids = np.array([q['id'] for q in index['all']], dtype=np.int64)
+    column_of = {q_id: col for col, q_id in enumerate(question_ids.tolist())}
+    users, rows, revisions = [], [], []
+    status_rows, count_rows = [], []
+    wrong_user, wrong_question, wrong_answer = [], [], []
+    unknown = 0
+
+    for user_idx, (user_id, row_number, revision, progress_data) in enumerate(records):
+        status = np.zeros(len(question_ids), dtype=np.int8)
+        counts = np.zeros(len(question_ids), dtype=np.uint16)
+        for q_id in progress_data["correct_ids"]:
+            col = column_of.get(q_id)
+            if col is None:
+                unknown += 1
+                continue
+            status[col] = MASTERED
+        for q_id in progress_data["incorrect_ids"]:
+            col = column_of.get(q_id)
+            if col is None:
+                unknown += 1
+                continue
+            status[col] = WRONG
+        for q_key, count in progress_data["error_counts"].items():
+            col = column_of.get(int(q_key)) if q_key.isdigit() else None
+            if col is not None:
+                counts[col] = min(int(count), np.iinfo(np.uint16).max)
+        for q_key, answer in progress_data["last_wrong_answers"].items():
+            col = column_of.get(int(q_key)) if q_key.isdigit() else None
+            if col is not None:
+                wrong_user.append(user_idx)
+                wrong_question.append(col)
+                wrong_answer.append(answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False))
+        users.append(user_id)
+        rows.append(row_number)
+        revisions.append(revision)
+        status_rows.append(status)
+        count_rows.append(counts)
+
+    shape = (len(users), len(question_ids))
+    snapshot = {
+        'users': np.array(users, dtype=str),
+        'rows': np.array(rows, dtype=np.int32),
+        'revisions': np.array(revisions, dtype=np.int64),
+        'question_ids': question_ids,
+        'status': np.vstack(status_rows) if status_rows else np.zeros(shape, dtype=np.int8),
+        'error_counts': np.vstack(count_rows) if count_rows else np.zeros(shape, dtype=np.uint16),
+        'last_wrong_user': np.array(wrong_user, dtype=np.int32),
+        'last_wrong_question': np.array(wrong_question, dtype=np.int32),
+        'last_wrong_answer': np.array(wrong_answer, dtype=str),
+        'index_version': np.array(index['version']),
+        'exported_at': np.array(time.time())
+    }
+    return snapshot, unknown
+
+
+def select_users(snapshot, user_indexes):
+    "取出快照中部分用户（保持各数组对齐，最近错误答案的用户下标重新编号）"
+    user_indexes = np.asarray(user_indexes, dtype=np.int64)
+    renumber = np.full(len(snapshot['users']), -1, dtype=np.int64)
+    renumber[user_indexes] = np.arange(len(user_indexes))
+    keep = renumber[snapshot['last_wrong_user']] >= 0 if len(snapshot['last_wrong_user']) else np.zeros(0, dtype=bool)
+    selected = dict(snapshot)
+    for key in ('users', 'rows', 'revisions', 'status', 'error_counts'):
+        selected[key] = snapshot[key][user_indexes]
+    selected['last_wrong_user'] = renumber[snapshot['last_wrong_user'][keep]].astype(np.int32)
+    selected['last_wrong_question'] = snapshot['last_wrong_question'][keep]
+    selected['last_wrong_answer'] = snapshot['last_wrong_answer'][keep]
+    return selected
+
+
+def concat_snapshots(first, second):
+    "按用户拼接两份题目列相同的快照"
+    merged = dict(second)
+    for key in ('users', 'rows', 'revisions', 'status', 'error_counts', 'last_wrong_question', 'last_wrong_answer'):
+        merged[key] = np.concatenate([first[key], second[key]])
+    merged['last_wrong_user'] = np.concatenate([first['last_wrong_user'], second['last_wrong_user'] + len(first['users'])]).astype(np.int32)
+    return merged
+
+
+# --- 读取与写出 ---
+def load_snapshot(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def write_snapshot(path, snapshot):
+    "先写临时文件再原子替换，避免导出中断留下损坏的文件"
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **snapshot)
+    os.replace(tmp_path, path)
+
+
+def open_progress_sheet(credentials_path, spreadsheet_id):
+    creds_dict = sheets_scheduler.load_credentials(credentials_path)
+    return sheets_scheduler.authorize(creds_dict).open_by_key(spreadsheet_id).sheet1
+
+
+def full_export(sheet, index):
+    "一次 get_all_values 读取整张进度表，流式解码为完整快照"
+    values = sheet.get_all_values()
+    records = decode_rows(iter_progress_rows(values), index['legacy_ids'])
+    return build_snapshot(records, index)
+
+
+def incremental_export(sheet, index, previous):
+    """增量导出：先一次读取 A、G 两列（用户ID和行修订号），只批量读取修订号变化或新增的行。
+    返回 (新的完整快照, 变化部分快照, 已删除的用户, 不在题库中的题目数)"""
+    user_column, revision_column = sheet.batch_get(["A:A", "G:G"])
+    known = {user: (int(row), int(rev)) for user, row, rev in zip(
+        previous['users'].tolist(), previous['rows'].tolist(), previous['revisions'].tolist()
+    )}
+    current = {}
+    changed_rows = []
+    for offset, cells in enumerate(user_column):
+        if not cells or not cells[0]:
+            continue
+        row_number = offset + 1
+        rev_cells = revision_column[offset] if offset < len(revision_column) else []
+        revision = int(rev_cells[0]) if rev_cells and rev_cells[0].isdigit() else 0
+        current[cells[0]] = row_number
+        # 旧版记录没有修订号，无法判断是否变化，每次都重新读取
+        if revision == 0 or known.get(cells[0]) != (row_number, revision):
+            changed_rows.append(row_number)
+
+    fetched = []
+    for start in range(0, len(changed_rows), BATCH_GET_CHUNK):
+        chunk = changed_rows[start:start + BATCH_GET_CHUNK]
+        ranges = sheet.batch_get([progress_rows.row_range(row_number) for row_number in chunk])
+        fetched.extend((row_number, cells[0]) for row_number, cells in zip(chunk, ranges) if cells and cells[0])
+    delta, unknown = build_snapshot(decode_rows(iter(fetched), index['legacy_ids']), index)
+
+    changed_users = set(delta['users'].tolist())
+    removed = sorted(set(known) - set(current))
+    unchanged = [i for i, user in enumerate(previous['users'].tolist()) if user in current and user not in changed_users]
+    snapshot = concat_snapshots(select_users(previous, unchanged), delta)
+    return snapshot, delta, removed, unknown
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出全员学习进度快照（NumPy .npz 列式格式）")
+    parser.add_argument("--credentials", help="服务账号 JSON 文件（默认读取环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml）")
+    parser.add_argument("--spreadsheet", default=progress_rows.SPREADSHEET_ID, help="进度表 ID")
+    parser.add_argument("--out", default="exports", help="输出目录")
+    parser.add_argument("--incremental", action="store_true", help="只读取上次快照之后修订号变化的行")
+    args = parser.parse_args(argv)
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    latest_path = out_dir / LATEST_NAME
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    index = question_index.get_index()
+    started = time.time()
+
+    with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+        sheet = open_progress_sheet(args.credentials, args.spreadsheet)
+        previous = load_snapshot(latest_path) if args.incremental and latest_path.exists() else None
+        if previous is not None and str(previous['index_version']) != index['version']:
+            print("题库已变化，题目列无法对齐，改为完整导出", file=sys.stderr)
+            previous = None
+
+        if previous is None:
+            snapshot, unknown = full_export(sheet, index)
+            write_snapshot(out_dir / f"progress-{stamp}.npz", snapshot)
+            summary = f"完整快照：{len(snapshot['users'])} 名用户"
+        else:
+            snapshot, delta, removed, unknown = incremental_export(sheet, index, previous)
+            delta['removed_users'] = np.array(removed, dtype=str)
+            write_snapshot(out_dir / f"progress-delta-{stamp}.npz", delta)
+            summary = f"增量快照：{len(delta['users'])} 名用户有变化，{len(removed)} 名用户已删除，共 {len(snapshot['users'])} 名用户"
+    write_snapshot(latest_path, snapshot)
+
+    print(f"{summary}，{len(snapshot['question_ids'])} 道题，用时 {time.time() - started:.1f} 秒 -> {out_dir}")
+    if unknown:
+        print(f"有 {unknown} 个题目ID不在当前题库中，已跳过", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""进度表行格式：Google Sheets 中每个用户一行的编码与解码"""
+import json
+import re
+
+import progress_crdt
+import question_index
+from question_index import ID_SCHEME_VERSION
+
+SPREADSHEET_ID = '13d6icf3wTSEidLWBbgEKZJcae_kYzTT3zO8WcMtoUts'
+
+# 列：A 用户ID, B 已掌握, C 错题, D 错误次数, E 最近错误答案, F ID方案版本, G 行修订号, H 可合并进度（CRDT）
+ROW_WIDTH = 8
+LAST_COLUMN = "H"
+
+
+def empty_progress():
+    return {
+        "correct_ids": set(),
+        "incorrect_ids": set(),
+        "error_counts": {},
+        "last_wrong_answers": {}
+    }
+
+
+def encode_progress_row(user_id, progress_data, revision, crdt_state=None):
+    "把进度编码为表格中的一行（B~E 列为可直接阅读的进度，H 列为多设备合并用的 CRDT 状态）"
+    return [
+        user_id,
+        json.dumps(list(progress_data["correct_ids"])),
+        json.dumps(list(progress_data["incorrect_ids"])),
+        json.dumps(progress_data["error_counts"]),
+        json.dumps(progress_data["last_wrong_answers"]),
+        str(ID_SCHEME_VERSION),
+        str(revision),
+        progress_crdt.encode(crdt_state) if crdt_state is not None else ""
+    ]
+
+
+def decode_progress_row(row, legacy_ids=None):
+    "解析表格中的一行，返回 (进度, 是否迁移了旧版ID)；旧版记录按 legacy_ids 迁移到稳定ID"
+    row = list(row) + [""] * (ROW_WIDTH - len(row))
+    progress_data = {
+        "correct_ids": set(json.loads(row[1])) if row[1] and row[1] != "[]" else set(),
+        "incorrect_ids": set(json.loads(row[2])) if row[2] and row[2] != "[]" else set(),
+        "error_counts": json.loads(row[3]) if row[3] and row[3] != "{}" else {},
+        "last_wrong_answers": json.loads(row[4]) if row[4] and row[4] != "{}" else {}
+    }
+    # 旧版记录（无F列ID方案标记）使用题库下标作为题目ID
+    migrated = row[5] != str(ID_SCHEME_VERSION)
+    if migrated:
+        if legacy_ids is None:
+            legacy_ids = question_index.get_index()['legacy_ids']
+        question_index.remap_progress(progress_data, legacy_ids)
+    return progress_data, migrated
+
+
+def decode_progress_crdt(row, progress_data):
+    "解析 H 列的 CRDT 状态；没有 H 列的旧记录由 B~E 列的进度转换"
+    if len(row) > 7 and row[7]:
+        return progress_crdt.decode(row[7])
+    return progress_crdt.from_progress(progress_data)
+
+
+def row_revision(row):
+    "行修订号（G列），相当于该行的 ETag；旧版记录没有修订号时为 0"
+    try:
+        return int(row[6]) if len(row) > 6 and row[6] else 0
+    except ValueError:
+        return 0
+
+
+def row_range(row_number):
+    return f"A{row_number}:{LAST_COLUMN}{row_number}"
+
+
+def appended_row_number(response):
+    "从 append_row 的返回结果中解析新行的行号"
+    try:
+        updated_range = response['updates']['updatedRange']
+    except (TypeError, KeyError):
+        return None
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
@@ -0,0 +1,34 @@
+"""进度表的读写操作（不依赖 Streamlit，页面、后台重试线程和边车进程共用）"""
+import progress_cache
+import progress_crdt
+import progress_rows
+
+
+def write_progress(sheet, user_id, row_to_update, crdt_state, last_wrong, local_revision):
+    """读-合并-写：先读取云端该行，与其他设备写入的进度合并后再写回，不锁表。
+    返回 (行号, 修订号, 合并后的CRDT状态, 合并后的进度)"""
+    if not row_to_update:
+        # 同一新用户可能已在其他设备上创建了记录
+        cell = sheet.find(user_id)
+        row_to_update = cell.row if cell else None
+    cloud_row = sheet.row_values(row_to_update) if row_to_update else []
+    if cloud_row:
+        # 合并满足幂等性，云端未被其他设备改写时合并结果不变；两次写入交错时，下次保存会再次合并补回
+        cloud_data, _ = progress_rows.decode_progress_row(cloud_row)
+        cloud_crdt = progress_rows.decode_progress_crdt(cloud_row, cloud_data)
+        crdt_state, last_wrong = progress_crdt.merge(crdt_state, cloud_crdt, last_wrong, cloud_data["last_wrong_answers"])
+    merged_data = progress_crdt.materialize(crdt_state, last_wrong)
+
+    # 修订号取云端与本地较大者加一，作为该行的版本标记
+    revision = max(progress_rows.row_revision(cloud_row), local_revision) + 1
+    row_data = progress_rows.encode_progress_row(user_id, merged_data, revision, crdt_state)
+    if row_to_update:
+        sheet.update(progress_rows.row_range(row_to_update), [row_data], value_input_option='USER_ENTERED')
+    else:
+        response = sheet.append_row(row_data, value_input_option='USER_ENTERED')
+        # 记住新行的行号，之后的保存更新该行而不是再追加新行
+        row_to_update = progress_rows.appended_row_number(response)
+    if row_to_update:
+        # 写穿本地进度缓存，下次登录无需访问云端
+        progress_cache.cache.put(user_id, row_to_update, row_data)
+    return row_to_update, revision, crdt_state, merged_data
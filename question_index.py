@@ -0,0 +1,365 @@
+"""题库共享索引：稳定题目ID、后台热加载、原子替换与ID迁移映射"""
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import pickle
+import stat
+import threading
+import time
+from pathlib import Path
+
+import bank_validator
+
+QUESTION_BANK_PATH = Path(__file__).with_name("question_bank.json")
+
+# 多进程部署时，编译好的索引放在该目录（通常位于 /dev/shm 共享内存）中，各工作进程映射读取，不再各自解析题库
+SHARED_INDEX_ENV = "QUIZ_SHARED_INDEX_DIR"
+# 编译索引文件的 HMAC 密钥（由部署主进程随机生成并传给工作进程），校验通过才反序列化
+SHARED_INDEX_KEY_ENV = "QUIZ_SHARED_INDEX_KEY"
+
+# 进度中题目ID的编码方案：1 = 题库数组下标（旧版），2 = 序号/内容哈希（稳定ID）
+ID_SCHEME_VERSION = 2
+
+
+class QuestionBankError(Exception):
+    """题库文件无法加载（文件缺失、格式错误或没有有效题目）"""
+
+
+# --- 稳定ID ---
+def content_key(q_text, options):
+    "题干+选项的内容哈希，用于在ID变化时匹配同一道题"
+    raw = json.dumps([str(q_text).strip(), [str(opt).strip() for opt in options]], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def stable_question_id(item, key, used_ids):
+    "优先使用序号作为题目ID；序号缺失或重复时退回内容哈希"
+    seq = item.get('序号', item.get('id'))
+    try:
+        seq_id = int(seq)
+    except (TypeError, ValueError):
+        seq_id = None
+    if seq_id is not None and seq_id >= 0 and seq_id not in used_ids:
+        return seq_id
+    # 取哈希前12位（48位整数），保证ID仍可用 str.isdigit() 校验
+    hash_id = int(key[:12], 16)
+    while hash_id in used_ids:
+        hash_id += 1
+    return hash_id
+
+
+# --- 索引构建 ---
+def parse_questions(items):
+    "解析 (下标, 题目) 序列，返回标准化题目列表以及旧版下标ID到新ID的映射"
+    questions = []
+    legacy_ids = {}
+    used_ids = set()
+
+    for i, item in items:
+        if not isinstance(item, dict):
+            continue
+        q_text = item.get('question') or item.get('题干')
+        options = item.get('options') or item.get('选项')
+        answer = item.get('answer') or item.get('正确答案')
+
+        if not q_text or not options or not answer or not isinstance(options, list) or len(options) == 0:
+            continue
+
+        # 判断是否为多选题（答案为数组格式或包含"|"分隔符）
+        is_multiple = isinstance(answer, list) or (isinstance(answer, str) and "|" in answer)
+
+        # 标准化答案格式，多选题转集合，单选题转字符串
+        if isinstance(answer, list):
+            # 数组格式答案，如 ["B", "C", "D"]
+            standard_answer = set([str(a).strip().upper() for a in answer if str(a).strip().upper()])
+        elif "|" in str(answer):
+            # "|"分隔符格式，如 "A|B|C"
+            standard_answer = set([a.strip().upper() for a in str(answer).split("|") if a.strip().upper()])
+        else:
+            # 单选题，如 "A" 或 "B"
+            standard_answer = str(answer).strip().upper()
+
+        key = content_key(q_text, options)
+        q_id = stable_question_id(item, key, used_ids)
+        used_ids.add(q_id)
+        legacy_ids[i] = q_id
+
+        explanation = item.get('explanation') or item.get('解析') or ''
+        topic = item.get('topic') or item.get('章节') or ''
+        questions.append({
+            'id': q_id,
+            'question': str(q_text),
+            'options': [str(opt) for opt in options],
+            'answer': standard_answer,  # 多选题存集合，单选题存字符串
+            'is_multiple': is_multiple,  # 标记是否为多选题
+            'original_answer': str(answer),  # 保留原始答案字符串（用于展示）
+            'explanation': str(explanation),
+            'topic': str(topic),
+            'content_key': key
+        })
+
+    return questions, legacy_ids
+
+
+def build_index(path=QUESTION_BANK_PATH):
+    "读取题库文件并构建只读索引（含题型分类和ID查找表）"
+    path = Path(path)
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        raise QuestionBankError(f"未找到 {path.name} 文件，请确认文件路径！")
+    version = hashlib.sha1(raw).hexdigest()[:12]
+    shared_dir = os.environ.get(SHARED_INDEX_ENV)
+    if shared_dir:
+        index = load_compiled_index(shared_dir, version)
+        if index is not None:
+            return index  # 已编译的索引在发布前已通过校验
+
+    # 流式解析题库：逐题校验（按块查询校验缓存）的同时解析，不先构建整个题目数组
+    report = {}
+    try:
+        items = bank_validator.iter_items(raw.decode("utf-8"))
+        questions, legacy_ids = parse_questions(bank_validator.checked_items(items, report))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise QuestionBankError(f"题库文件格式错误，无法解析 JSON: {str(e)}")
+    except ValueError as e:
+        raise QuestionBankError(str(e))
+    # 存在错误级别的诊断时拒绝构建（热加载时保留旧索引），警告不影响加载
+    diagnostics = report['diagnostics']
+    if any(d['severity'] == bank_validator.ERROR for d in diagnostics):
+        raise QuestionBankError(f"题库校验未通过：{bank_validator.summarize(diagnostics)}")
+
+    if not questions:
+        raise QuestionBankError("未加载到有效题目，请检查题库文件！")
+
+    single_choice = [q for q in questions if not q['is_multiple']]
+    multiple_choice = [q for q in questions if q['is_multiple']]
+    index = {
+        'version': version,
+        'all': questions,
+        'single_choice': single_choice,
+        'multiple_choice': multiple_choice,
+        'by_id': {q['id']: q for q in questions},
+        'legacy_ids': legacy_ids,
+        'total': len(questions),
+        'total_single': len(single_choice),
+        'total_multiple': len(multiple_choice),
+        'loaded_at': time.time()
+    }
+    if shared_dir:
+        publish_compiled_index(shared_dir, index)
+    return index
+
+
+# --- 编译索引的共享（多进程部署）---
+# 文件格式：HMAC-SHA256 摘要（32 字节）+ pickle 数据。pickle 反序列化可以执行任意代码，
+# 所以只读取本用户私有目录（0700）中、摘要与部署密钥匹配的文件
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def compiled_index_path(shared_dir, version):
+    return Path(shared_dir) / f"index-{version}-id{ID_SCHEME_VERSION}.pickle"
+
+
+def shared_index_key():
+    key = os.environ.get(SHARED_INDEX_KEY_ENV)
+    return bytes.fromhex(key) if key else None
+
+
+def shared_dir_is_private(shared_dir):
+    "共享目录必须是当前用户所有、其他用户不可读写的目录（不跟随符号链接）"
+    try:
+        st = os.lstat(shared_dir)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o077:
+        return False
+    return not hasattr(os, "getuid") or st.st_uid == os.getuid()
+
+
+def publish_compiled_index(shared_dir, index):
+    "把编译好的索引签名后写入共享目录（先写临时文件再原子替换），供其他进程直接映射读取"
+    key = shared_index_key()
+    path = compiled_index_path(shared_dir, index['version'])
+    if key is None:
+        return None  # 没有部署密钥时不共享，各进程自行解析
+    try:
+        os.makedirs(shared_dir, mode=0o700, exist_ok=True)
+        if not shared_dir_is_private(shared_dir):
+            return None
+        if path.exists():
+            return path
+        data = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(hmac.new(key, data, hashlib.sha256).digest())
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        return None  # 共享目录不可写时各进程退回自行解析
+    return path
+
+
+def load_compiled_index(shared_dir, version):
+    "映射读取共享目录中与题库版本一致、签名有效的编译索引；不存在、损坏或不可信时返回 None"
+    key = shared_index_key()
+    if key is None or not shared_dir_is_private(shared_dir):
+        return None
+    path = compiled_index_path(shared_dir, version)
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                digest = hmac.new(key, view[DIGEST_SIZE:], hashlib.sha256).digest()
+                if not hmac.compare_digest(digest, view[:DIGEST_SIZE]):
+                    return None
+                index = pickle.loads(view[DIGEST_SIZE:])
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        return None
+    if index.get('version') != version:
+        return None
+    index['loaded_at'] = time.time()
+    return index
+
+
+def diff_ids(old_index, new_index):
+    "比较两个索引，返回内容相同但ID发生变化的题目映射 {旧ID: 新ID}"
+    new_by_id = new_index['by_id']
+    unchanged = set()
+    moved = []
+    for q in old_index['all']:
+        same = new_by_id.get(q['id'])
+        if same is not None and (same['content_key'] == q['content_key'] or same['question'].strip() == q['question'].strip()):
+            unchanged.add(q['id'])
+        else:
+            moved.append(q)
+    if not moved:
+        return {}
+
+    # 题库中可能存在内容完全相同的重复题，按出现顺序逐一认领，避免多道旧题映射到同一新题
+    new_by_key = {}
+    new_by_text = {}
+    for q in new_index['all']:
+        if q['id'] in unchanged:
+            continue
+        new_by_key.setdefault(q['content_key'], []).append(q['id'])
+        new_by_text.setdefault(q['question'].strip(), []).append(q['id'])
+
+    mapping = {}
+    claimed = set()
+    for q in moved:
+        candidates = new_by_key.get(q['content_key'], []) + new_by_text.get(q['question'].strip(), [])
+        new_id = next((c for c in candidates if c not in claimed), None)
+        if new_id is not None:
+            claimed.add(new_id)
+            if new_id != q['id']:
+                mapping[q['id']] = new_id
+    return mapping
+
+
+# --- 进程级共享索引（所有会话共用，原子替换）---
+_index_lock = threading.Lock()
+_current_index = None
+_migrations = {}  # 旧版本号 -> (新版本号, {旧ID: 新ID})
+_watcher_thread = None
+_watcher_state = {'last_error': None, 'last_reload': None}
+
+
+def get_index():
+    "获取当前共享索引；首次调用时构建"
+    global _current_index
+    index = _current_index
+    if index is not None:
+        return index
+    with _index_lock:
+        if _current_index is None:
+            _current_index = build_index()
+        return _current_index
+
+
+def reload_index(path=QUESTION_BANK_PATH):
+    "重新构建索引并原子替换；构建失败时保留旧索引并抛出异常"
+    global _current_index
+    new_index = build_index(path)
+    with _index_lock:
+        old_index = _current_index
+        if old_index is not None and old_index['version'] == new_index['version']:
+            return old_index
+        if old_index is not None:
+            _migrations[old_index['version']] = (new_index['version'], diff_ids(old_index, new_index))
+        # 单次引用赋值即为原子替换，正在渲染的会话仍持有旧索引直到下次重跑
+        _current_index = new_index
+    _watcher_state['last_reload'] = time.time()
+    return new_index
+
+
+def migration_map(from_version):
+    "返回从指定版本迁移到当前版本的ID映射（沿版本链合并）"
+    mapping = {}
+    version = from_version
+    seen = set()
+    while version in _migrations and version not in seen:
+        seen.add(version)
+        version, step = _migrations[version]
+        # 先把已有映射的目标继续向前推进，再补充本步新增的映射
+        mapping = {old: step.get(new, new) for old, new in mapping.items()}
+        for old, new in step.items():
+            mapping.setdefault(old, new)
+    return mapping
+
+
+def remap_progress(progress_data, mapping):
+    "按ID映射原地改写进度数据（集合中的整数ID和字典中的字符串ID）"
+    if not mapping:
+        return progress_data
+    for key in ("correct_ids", "incorrect_ids"):
+        progress_data[key] = {mapping.get(q_id, q_id) for q_id in progress_data[key]}
+    for key in ("error_counts", "last_wrong_answers"):
+        remapped = {}
+        for q_id, value in progress_data[key].items():
+            if q_id.isdigit():
+                q_id = str(mapping.get(int(q_id), int(q_id)))
+            remapped[q_id] = value
+        progress_data[key] = remapped
+    return progress_data
+
+
+def start_watcher(path=QUESTION_BANK_PATH, interval=2.0):
+    "启动后台线程轮询题库文件，变化时重建并替换共享索引（每个进程只启动一次）"
+    global _watcher_thread
+    with _index_lock:
+        if _watcher_thread is not None and _watcher_thread.is_alive():
+            return _watcher_thread
+        path = Path(path)
+
+        def _signature():
+            try:
+                stat = path.stat()
+                return (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                return None
+
+        def _watch():
+            last_signature = _signature()
+            while True:
+                time.sleep(interval)
+                signature = _signature()
+                if signature is None or signature == last_signature:
+                    continue
+                last_signature = signature
+                try:
+                    reload_index(path)
+                    _watcher_state['last_error'] = None
+                except QuestionBankError as e:
+                    # 编辑中途的半写文件等情况：保留旧索引，等待下一次变化
+                    _watcher_state['last_error'] = str(e)
+
+        _watcher_thread = threading.Thread(target=_watch, name="question-bank-watcher", daemon=True)
+        _watcher_thread.start()
+        return _watcher_thread
+
+
+def watcher_status():
+    "返回热加载状态（最近一次重载时间和错误）"
+    return dict(_watcher_state)
@@ -1,9 +1,28 @@
 import streamlit as st
+import datetime
 import json
 import random
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import re
+import time
 from pathlib import Path
+import question_index
+import session_memory
+import local_store
+import idle_sessions
+import background_jobs
+import class_prewarm
+import render_cache
+import startup_metrics
+import session_trace
+import progress_rows
+import answer_history
+import progress_cache
+import progress_crdt
+import progress_store
+import sheets_scheduler
+import sheets_sidecar
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from question_index import QuestionBankError
 
 # --- 页面配置 ---
 st.set_page_config(
@@ -14,7 +33,7 @@ st.set_page_config(
 )
 
 # --- 自定义CSS ---
-st.markdown("""
+PAGE_STYLE = """
 <style>
     /* 护眼背景设置 - 使用更柔和的颜色 */
     body {
@@ -164,20 +183,30 @@ st.markdown("""
         border-radius: 0.5rem;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def compact_page_style():
+    "去掉注释和缩进后的样式表（每个进程只处理一次），减小每个新会话首屏需要下发的内容"
+    css = re.sub(r"/\*.*?\*/", "", PAGE_STYLE, flags=re.S)
+    return re.sub(r"\s*\n\s*", "", css)
+
+st.markdown(compact_page_style(), unsafe_allow_html=True)
 
 # --- 核心配置 ---
-SPREADSHEET_ID = '13d6icf3wTSEidLWBbgEKZJcae_kYzTT3zO8WcMtoUts'  
+SPREADSHEET_ID = progress_rows.SPREADSHEET_ID
 TOTAL_QUESTIONS = 1330  # 固定总题数为1330道
+EXAM_RESULTS_SHEET = "exam_results"  # 模拟考试成绩工作表
+EXAM_TICK_SECONDS = 15  # 考试倒计时的刷新间隔（秒），到达时限后自动交卷
+IDLE_SESSION_TIMEOUT = 30 * 60  # 会话空闲超过30分钟后保存进度、落盘并释放内存
+CHECKPOINT_MAX_AGE = 24 * 3600  # 本地检查点保留24小时，超时后重新从云端加载
 
 # --- Google Sheets 连接函数 ---
 def get_google_sheets_client():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     try:
         creds_dict = json.loads(st.secrets["google_credentials"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        return client
+        # 所有表格请求经过进程级调度器限流和重试
+        return sheets_scheduler.authorize(creds_dict)
     except KeyError:
         st.error("错误：Streamlit Secrets 中未找到 'google_credentials'，请检查配置！")
         st.stop()
@@ -185,16 +214,55 @@ def get_google_sheets_client():
         st.error(f"连接 Google Sheets 失败: {str(e)}")
         st.stop()
 
+def get_progress_sheet():
+    "进度工作表（句柄在进程内只打开一次）"
+    return sheets_scheduler.open_sheet1(get_google_sheets_client, SPREADSHEET_ID)
+
 # --- 进度加载/保存函数 ---
-def load_progress(user_id):
-    "加载进度"
+def fetch_progress_row(user_id):
+    """读取用户进度（不涉及页面输出，可在后台线程调用）：优先使用本地进度缓存，按行修订号校验是否过期。
+    返回 (进度, 行号, 修订号, 是否迁移了旧版ID, CRDT状态)，新用户进度为 None"""
+    def fetch():
+        sheet = get_progress_sheet()
+        cell = sheet.find(user_id)
+        if cell is None:
+            return None, None
+        return cell.row, sheet.row_values(cell.row)
+    
+    def revalidate(entry):
+        # 比较该行云端的用户ID和修订号（类似 ETag 校验）；两列整列读取，几秒内进程中所有用户的校验共用一次读取，
+        # 开课时全班集中登录也只需要少数几次读取
+        cloud = progress_cache.revisions.lookup(entry['row'], lambda: get_progress_sheet().batch_get(["A:A", "G:G"]))
+        return cloud == (user_id, str(entry['revision']) if entry['revision'] else "")
+    
+    entry = progress_cache.cache.read_through(user_id, fetch, revalidate)
+    if entry is None:
+        return None, None, 0, False, progress_crdt.new_state()
+    cloud_data, migrated = progress_rows.decode_progress_row(entry['values'])
+    crdt_state = progress_rows.decode_progress_crdt(entry['values'], cloud_data)
+    return cloud_data, entry['row'], entry['revision'], migrated, crdt_state
+
+def load_progress(user_id, fetched=None):
+    "加载进度；fetched 为登录时已提交到后台线程池的 fetch_progress_row 任务，为 None 时直接读取"
     try:
         # 从Google Sheets加载最新数据
-        client = get_google_sheets_client()
-        sheet = client.open_by_key(SPREADSHEET_ID).sheet1
-        cell = sheet.find(user_id)
+        if fetched is not None:
+            cloud_data, row_id, revision, migrated, crdt_state = fetched.result()
+        else:
+            with sheets_scheduler.priority(sheets_scheduler.LOGIN):
+                cloud_data, row_id, revision, migrated, crdt_state = fetch_progress_row(user_id)
+        st.session_state['progress_revision'] = revision
         
-        if cell is None:
+        # 本机还有保存失败、尚未写回云端的进度时一并合并
+        pending = local_store.pending_saves.get(user_id)
+        if pending:
+            cloud_wrong = cloud_data["last_wrong_answers"] if cloud_data else {}
+            crdt_state, last_wrong = progress_crdt.merge(crdt_state, pending['crdt'], cloud_wrong, pending['last_wrong'])
+            cloud_data = progress_crdt.materialize(crdt_state, last_wrong)
+            row_id = row_id or pending['row']
+        st.session_state['progress_crdt'] = crdt_state
+        
+        if cloud_data is None:
             # 新用户
             st.info(f"👋 欢迎新用户 {user_id}！将为你创建新的学习记录。")
             default_data = {
@@ -205,151 +273,185 @@ def load_progress(user_id):
             }
             return default_data, None
         
-        # 现有用户，获取云端数据
-        row = sheet.row_values(cell.row)
-        cloud_data = {
-            "correct_ids": set(json.loads(row[1])) if row[1] and row[1] != "[]" else set(),
-            "incorrect_ids": set(json.loads(row[2])) if row[2] and row[2] != "[]" else set(),
-            "error_counts": json.loads(row[3]) if row[3] and row[3] != "{}" else {},
-            "last_wrong_answers": json.loads(row[4]) if row[4] and row[4] != "{}" else {}
-        }
+        if migrated:
+            st.session_state['legacy_progress_migrated'] = True
         
         st.success(f"✅ 欢迎回来, {user_id}！已加载你的学习进度（累计错题 {len(cloud_data['error_counts'])} 道）。")
-        return cloud_data, cell.row
+        return cloud_data, row_id
     
     except Exception as e:
         st.error(f"加载进度时发生错误: {str(e)}")
         return None, None
-def save_progress(user_id, progress_data, row_to_update=None, force_save=False):
-    "保存进度"
+def write_progress(user_id, row_to_update, crdt_state, last_wrong, local_revision):
+    "读-合并-写保存进度（不涉及页面输出，会话保存和后台重试共用），见 progress_store.write_progress"
+    sheet = get_progress_sheet()
+    return progress_store.write_progress(sheet, user_id, row_to_update, crdt_state, last_wrong, local_revision)
+
+def replay_pending_save(user_id, payload):
+    "后台重试线程调用：把重试队列中的进度写回云端（低优先级，不挤占登录和答题的配额）"
+    with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+        write_progress(user_id, payload['row'], payload['crdt'], payload['last_wrong'], payload['revision'])
+
+def save_progress(user_id, progress_data, row_to_update=None, force_save=False, state=None):
+    "保存进度（state 默认为当前会话；空闲回收线程会传入被回收会话的状态）。返回云端是否已是最新"
+    state = st.session_state if state is None else state
     # 检查是否需要保存到云端（默认每10题保存一次，或强制保存）
-    answer_count = st.session_state.get('answer_count', 0)
+    answer_count = state.get('answer_count', 0)
     if not force_save and answer_count % 10 != 0:
-        return
-    
-    # 检查数据是否有变化
-    last_saved_data = st.session_state.get('last_saved_data', {})
-    data_changed = False
+        return False
     
-    # 比较关键数据是否变化
-    if last_saved_data.get('correct_ids') != progress_data['correct_ids']:
-        data_changed = True
-    elif last_saved_data.get('incorrect_ids') != progress_data['incorrect_ids']:
-        data_changed = True
-    elif last_saved_data.get('error_counts') != progress_data['error_counts']:
-        data_changed = True
-    elif last_saved_data.get('last_wrong_answers') != progress_data['last_wrong_answers']:
-        data_changed = True
+    # 检查数据是否有变化（与上次保存的进度指纹比较，会话中不再保留整份进度的副本）
+    fingerprint = session_memory.progress_fingerprint(progress_data)
+    data_changed = fingerprint != state.get('last_saved_fingerprint')
     
     if not data_changed and not force_save:
-        return  # 数据未变化，不需要保存到云端
+        return True  # 数据未变化，不需要保存到云端
     
-    # 保存到Google Sheets
-    client = get_google_sheets_client()
-    sheet = client.open_by_key(SPREADSHEET_ID).sheet1
+    # 保存到Google Sheets：读-合并-写；本机重试队列中的进度一并合并写回
+    crdt_state = session_crdt(state)
+    last_wrong = progress_data["last_wrong_answers"]
+    pending = local_store.pending_saves.get(user_id)
+    if pending:
+        crdt_state, last_wrong = progress_crdt.merge(crdt_state, pending['crdt'], last_wrong, pending['last_wrong'])
+        row_to_update = row_to_update or pending['row']
+    saved_at = time.time()
+    try:
+        row_to_update, revision, crdt_state, merged_data = write_progress(
+            user_id, row_to_update, crdt_state, last_wrong, state.get('progress_revision', 0)
+        )
+        state['user_row_id'] = row_to_update
+        state['progress_revision'] = revision
+        local_store.pending_saves.discard(user_id, enqueued_before=saved_at)
+        
+        # 会话采用合并后的进度（包含其他设备的作答），合并带来变化时刷新筛选缓存
+        merged_fingerprint = session_memory.progress_fingerprint(merged_data)
+        state['progress_crdt'] = crdt_state
+        for key in local_store.PROGRESS_KEYS:
+            state[key] = merged_data[key]
+        if merged_fingerprint != fingerprint:
+            state['filter_cache_invalid'] = True
+            state['error_cache_invalid'] = True
+        
+        # 保存成功后更新上次保存的进度指纹
+        state['last_saved_fingerprint'] = merged_fingerprint
+        return True
+    except Exception as e:
+
+# --- 题库加载函数（优化：改进缓存策略，预计算题型分类）---
+        # 保存失败（如配额用尽）的进度落盘到重试队列，由后台线程稍后写回云端，不会丢失
+        local_store.pending_saves.put(user_id, {
+            'row': row_to_update,
+            'revision': state.get('progress_revision', 0),
+            'crdt': crdt_state,
+            'last_wrong': last_wrong
+        }, e)
+        st.warning(f"保存到云端失败: {str(e)}（进度已保存在本地，稍后自动重试）")
+        return False
+
+# --- 模拟考试成绩读写 ---
+def get_exam_results_sheet(client):
+    "获取模拟考试成绩工作表，不存在时自动创建"
+    import gspread  # 延迟导入：只在首次访问云端时加载，不拖慢启动
+    spreadsheet = client.open_by_key(SPREADSHEET_ID)
+    try:
+        return spreadsheet.worksheet(EXAM_RESULTS_SHEET)
+    except gspread.exceptions.WorksheetNotFound:
+        sheet = spreadsheet.add_worksheet(title=EXAM_RESULTS_SHEET, rows=1000, cols=8)
+        sheet.append_row(["user_id", "finished_at", "paper_id", "question_ids", "answers", "score", "total", "duration_s"])
+        return sheet
+
+def load_exam_history(user_id, depth):
+    "读取用户最近几套试卷的题目ID（由组卷线程池在后台调用）"
+    sheet = get_exam_results_sheet(get_google_sheets_client())
+    rows = [cell.row for cell in sheet.findall(user_id, in_column=1)][-depth:]
+    if not rows:
+        return []
+    values = sheet.batch_get([f"D{row}" for row in rows])
+    return [json.loads(v[0][0]) for v in values if v and v[0] and v[0][0]]
+
+def save_exam_result(user_id, paper, answers, result):
+    "整卷成绩一次写入云端（单次 append_row）"
     row_data = [
         user_id,
-        json.dumps(list(progress_data["correct_ids"])),
-        json.dumps(list(progress_data["incorrect_ids"])),
-        json.dumps(progress_data["error_counts"]),
-        json.dumps(progress_data["last_wrong_answers"])
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+        paper['paper_id'],
+        json.dumps(paper['question_ids']),
+        json.dumps({str(q_id): sorted(letters) for q_id, letters in answers.items()}),
+        result['score'],
+        result['total'],
+        result['duration_s']
     ]
     try:
-        if row_to_update:
-            sheet.update(f'A{row_to_update}:E{row_to_update}', [row_data], value_input_option='USER_ENTERED')
-        else:
-            sheet.append_row(row_data, value_input_option='USER_ENTERED')
-        
-        # 保存成功后更新上次保存的数据
-        st.session_state['last_saved_data'] = {
-            'correct_ids': progress_data['correct_ids'].copy(),
-            'incorrect_ids': progress_data['incorrect_ids'].copy(),
-            'error_counts': progress_data['error_counts'].copy(),
-            'last_wrong_answers': progress_data['last_wrong_answers'].copy()
-        }
+        sheet = get_exam_results_sheet(get_google_sheets_client())
+        sheet.append_row(row_data, value_input_option='USER_ENTERED')
+        return True
     except Exception as e:
+        st.warning(f"考试成绩保存到云端失败: {str(e)}")
+        return False
 
-# --- 题库加载函数（优化：改进缓存策略，预计算题型分类）---
-        st.warning(f"保存到云端失败: {str(e)}")
+def timed(name, fn, *args, **kwargs):
+    "执行 fn 并把耗时记入启动耗时统计（可提交到线程池）"
+    started = time.time()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        startup_metrics.metrics.record(name, time.time() - started)
 
-# --- 题库加载函数（优化：改进缓存策略，预计算题型分类）---
+# --- 题库加载函数（进程级共享索引，题库文件变化时后台热加载）---
 def load_questions():
+    "获取共享题库索引（包含预计算的题型分类），各会话共用同一份，不重复解析"
     try:
-        with open("question_bank.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if not isinstance(data, list):
-            st.error("错误：题库文件必须是JSON数组格式！")
-            st.stop()
-        
-        normalized_questions = []
-        # 预计算不同题型的题目列表
-        all_questions = []
-        single_choice = []
-        multiple_choice = []
-        
-        for i, item in enumerate(data):
-            q_text = item.get('question') or item.get('题干')
-            options = item.get('options') or item.get('选项')
-            answer = item.get('answer') or item.get('正确答案')
-            
-            if not q_text or not options or not answer or not isinstance(options, list) or len(options) == 0:
-                continue
-            
-            # 判断是否为多选题（答案为数组格式或包含"|"分隔符）
-            is_multiple = isinstance(answer, list) or (isinstance(answer, str) and "|" in answer)
-            
-            # 标准化答案格式，多选题转集合，单选题转字符串
-            if isinstance(answer, list):
-                # 数组格式答案，如 ["B", "C", "D"]
-                standard_answer = set([str(a).strip().upper() for a in answer if str(a).strip().upper()])
-            elif "|" in str(answer):
-                # "|"分隔符格式，如 "A|B|C"
-                standard_answer = set([a.strip().upper() for a in str(answer).split("|") if a.strip().upper()])
-            else:
-                # 单选题，如 "A" 或 "B"
-                standard_answer = str(answer).strip().upper()
-            
-            explanation = item.get('explanation') or item.get('解析') or ''
-            question = {
-                'id': i,
-                'question': str(q_text),
-                'options': [str(opt) for opt in options],
-                'answer': standard_answer,  # 多选题存集合，单选题存字符串
-                'is_multiple': is_multiple,  # 标记是否为多选题
-                'original_answer': str(answer),  # 保留原始答案字符串（用于展示）
-                'explanation': str(explanation)
-            }
-            
-            normalized_questions.append(question)
-            all_questions.append(question)
-            if is_multiple:
-                multiple_choice.append(question)
-            else:
-                single_choice.append(question)
-        
-        if not normalized_questions:
-            st.error("错误：未加载到有效题目，请检查题库文件！")
-            st.stop()
-        
-        # 返回包含所有题型分类的结果
-        return {
-            'all': all_questions,
-            'single_choice': single_choice,
-            'multiple_choice': multiple_choice,
-            'total': len(all_questions),
-            'total_single': len(single_choice),
-            'total_multiple': len(multiple_choice)
-        }
-    except FileNotFoundError:
-        st.error("错误：未找到 question_bank.json 文件，请确认文件路径！")
-        st.stop()
-    except json.JSONDecodeError as e:
-        st.error(f"错误：题库文件格式错误，无法解析 JSON: {str(e)}")
+        question_index.start_watcher()
+        return question_index.get_index()
+    except QuestionBankError as e:
+        st.error(f"错误：{str(e)}")
         st.stop()
     except Exception as e:
         st.error(f"加载题库时发生错误: {str(e)}")
         st.stop()
 
+def sync_question_index():
+    "题库热加载后，会话在下次重跑时切换到新索引并按迁移映射改写进度中的题目ID"
+    index = load_questions()
+    old_version = st.session_state.get('index_version')
+    if old_version == index['version']:
+        return
+
+    mapping = question_index.migration_map(old_version)
+    progress_data = {
+        "correct_ids": st.session_state.correct_ids,
+        "incorrect_ids": st.session_state.incorrect_ids,
+        "error_counts": st.session_state.error_counts,
+        "last_wrong_answers": st.session_state.last_wrong_answers
+    }
+    question_index.remap_progress(progress_data, mapping)
+    progress_crdt.remap(session_crdt(), mapping)
+    st.session_state.correct_ids = progress_data["correct_ids"]
+    st.session_state.incorrect_ids = progress_data["incorrect_ids"]
+    st.session_state.error_counts = progress_data["error_counts"]
+    st.session_state.last_wrong_answers = progress_data["last_wrong_answers"]
+
+    # 当前批次换成新索引中的题目对象，已删除的题目从批次中移除
+    by_id = index['by_id']
+    current_idx = st.session_state.get('current_question_idx', 0)
+    new_batch = []
+    for pos, q in enumerate(st.session_state.get('current_batch', [])):
+        new_id = mapping.get(q['id'], q['id'])
+        if new_id in by_id:
+            new_batch.append(by_id[new_id])
+        elif pos < current_idx:
+            current_idx -= 1
+    st.session_state.current_batch = new_batch
+    st.session_state.current_question_idx = current_idx
+    st.session_state.submitted_answers = {
+        mapping.get(q_id, q_id): answer for q_id, answer in st.session_state.get('submitted_answers', {}).items()
+    }
+
+    st.session_state.all_questions = index['all']
+    st.session_state.questions_data = index
+    st.session_state.index_version = index['version']
+    st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True})
+
 # --- 答题批次生成函数 ---
 def generate_new_batch():
     """优化批次生成：减少重复计算，缓存过滤结果"""
@@ -397,20 +499,44 @@ def generate_new_batch():
     incorrect_ids = st.session_state.incorrect_ids
     correct_ids = st.session_state.correct_ids
     
+    # 有离线拟合的难度模型时，按难度升序遍历题目池，分类后的各列表天然有序，可直接二分挑题
+    import difficulty_model  # 延迟导入（依赖 NumPy），登录页不需要
+    model = difficulty_model.load_model()
+    difficulty = None
+    if model is not None:
+        pool_name = {'仅单选题': 'single_choice', '仅多选题': 'multiple_choice'}.get(question_type, 'all')
+        filtered_questions, difficulty = difficulty_model.sorted_pool(questions_data, pool_name, model)
+        target = difficulty_model.target_difficulty(
+            difficulty_model.estimate_ability(model, correct_ids, st.session_state.error_counts, incorrect_ids)
+        )
+    
     # 分类题目 - 优化：使用更高效的过滤方式
-    incorrect_questions = []
-    correct_questions = []
-    remaining_questions = []
+    incorrect_questions, incorrect_difficulty = [], []
+    correct_questions, correct_difficulty = [], []
+    remaining_questions, remaining_difficulty = [], []
     
     # 一次性遍历过滤后的题目，避免多次遍历
-    for q in filtered_questions:
+    for pos, q in enumerate(filtered_questions):
         q_id = q['id']
         if q_id in incorrect_ids:
-            incorrect_questions.append(q)
+            category, category_difficulty = incorrect_questions, incorrect_difficulty
         elif q_id in correct_ids:
-            correct_questions.append(q)
+            category, category_difficulty = correct_questions, correct_difficulty
         else:
-            remaining_questions.append(q)
+            category, category_difficulty = remaining_questions, remaining_difficulty
+        category.append(q)
+        if difficulty is not None:
+            category_difficulty.append(difficulty[pos])
+    
+    # 带种子的随机数生成器，种子记入会话追踪，重放时可得到相同的批次
+    seed = session_trace.batch_seed(st.session_state)
+    rng = random.Random(seed)
+    
+    def pick(questions, difficulties, count):
+        "有难度模型时挑选难度接近用户能力的题目，否则随机抽取"
+        if difficulty is None:
+            return rng.sample(questions, count)
+        return difficulty_model.pick_near(questions, difficulties, target, count, rng)
     
     # 生成批次 - 优化：避免不必要的extend操作
     new_batch = []
@@ -418,21 +544,22 @@ def generate_new_batch():
     # 添加错题（最多占一半）
     wrong_count = min(batch_size // 2, len(incorrect_questions))
     if wrong_count > 0:
-        new_batch.extend(random.sample(incorrect_questions, wrong_count))
+        new_batch.extend(pick(incorrect_questions, incorrect_difficulty, wrong_count))
     
     # 添加已做对的题目（最多占四分之一）
     review_count = min(batch_size // 4, len(correct_questions))
     if review_count > 0:
-        new_batch.extend(random.sample(correct_questions, review_count))
+        new_batch.extend(pick(correct_questions, correct_difficulty, review_count))
     
     # 添加新题目
     needed = batch_size - len(new_batch)
     if needed > 0 and remaining_questions:
-        new_batch.extend(random.sample(remaining_questions, min(needed, len(remaining_questions))))
+        new_batch.extend(pick(remaining_questions, remaining_difficulty, min(needed, len(remaining_questions))))
     
     # 洗牌并限制批次大小
-    random.shuffle(new_batch)
+    rng.shuffle(new_batch)
     new_batch = new_batch[:batch_size]
+    session_trace.action(st.session_state, 'batch', m="normal", seed=seed, h=session_trace.batch_fingerprint(new_batch))
     
     # 更新会话状态
     st.session_state.current_batch = new_batch
@@ -440,6 +567,8 @@ def generate_new_batch():
     st.session_state.submitted_answers = {}
     st.session_state.quiz_finished = not new_batch
     st.session_state.current_mode = "normal"
+    tidy_session_state()
+    checkpoint_session()
 
 def generate_error_batch():
     """优化错题批次生成：减少重复计算"""
@@ -499,7 +628,9 @@ def generate_error_batch():
     
     # 生成错题批次
     batch_size = min(100, len(error_questions))
-    error_batch = random.sample(error_questions, batch_size)
+    seed = session_trace.batch_seed(st.session_state)
+    error_batch = random.Random(seed).sample(error_questions, batch_size)
+    session_trace.action(st.session_state, 'batch', m="error", seed=seed, h=session_trace.batch_fingerprint(error_batch))
     
     # 更新会话状态
     st.session_state.current_batch = error_batch
@@ -507,6 +638,325 @@ def generate_error_batch():
     st.session_state.submitted_answers = {}
     st.session_state.quiz_finished = False
     st.session_state.current_mode = "error"
+    tidy_session_state()
+    checkpoint_session()
+
+def change_question_type():
+    "切换题目类型：使过滤缓存失效并生成新批次"
+    if not session_active():
+        return
+    with session_trace.step(st.session_state, 'type', v=st.session_state.question_type_select):
+        st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True})
+        if st.session_state.current_mode == "normal":
+            generate_new_batch()
+        else:
+            generate_error_batch()
+
+# --- 会话状态内存管理 ---
+def tidy_session_state():
+    "批次变化后清理会话状态：删除过期的答题控件键和非当前题型的缓存，并记录内存占用"
+    batch_ids = [q['id'] for q in st.session_state.get('current_batch', [])]
+    session_memory.evict_stale_widget_keys(st.session_state, batch_ids)
+    session_memory.evict_inactive_type_caches(st.session_state, st.session_state.get('question_type_select', '全部题目'))
+    exam = st.session_state.get('exam')
+    session_memory.evict_exam_widget_keys(st.session_state, exam['paper']['question_ids'] if exam else ())
+    record_session_footprint()
+
+def record_session_footprint():
+    "测量当前会话的状态占用并上报到进程内统计"
+    ctx = get_script_run_ctx()
+    if ctx is None or 'questions_data' not in st.session_state:
+        return
+    stats = session_memory.measure_session(st.session_state, st.session_state.questions_data)
+    session_memory.registry.record(ctx.session_id, st.session_state.get('user_id'), stats)
+
+def is_admin():
+    "管理员名单配置在 Streamlit Secrets 的 admin_ids 中"
+    try:
+        return st.session_state.get('user_id') in st.secrets.get("admin_ids", [])
+    except Exception:
+        return False
+
+def render_admin_panel():
+    "管理面板：展示本进程各会话的内存占用，并估算并发所需内存"
+    with st.expander("🛠️ 管理面板"):
+        record_session_footprint()
+        sessions = session_memory.registry.snapshot()
+        shared_bytes = session_memory.estimate_bytes(st.session_state.questions_data)
+        
+        st.write("**会话内存占用**")
+        col_mem1, col_mem2 = st.columns(2)
+        with col_mem1:
+            st.metric("活跃会话", len(sessions))
+        with col_mem2:
+            st.metric("会话合计", f"{sum(s['bytes'] for s in sessions) / 1024:.0f} KB")
+        st.caption(f"共享题库索引（所有会话共用）：{shared_bytes / 1024 / 1024:.1f} MB")
+        render_stats = render_cache.stats()
+        cache_stats = progress_cache.cache.stats()
+        st.caption(f"进度缓存：命中率 {cache_stats['hit_rate']}%（直接命中 {cache_stats['hits']}，校验后命中 {cache_stats['revalidated']}，未命中 {cache_stats['misses']}）")
+        st.caption(f"题目渲染缓存：选项排列命中 {render_stats['options'].hits} 次，答题结果命中 {render_stats['results'].hits} 次")
+        startup = startup_metrics.metrics.summary()
+        if startup:
+            names = {'time_to_first_question': "登录到出题", 'login_load': "登录加载", 'progress_fetch': "读取云端进度", 'index_load': "获取题库索引"}
+            st.caption("启动耗时（中位数 / P95）：" + "，".join(
+                f"{names.get(name, name)} {item['p50']:.2f}s / {item['p95']:.2f}s（{item['count']} 次）" for name, item in startup.items()
+            ))
+        
+        st.write("**Google Sheets 配额**")
+        # 多进程部署时配额由边车进程统一调度，统计也从边车进程读取
+        sheets_metrics = sheets_sidecar.connect().metrics() if sheets_sidecar.enabled() else sheets_scheduler.scheduler.metrics()
+        pending_stats = local_store.pending_saves.stats()
+        col_quota1, col_quota2, col_quota3 = st.columns(3)
+        with col_quota1:
+            st.metric("读配额余量/分钟", sheets_metrics['quota']['read']['headroom'], help=f"上限 {sheets_metrics['quota']['read']['per_minute']}")
+        with col_quota2:
+            st.metric("写配额余量/分钟", sheets_metrics['quota']['write']['headroom'], help=f"上限 {sheets_metrics['quota']['write']['per_minute']}")
+        with col_quota3:
+            st.metric("待重试保存", pending_stats['pending'], help=f"最早一条已等待 {pending_stats['oldest_age_s']} 秒，累计重试成功 {pending_stats['replayed']} 条")
+        st.dataframe([
+            {
+                "优先级": name,
+                "请求数": stats['calls'],
+                "限流等待": stats['throttled'],
+                "等待(秒)": stats['wait_s'],
+                "429次数": stats['quota_errors'],
+                "重试": stats['retries'],
+                "最终失败": stats['failures']
+            }
+            for name, stats in sheets_metrics['by_priority'].items()
+        ], hide_index=True)
+        
+        render_prewarm_panel()
+        
+        st.dataframe([
+            {
+                "用户": s['user_id'],
+                "占用(KB)": round(s['bytes'] / 1024, 1),
+                "状态键": s['keys'],
+                "控件键": s['widget_keys'],
+                "最大项": ", ".join(f"{key}({size // 1024}KB)" for key, size in s['largest'][:3])
+            }
+            for s in sessions
+        ], hide_index=True)
+        
+        concurrent = st.number_input("预计并发学员数", min_value=1, value=40, step=10)
+        estimate = session_memory.registry.capacity_estimate(concurrent)
+        st.write(f"预计需要内存：约 {(estimate + shared_bytes) / 1024 / 1024:.1f} MB（会话 {estimate / 1024 / 1024:.1f} MB + 共享题库）")
+
+def render_prewarm_panel():
+    "课前预热：按上课名单在开课前批量读取全班进度写入本地缓存，并预热本进程的题库索引"
+    st.write("**课前预热**")
+    with st.form("class_prewarm_form"):
+        roster = st.text_area("上课名单（每行一个用户ID）", height=100)
+        col_day, col_time = st.columns(2)
+        with col_day:
+            start_day = st.date_input("开课日期")
+        with col_time:
+            start_time = st.time_input("开课时间", step=300)
+        lead = st.number_input("提前预热（分钟）", min_value=1, max_value=class_prewarm.MAX_LEAD_MINUTES, value=class_prewarm.DEFAULT_LEAD_MINUTES)
+        if st.form_submit_button("安排预热"):
+            user_ids = list(dict.fromkeys(line.split(",")[0].strip() for line in roster.splitlines() if line.strip()))
+            if user_ids:
+                # 凭据在页面线程中读取，预热线程不访问 st.secrets
+                creds_dict = json.loads(st.secrets["google_credentials"])
+                start_at = datetime.datetime.combine(start_day, start_time).timestamp()
+                class_prewarm.scheduler.schedule(
+                    user_ids, start_at,
+                    lambda: sheets_scheduler.open_sheet1(lambda: sheets_scheduler.authorize(creds_dict), SPREADSHEET_ID),
+                    lead_minutes=lead
+                )
+                st.success(f"已安排：{len(user_ids)} 名学员，开课前 {lead} 分钟预热")
+            else:
+                st.warning("名单为空")
+    jobs = class_prewarm.scheduler.jobs()
+    if jobs:
+        st.dataframe([
+            {
+                "开课时间": time.strftime("%m-%d %H:%M", time.localtime(job['start_at'])),
+                "预热时间": time.strftime("%H:%M", time.localtime(job['run_at'])),
+                "学员数": len(job['users']),
+                "状态": job['status'],
+                "已缓存": job['result']['cached'] if job['result'] else "",
+                "新学员": len(job['result']['new_users']) if job['result'] else "",
+                "耗时(秒)": job['result']['seconds'] if job['result'] else "",
+                "错误": job['error'] or ""
+            }
+            for job in jobs
+        ], hide_index=True)
+
+# --- 空闲会话回收与恢复 ---
+def session_active():
+    "控件回调开头调用：登记活跃，会话已被空闲回收时返回 False（回调不再修改状态，随后的重跑从检查点恢复）"
+    track_session_activity()
+    return 'all_questions' in st.session_state
+
+def flush_idle_session(state):
+    "空闲回收前强制保存被回收会话的进度（在后台线程中调用）"
+    progress_to_save = {key: state[key] for key in local_store.PROGRESS_KEYS}
+    with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+        return save_progress(state['user_id'], progress_to_save, state.get('user_row_id'), force_save=True, state=state)
+
+def track_session_activity():
+    """记录会话活跃时间，并确保本进程的空闲回收线程已启动。
+    必须在读取会话状态之前调用（主脚本开头、控件回调开头）：会话正在被回收时在此等待回收完成"""
+    ctx = get_script_run_ctx()
+    if ctx is None or 'user_id' not in st.session_state:
+        return
+    idle_sessions.manager.start(IDLE_SESSION_TIMEOUT, flush_idle_session, on_evicted=session_memory.registry.forget)
+    if not sheets_sidecar.enabled():
+        # 多进程部署时由边车进程统一重试，各工作进程不再各自启动重试线程
+        local_store.pending_saves.start(replay_pending_save)
+    idle_sessions.manager.touch(ctx.session_id, st.session_state.user_id, ctx.session_state)
+
+# --- 答题记录统计 ---
+def render_answer_stats():
+    "侧边栏的答题记录：今日答题、连续天数、滚动正确率和每日图表（只读取预先累计的分桶）"
+    stats = st.session_state.get('answer_stats')
+    if stats is None:
+        stats = answer_history.history.load(st.session_state.user_id)
+        st.session_state['answer_stats'] = stats
+    st.markdown("---")
+    st.subheader("📈 学习记录")
+    today_answers, today_correct = answer_history.today_counts(stats)
+    accuracy = answer_history.rolling_accuracy(stats)
+    col_day, col_streak, col_accuracy = st.columns(3)
+    with col_day:
+        st.metric("今日答题", today_answers, help=f"今日答对 {today_correct} 题")
+    with col_streak:
+        st.metric("连续天数", answer_history.current_streak(stats), help=f"最长连续 {stats['best_streak']} 天")
+    with col_accuracy:
+        st.metric(
+            "近期正确率", "-" if accuracy is None else f"{accuracy * 100:.0f}%",
+            help=f"最近 {len(stats['ring'])} 次作答；当前连对 {stats['run']} 题，最长连对 {stats['best_run']} 题"
+        )
+    if stats['total']:
+        with st.expander("每日答题与正确率"):
+            labels, answers, daily_accuracy = answer_history.daily_series(stats)
+            st.bar_chart({'日期': labels, '答题数': answers}, x='日期', y='答题数', height=180)
+            st.line_chart({'日期': labels, '正确率(%)': daily_accuracy}, x='日期', y='正确率(%)', height=180)
+            st.caption("最近作答：" + " ".join(
+                f"{'✅' if ok else '❌'}{q_id}" for _, q_id, ok in answer_history.recent_timeline(stats, limit=10)
+            ))
+
+# --- 本地检查点（断线重连后继续当前批次）---
+def session_crdt(state=None):
+    "会话的可合并进度（CRDT）状态；旧会话没有时由当前进度转换"
+    state = st.session_state if state is None else state
+    if state.get('progress_crdt') is None:
+        state['progress_crdt'] = progress_crdt.from_progress({key: state[key] for key in local_store.PROGRESS_KEYS})
+    return state['progress_crdt']
+
+def record_progress(question_id, is_correct):
+    "把一次作答（或标记已掌握）记入本设备的 CRDT 状态，返回写入时间戳"
+    device_id = local_store.ensure_device_id(st.session_state)
+    crdt_state = progress_crdt.record(session_crdt(), question_id, is_correct, device_id)
+    return crdt_state['q'][str(question_id)][1]
+
+def current_progress():
+    "当前会话的进度数据（引用会话中的对象，不复制）"
+    return {key: st.session_state[key] for key in local_store.PROGRESS_KEYS}
+
+def trace_session_start(source):
+    "追踪开启时记录登录后的初始进度行（重放时作为存储中的初始数据）"
+    if session_trace.enabled():
+        row = progress_rows.encode_progress_row(
+            st.session_state.user_id, current_progress(), st.session_state.get('progress_revision', 0), session_crdt()
+        )
+        session_trace.action(st.session_state, 'start', src=source, row=row)
+
+def checkpoint_session():
+    "把当前会话的完整快照写入本地检查点（批次变化、错题本操作时调用）"
+    device_id = local_store.ensure_device_id(st.session_state)
+    local_store.checkpoints.snapshot(st.session_state.user_id, device_id, local_store.pack_session(st.session_state))
+    st.session_state['checkpoint_events'] = 0
+
+def checkpoint_event(event):
+    "追加一条检查点事件；事件累积过多时改写为完整快照"
+    events = st.session_state.get('checkpoint_events', 0) + 1
+    if events >= local_store.checkpoints.SNAPSHOT_EVERY:
+        checkpoint_session()
+    else:
+        local_store.checkpoints.append_event(st.session_state.user_id, local_store.ensure_device_id(st.session_state), event)
+        st.session_state['checkpoint_events'] = events
+
+def record_answer(question_id, user_answer, is_correct):
+    "记录一次作答：更新学习进度和答题计数、写入本地检查点，并按批量策略保存到云端"
+    with session_trace.step(st.session_state, 'answer', q=question_id, ans=user_answer, ok=is_correct):
+        local_store.apply_answer(st.session_state, question_id, is_correct, user_answer)
+        ts = record_progress(question_id, is_correct)
+        st.session_state['answer_count'] = st.session_state.get('answer_count', 0) + 1
+        checkpoint_event({'t': 'a', 'q': question_id, 'ans': user_answer, 'ok': is_correct, 'ts': ts})
+        st.session_state['answer_stats'] = answer_history.history.record(st.session_state.user_id, question_id, is_correct)
+        save_progress(st.session_state.user_id, current_progress(), st.session_state.user_row_id)
+
+def go_to_question(idx):
+    "翻到指定题目，并记录到本地检查点"
+    if not session_active():
+        return
+    with session_trace.step(st.session_state, 'goto', i=idx):
+        st.session_state.current_question_idx = idx
+        checkpoint_event({'t': 'p', 'i': idx})
+
+def restore_checkpoint():
+    """登录或会话被回收后优先从本地检查点恢复当前批次；没有可用检查点时返回 False。
+    被回收的会话保留了设备ID，恢复本设备的检查点，回收前进度已强制保存到云端，不再读取云端；
+    新登录的会话取该用户最近的检查点，以新的设备ID继续，云端进度在后台读取后再合并"""
+    user_id = st.session_state.user_id
+    evicted = bool(st.session_state.get('device_id'))
+    payload = local_store.checkpoints.load(user_id, st.session_state.get('device_id'), max_age=CHECKPOINT_MAX_AGE)
+    if payload is None:
+        return False
+    local_store.ensure_device_id(st.session_state)
+    
+    questions_data = load_questions()
+    local_store.unpack_session(st.session_state, payload, questions_data)
+    st.session_state.all_questions = questions_data['all']
+    st.session_state.questions_data = questions_data
+    if not evicted:
+        st.session_state['cloud_reconcile'] = background_jobs.submit(
+            sheets_scheduler.with_priority, sheets_scheduler.BACKGROUND, fetch_progress_row, user_id
+        )
+    
+    if not st.session_state.current_batch and not st.session_state.quiz_finished:
+        if st.session_state.current_mode == "normal":
+            generate_new_batch()
+        else:
+            generate_error_batch()
+    else:
+        checkpoint_session()
+    st.info(f"♻️ 欢迎回来, {user_id}！已从本地恢复你上次的答题进度。")
+    return True
+
+def reconcile_with_cloud():
+    "检查点恢复后的云端对账：后台读取完成后，若云端被其他设备更新过，则与本地进度做无冲突合并"
+    future = st.session_state.get('cloud_reconcile')
+    if future is None or not future.done():
+        return
+    del st.session_state['cloud_reconcile']
+    try:
+        cloud_data, row_id, revision, _, cloud_crdt = future.result()
+    except Exception:
+        return  # 云端暂不可用，继续使用本地检查点，下次保存时再同步
+    if row_id:
+        st.session_state.user_row_id = row_id
+    if cloud_data is None:
+        return
+    st.session_state['progress_revision'] = max(revision, st.session_state.get('progress_revision', 0))
+    cloud_fingerprint = session_memory.progress_fingerprint(cloud_data)
+    if cloud_fingerprint == st.session_state.get('last_saved_fingerprint'):
+        return  # 云端自上次保存后没有变化，本地检查点即为最新
+    
+    crdt_state, last_wrong = progress_crdt.merge(
+        session_crdt(), cloud_crdt, st.session_state.last_wrong_answers, cloud_data["last_wrong_answers"]
+    )
+    merged = progress_crdt.materialize(crdt_state, last_wrong)
+    st.session_state['progress_crdt'] = crdt_state
+    for key in local_store.PROGRESS_KEYS:
+        st.session_state[key] = merged[key]
+    # 以云端版本为已保存基准，合并结果在下次保存时写回云端
+    st.session_state['last_saved_fingerprint'] = cloud_fingerprint
+    st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True})
+    checkpoint_session()
 
 # --- 辅助函数 ---
 def reset_user_progress():
@@ -516,8 +966,14 @@ def reset_user_progress():
         "error_counts": {}, 
         "last_wrong_answers": {}
     }
-    save_progress(st.session_state.user_id, empty_data, st.session_state.user_row_id)
+    # 记录重置时间，合并时其他设备在重置之前的作答一并作废
+    progress_crdt.reset(session_crdt())
+    save_progress(st.session_state.user_id, empty_data, st.session_state.user_row_id, force_save=True)
+    local_store.checkpoints.delete(st.session_state.user_id)
     st.success("🗑️ 所有进度已重置！")
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        session_memory.registry.forget(ctx.session_id)
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     st.rerun()
@@ -527,8 +983,157 @@ def paginate_list(data, page_num, page_size):
     end_idx = start_idx + page_size
     return data[start_idx:end_idx], len(data)
 
+# --- 模拟考试页面 ---
+def exam_selected_options(q):
+    "读取考试控件当前选中的选项"
+    if q['is_multiple']:
+        return [opt for opt in q['options'] if st.session_state.get(f"exam_{q['id']}_opt_{opt[:5]}")]
+    choice = st.session_state.get(f"exam_{q['id']}")
+    return [choice] if choice else []
+
+def record_exam_answer(q_id):
+    "考试作答控件的回调：只记录截止时间之前的作答，截止后的改动不计分"
+    if not session_active():
+        return
+    exam = st.session_state.get('exam')
+    if exam is None or time.time() >= exam['deadline']:
+        return
+    q = st.session_state.questions_data['by_id'].get(q_id)
+    if q is not None:
+        exam['answers'][q_id] = sorted(render_cache.option_letter(opt) for opt in exam_selected_options(q))
+
+def end_exam():
+    "结束考试：清除试卷和考试控件键"
+    st.session_state.exam = None
+    session_memory.evict_exam_widget_keys(st.session_state)
+    checkpoint_session()
+
+def finish_exam(auto_submitted=False):
+    "交卷：按截止前记录的答案整卷评分并一次写入成绩；自动交卷时用时按考试时限计"
+    import exam_papers
+    exam = st.session_state.exam
+    answers = {q_id: set(letters) for q_id, letters in exam['answers'].items()}
+    result = exam_papers.grade_paper(exam['paper'], answers)
+    result['duration_s'] = int(min(time.time(), exam['deadline']) - exam['started_at'])
+    result['auto_submitted'] = auto_submitted
+    save_exam_result(st.session_state.user_id, exam['paper'], answers, result)
+    st.session_state.exam_result = result
+    end_exam()
+
+@st.fragment(run_every=EXAM_TICK_SECONDS)
+def exam_countdown():
+    "考试倒计时（定时局部刷新）；到达时限时整页重跑，由 render_exam_tab 自动交卷"
+    exam = st.session_state.get('exam')
+    if exam is None:
+        return
+    remaining = exam['deadline'] - time.time()
+    if remaining <= 0:
+        st.rerun()
+    st.info(f"⏳ 剩余时间：约 {int(remaining // 60)} 分 {int(remaining % 60)} 秒（截止 {time.strftime('%H:%M', time.localtime(exam['deadline']))}，到时自动交卷）")
+
+@st.fragment
+def render_exam_paper():
+    "试卷（局部重跑：每次作答只重跑试卷本身，不重跑整个页面）；截止后控件锁定"
+    exam = st.session_state.get('exam')
+    if exam is None:
+        return
+    locked = time.time() >= exam['deadline']
+    by_id = st.session_state.questions_data['by_id']
+    for n, q_id in enumerate(exam['paper']['question_ids'], 1):
+        q = by_id.get(q_id)
+        if q is None:
+            continue
+        type_text = "多选" if q['is_multiple'] else "单选"
+        st.write(f"**{n}. （{type_text}）{q['question']}**")
+        if q['is_multiple']:
+            for opt in q['options']:
+                st.checkbox(opt, key=f"exam_{q_id}_opt_{opt[:5]}", disabled=locked, on_change=record_exam_answer, args=(q_id,))
+        else:
+            st.radio(
+                f"第 {n} 题答案", q['options'], key=f"exam_{q_id}", index=None, label_visibility="collapsed",
+                disabled=locked, on_change=record_exam_answer, args=(q_id,)
+            )
+    if st.button("📤 交卷", type="primary") or locked:
+        finish_exam(auto_submitted=locked)
+        st.rerun()
+
+def render_exam_tab():
+    "模拟考试：开始时直接取用后台预生成的试卷，交卷时整卷评分并一次写入成绩"
+    st.header("⏱️ 模拟考试")
+    st.markdown("---")
+
+    import exam_papers  # 延迟导入（依赖 NumPy），登录页不需要
+    user_id = st.session_state.user_id
+    questions_data = st.session_state.questions_data
+    exam_config = exam_papers.DEFAULT_EXAM_CONFIG
+    exam = st.session_state.get('exam')
+    if exam is None:
+        # 后台预生成试卷（首次还会在后台读取最近试卷用于去重）
+        exam_papers.paper_pool.prefetch(
+            user_id, questions_data, exam_config,
+            history_loader=lambda: sheets_scheduler.with_priority(
+                sheets_scheduler.BACKGROUND, load_exam_history, user_id, exam_config.history_depth
+            )
+        )
+
+        result = st.session_state.get('exam_result')
+        if result:
+            st.subheader("📋 上次考试成绩")
+            col_res1, col_res2, col_res3 = st.columns(3)
+            with col_res1:
+                st.metric("得分", f"{result['score']}/{result['total']}")
+            with col_res2:
+                st.metric("正确率", f"{result['accuracy']}%")
+            with col_res3:
+                st.metric("用时", f"{result['duration_s'] // 60} 分钟")
+            st.write(f"单选题：{result['single_correct']}/{result['single_total']}　多选题：{result['multiple_correct']}/{result['multiple_total']}")
+            if result.get('auto_submitted'):
+                st.warning("⏰ 已到考试时限，系统已按截止前的作答自动交卷")
+            by_id = questions_data['by_id']
+            wrong_questions = [by_id[q_id] for q_id in result['wrong_ids'] if q_id in by_id]
+            if wrong_questions:
+                with st.expander(f"❌ 查看错题（{len(wrong_questions)} 道）"):
+                    for q in wrong_questions:
+                        st.write(f"**{q['question']}**")
+                        correct_letters = q['answer'] if q['is_multiple'] else {q['answer']}
+                        correct_texts = [opt for opt in q['options'] if opt.split(".")[0].strip().upper() in correct_letters]
+                        st.markdown(f"✅ 正确答案：<span style='color:green'>{', '.join(correct_texts)}</span>", unsafe_allow_html=True)
+                        st.markdown("---")
+            st.divider()
+
+        single_count = exam_config.size - exam_config.multiple_count
+        st.write(f"每套试卷 {exam_config.size} 题（单选 {single_count} 道，多选 {exam_config.multiple_count} 道），限时 {exam_config.time_limit_min} 分钟。")
+        st.caption(f"试题覆盖题库各部分，且不与你最近 {exam_config.history_depth} 套试卷重复。")
+        if st.button("🚀 开始考试", type="primary"):
+            paper = exam_papers.paper_pool.take(user_id, questions_data, exam_config)
+            started_at = time.time()
+            st.session_state.exam = {
+                'paper': paper,
+                'started_at': started_at,
+                'deadline': started_at + exam_config.time_limit_min * 60,
+                'answers': {}  # 题目ID -> 选中的字母列表，只记录截止时间之前的作答
+            }
+            st.session_state.exam_result = None
+            checkpoint_session()
+            st.rerun()
+        return
+
+    if time.time() >= exam['deadline']:
+        # 已到考试时限（倒计时触发的重跑或任何一次重跑）：按截止前记录的答案自动交卷
+        finish_exam(auto_submitted=True)
+        st.rerun()
+
+    exam_countdown()
+    render_exam_paper()
+
+    if st.button("🚫 放弃本次考试", type="secondary"):
+        end_exam()
+        st.rerun()
+
 # --- 主应用逻辑 ---
 def main():
+    # 先登记活跃（等待可能正在进行的空闲回收完成），再读取任何会话状态
+    track_session_activity()
     st.title("✈️ 飞机人电子系统刷题系统")
     st.markdown(f"### 适配{TOTAL_QUESTIONS}道海量题库 | 错题本独立管理 | 支持单选/多选")
     st.divider()
@@ -543,19 +1148,35 @@ def main():
                 submitted = st.form_submit_button("登录", type="primary")
                 if submitted and user_id:
                     st.session_state.user_id = user_id
+                    st.session_state['login_started_at'] = time.time()
+                    session_trace.action(st.session_state, 'login', u=user_id)
                     st.rerun()
                 elif submitted:
                     st.warning("请输入昵称/ID后登录！")
+        # 登录表单已渲染，趁用户输入时在后台预先构建题库索引（进程内只构建一次）
+        background_jobs.submit(question_index.get_index)
         return
 
+    # 断线重连、空闲回收后返回的会话，优先从本地检查点恢复，不等待云端
+    if 'all_questions' not in st.session_state:
+        if restore_checkpoint():
+            trace_session_start("checkpoint")
+
     # 初始化数据
     if 'all_questions' not in st.session_state:
-        progress_data, row_id = load_progress(st.session_state.user_id)
-        if progress_data is None:
-            return
+        # 云端进度读取和题库加载并发进行：进度在后台线程池读取，题库索引同时在当前线程获取（通常已在登录页预先构建）
+        login_phase_started = time.time()
+        fetched = background_jobs.submit(
+            timed, 'progress_fetch', sheets_scheduler.with_priority, sheets_scheduler.LOGIN, fetch_progress_row, st.session_state.user_id
+        )
         
         # 加载题库数据（包含预计算的题型分类）
-        questions_data = load_questions()
+        questions_data = timed('index_load', load_questions)
+        
+        progress_data, row_id = load_progress(st.session_state.user_id, fetched)
+        if progress_data is None:
+            return
+        startup_metrics.metrics.record('login_load', time.time() - login_phase_started)
         all_questions = questions_data['all']
         
         # 保存完整题库和预计算的题型分类到会话状态
@@ -566,23 +1187,29 @@ def main():
         st.session_state.error_counts = progress_data["error_counts"]
         st.session_state.last_wrong_answers = progress_data["last_wrong_answers"]
         st.session_state.user_row_id = row_id
+        st.session_state.index_version = questions_data['version']
         st.session_state.current_mode = "normal"
         
-        # 初始化上次保存的数据，用于增量更新检测
-        st.session_state['last_saved_data'] = {
-            'correct_ids': progress_data['correct_ids'].copy(),
-            'incorrect_ids': progress_data['incorrect_ids'].copy(),
-            'error_counts': progress_data['error_counts'].copy(),
-            'last_wrong_answers': progress_data['last_wrong_answers'].copy()
-        }
+        # 初始化上次保存的进度指纹，用于增量更新检测
+        st.session_state['last_saved_fingerprint'] = session_memory.progress_fingerprint(progress_data)
+        
+        # 旧版进度迁移到稳定ID后立即回写，避免题库变动后再次按下标迁移出错
+        if st.session_state.pop('legacy_progress_migrated', False):
+            save_progress(st.session_state.user_id, progress_data, row_id, force_save=True)
+        
+        trace_session_start("cloud")
         
         # 显示加载成功信息
         st.success(f"✅ 题库加载完成（共 {questions_data['total']} 道有效题目，包含单选题 {questions_data['total_single']} 道，多选题 {questions_data['total_multiple']} 道）")
         
         generate_new_batch()
+    else:
+        # 题库热加载后切换到新索引（只比较版本号，不重新解析题库）
+        sync_question_index()
+        reconcile_with_cloud()
 
     # 主标签页
-    tab1, tab2 = st.tabs(["📝 答题练习", "📚 错题本"])
+    tab1, tab2, tab3 = st.tabs(["📝 答题练习", "📚 错题本", "⏱️ 模拟考试"])
 
     # 答题练习标签页
     with tab1:
@@ -595,10 +1222,11 @@ def main():
             col_btn1, col_btn2 = st.columns(2)
             with col_btn1:
                 if st.button("🔄 刷新批次", type="primary"):
-                    if st.session_state.current_mode == "normal":
-                        generate_new_batch()
-                    else:
-                        generate_error_batch()
+                    with session_trace.step(st.session_state, 'refresh'):
+                        if st.session_state.current_mode == "normal":
+                            generate_new_batch()
+                        else:
+                            generate_error_batch()
                     st.rerun()
             with col_btn2:
                 st.button("📚 去错题本", type="secondary", help="点击上方「错题本」标签页查看")
@@ -611,12 +1239,7 @@ def main():
                 ["全部题目", "仅单选题", "仅多选题"],
                 key="question_type_select",
                 help="选择你想要练习的题目类型",
-                on_change=lambda: (
-                    # 使缓存失效
-                    st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True}),
-                    # 生成新批次
-                    generate_new_batch() if st.session_state.current_mode == "normal" else generate_error_batch()
-                )
+                on_change=change_question_type
             )
             
             # 学习进度显示
@@ -638,6 +1261,8 @@ def main():
             if total_q > 0:
                 st.progress(correct_q / total_q, text=f"掌握率：{round(correct_q/total_q*100, 1)}%")
             
+            render_answer_stats()
+            
             # 高级操作
             st.markdown("---")
             st.subheader("⚠️ 高级操作")
@@ -655,6 +1280,10 @@ def main():
                     if st.button("❌ 取消"):
                         st.session_state.show_reset_confirm = False
                         st.rerun()
+            
+            if is_admin():
+                st.markdown("---")
+                render_admin_panel()
 
         # 答题逻辑
         if st.session_state.quiz_finished:
@@ -664,10 +1293,11 @@ def main():
             col_fin1, col_fin2 = st.columns(2)
             with col_fin1:
                 if st.button("🔄 继续练习", type="primary"):
-                    if st.session_state.current_mode == "normal":
-                        generate_new_batch()
-                    else:
-                        generate_error_batch()
+                    with session_trace.step(st.session_state, 'continue'):
+                        if st.session_state.current_mode == "normal":
+                            generate_new_batch()
+                        else:
+                            generate_error_batch()
                     st.rerun()
             with col_fin2:
                 st.button("📚 去错题本", type="secondary", help="点击上方「错题本」标签页查看")
@@ -698,6 +1328,12 @@ def main():
         question_id = current_question['id']
         is_multiple = current_question['is_multiple']  # 获取是否为多选题
         
+        # 登录后第一次显示题目：记录从点击登录到出题的耗时
+        login_started_at = st.session_state.pop('login_started_at', None)
+        if login_started_at is not None:
+            st.session_state['time_to_first_question'] = time.time() - login_started_at
+            startup_metrics.metrics.record('time_to_first_question', st.session_state['time_to_first_question'])
+        
         st.subheader(f"本轮进度：{current_idx + 1}/{len(current_batch)} 题")
         st.write(f"### {current_question['question']}")
         
@@ -711,10 +1347,8 @@ def main():
         user_answer_data = st.session_state.submitted_answers.get(question_id)
 
         # 选项乱序显示（在所有情况下都定义options变量）
-        options = current_question["options"].copy()
-        # 使用question_id作为随机种子，确保每次刷新页面时选项顺序一致
-        random.seed(question_id)
-        random.shuffle(options)
+        # 以question_id为种子的固定排列，由渲染缓存预计算，不改动全局随机数状态
+        options = render_cache.shuffled_options(current_question)
 
         # 自适应渲染单选/多选组件
         if not is_submitted:
@@ -759,29 +1393,8 @@ def main():
                     user_answer_letter = user_answer.split(".")[0].strip().upper()
                     is_correct = user_answer_letter == current_question["answer"]
                 
-                # 更新学习进度
-                if is_correct:
-                    st.session_state.correct_ids.add(question_id)
-                    st.session_state.incorrect_ids.discard(question_id)
-                    st.session_state.error_counts.pop(str(question_id), None)
-                    st.session_state.last_wrong_answers.pop(str(question_id), None)
-                else:
-                    st.session_state.incorrect_ids.add(question_id)
-                    st.session_state.correct_ids.discard(question_id)
-                    st.session_state.error_counts[str(question_id)] = st.session_state.error_counts.get(str(question_id), 0) + 1
-                    st.session_state.last_wrong_answers[str(question_id)] = user_answer
-                
-                # 更新答题计数
-                st.session_state['answer_count'] = st.session_state.get('answer_count', 0) + 1
-                
-                # 保存进度（使用批量保存机制）
-                progress_to_save = {
-                    "correct_ids": st.session_state.correct_ids,
-                    "incorrect_ids": st.session_state.incorrect_ids,
-                    "error_counts": st.session_state.error_counts,
-                    "last_wrong_answers": st.session_state.last_wrong_answers
-                }
-                save_progress(st.session_state.user_id, progress_to_save, st.session_state.user_row_id)
+                # 更新学习进度、写入本地检查点并按批量策略保存到云端
+                record_answer(question_id, user_answer, is_correct)
                 
                 # 使缓存失效，下次生成批次时重新过滤
                 st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True})
@@ -818,29 +1431,8 @@ def main():
                         correct_letters = current_question["answer"]
                         is_correct = user_answer_letters == correct_letters
                         
-                        # 更新学习进度
-                        if is_correct:
-                            st.session_state.correct_ids.add(question_id)
-                            st.session_state.incorrect_ids.discard(question_id)
-                            st.session_state.error_counts.pop(str(question_id), None)
-                            st.session_state.last_wrong_answers.pop(str(question_id), None)
-                        else:
-                            st.session_state.incorrect_ids.add(question_id)
-                            st.session_state.correct_ids.discard(question_id)
-                            st.session_state.error_counts[str(question_id)] = st.session_state.error_counts.get(str(question_id), 0) + 1
-                            st.session_state.last_wrong_answers[str(question_id)] = user_answer
-                        
-                        # 更新答题计数
-                        st.session_state['answer_count'] = st.session_state.get('answer_count', 0) + 1
-                        
-                        # 保存进度（使用批量保存机制）
-                        progress_to_save = {
-                            "correct_ids": st.session_state.correct_ids,
-                            "incorrect_ids": st.session_state.incorrect_ids,
-                            "error_counts": st.session_state.error_counts,
-                            "last_wrong_answers": st.session_state.last_wrong_answers
-                        }
-                        save_progress(st.session_state.user_id, progress_to_save, st.session_state.user_row_id)
+                        # 更新学习进度、写入本地检查点并按批量策略保存到云端
+                        record_answer(question_id, user_answer, is_correct)
                         
                         # 使缓存失效，下次生成批次时重新过滤
                         st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True})
@@ -865,29 +1457,8 @@ def main():
                         user_answer_letter = user_answer.split(".")[0].strip().upper()
                         is_correct = user_answer_letter == current_question["answer"]
                         
-                        # 更新学习进度
-                        if is_correct:
-                            st.session_state.correct_ids.add(question_id)
-                            st.session_state.incorrect_ids.discard(question_id)
-                            st.session_state.error_counts.pop(str(question_id), None)
-                            st.session_state.last_wrong_answers.pop(str(question_id), None)
-                        else:
-                            st.session_state.incorrect_ids.add(question_id)
-                            st.session_state.correct_ids.discard(question_id)
-                            st.session_state.error_counts[str(question_id)] = st.session_state.error_counts.get(str(question_id), 0) + 1
-                            st.session_state.last_wrong_answers[str(question_id)] = user_answer
-                        
-                        # 更新答题计数
-                        st.session_state['answer_count'] = st.session_state.get('answer_count', 0) + 1
-                        
-                        # 保存进度
-                        progress_to_save = {
-                            "correct_ids": st.session_state.correct_ids,
-                            "incorrect_ids": st.session_state.incorrect_ids,
-                            "error_counts": st.session_state.error_counts,
-                            "last_wrong_answers": st.session_state.last_wrong_answers
-                        }
-                        save_progress(st.session_state.user_id, progress_to_save, st.session_state.user_row_id)
+                        # 更新学习进度、写入本地检查点并按批量策略保存到云端
+                        record_answer(question_id, user_answer, is_correct)
                         
                         # 使缓存失效，下次生成批次时重新过滤
                         st.session_state.update({'filter_cache_invalid': True, 'error_cache_invalid': True})
@@ -915,54 +1486,17 @@ def main():
             
             # 核心修改5：提交后展示正确/错误结果（适配单选/多选）
             st.divider()
-            if is_multiple:
-                # 多选题结果展示
-                user_answer_letters = set([opt.split(".")[0].strip().upper() for opt in user_answer_data])
-                correct_letters = current_question["answer"]
-                is_correct = user_answer_letters == correct_letters
-                
-                if is_correct:
-                    st.success("🎉 回答正确！")
-                else:
-                    st.error("❌ 回答错误！")
-                
-                # 显示每个选项的正确/错误状态
-                st.write("#### 答题情况：")
-                for opt in options:
-                    opt_letter = opt.split(".")[0].strip().upper()
-                    if opt_letter in correct_letters:
-                        # 正确答案，使用绿色背景和加粗字体
-                        st.markdown(f"<div style='background-color: #d1fae5; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0; font-weight: bold;'>✅ {opt}</div>", unsafe_allow_html=True)
-                    elif opt in user_answer_data:
-                        # 用户选择的错误答案，使用红色背景
-                        st.markdown(f"<div style='background-color: #fee2e2; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0;'>❌ {opt}</div>", unsafe_allow_html=True)
-                    else:
-                        # 未选择的错误答案，使用灰色背景
-                        st.markdown(f"<div style='background-color: #f3f4f6; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0;'>{opt}</div>", unsafe_allow_html=True)
+            # 判定结果和每个选项的正确/错误状态HTML按（题目, 作答）缓存，重跑时不再重复构建
+            is_correct, result_html = render_cache.result_view(current_question, user_answer_data)
+            
+            if is_correct:
+                st.success("🎉 回答正确！")
             else:
-                # 单选题结果展示
-                user_answer_letter = user_answer_data.split(".")[0].strip().upper()
-                correct_answer_letter = current_question["answer"]
-                is_correct = user_answer_letter == correct_answer_letter
-                
-                if is_correct:
-                    st.success("🎉 回答正确！")
-                else:
-                    st.error("❌ 回答错误！")
-                
-                # 显示每个选项的正确/错误状态
-                st.write("#### 答题情况：")
-                for opt in options:
-                    opt_letter = opt.split(".")[0].strip().upper()
-                    if opt_letter == correct_answer_letter:
-                        # 正确答案，使用绿色背景和加粗字体
-                        st.markdown(f"<div style='background-color: #d1fae5; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0; font-weight: bold;'>✅ {opt}</div>", unsafe_allow_html=True)
-                    elif opt == user_answer_data:
-                        # 用户选择的错误答案，使用红色背景
-                        st.markdown(f"<div style='background-color: #fee2e2; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0;'>❌ {opt}</div>", unsafe_allow_html=True)
-                    else:
-                        # 未选择的错误答案，使用灰色背景
-                        st.markdown(f"<div style='background-color: #f3f4f6; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0;'>{opt}</div>", unsafe_allow_html=True)
+                st.error("❌ 回答错误！")
+            
+            # 显示每个选项的正确/错误状态
+            st.write("#### 答题情况：")
+            st.markdown(result_html, unsafe_allow_html=True)
             
             # 显示解析
             if current_question.get("explanation"):
@@ -970,7 +1504,7 @@ def main():
                 st.info(f"📖 解析：{current_question['explanation']}")
             
             # 下一题按钮
-            st.button("➡️ 下一题", on_click=lambda: st.session_state.update({"current_question_idx": current_idx + 1}), type="primary")
+            st.button("➡️ 下一题", on_click=go_to_question, args=(current_idx + 1,), type="primary")
 
     # 错题本标签页（核心修改6：适配多选题错题展示）
     with tab2:
@@ -995,7 +1529,8 @@ def main():
         col_btn1, col_btn2, col_btn3 = st.columns(3)
         with col_btn1:
             if st.button("🚀 专项练习错题", type="primary", disabled=len(error_questions)==0):
-                generate_error_batch()
+                with session_trace.step(st.session_state, 'error_practice'):
+                    generate_error_batch()
                 st.success("✅ 错题练习批次已生成！请切换到「答题练习」标签页开始练习～")
         with col_btn2:
             if st.button("🧹 清空已订正错题", type="secondary", disabled=mastered_error==0):
@@ -1009,6 +1544,7 @@ def main():
                 
                 st.session_state.error_counts = new_error_counts
                 st.session_state.last_wrong_answers = new_last_wrong
+                checkpoint_session()
                 progress_to_save = {
                     "correct_ids": st.session_state.correct_ids,
                     "incorrect_ids": st.session_state.incorrect_ids,
@@ -1071,18 +1607,21 @@ def main():
                         st.markdown(f"#### 📖 解析：{q['explanation']}", unsafe_allow_html=True)
                     
                     if st.button(f"✅ 标记为已掌握", key=f"master_{q['id']}"):
-                        st.session_state.correct_ids.add(q['id'])
-                        st.session_state.incorrect_ids.discard(q['id'])
-                        st.session_state.error_counts.pop(q_id_str, None)
-                        st.session_state.last_wrong_answers.pop(q_id_str, None)
-                        
-                        progress_to_save = {
-                            "correct_ids": st.session_state.correct_ids,
-                            "incorrect_ids": st.session_state.incorrect_ids,
-                            "error_counts": st.session_state.error_counts,
-                            "last_wrong_answers": st.session_state.last_wrong_answers
-                        }
-                        save_progress(st.session_state.user_id, progress_to_save, st.session_state.user_row_id)
+                        with session_trace.step(st.session_state, 'master', q=q['id']):
+                            st.session_state.correct_ids.add(q['id'])
+                            st.session_state.incorrect_ids.discard(q['id'])
+                            st.session_state.error_counts.pop(q_id_str, None)
+                            st.session_state.last_wrong_answers.pop(q_id_str, None)
+                            record_progress(q['id'], True)
+                            checkpoint_session()
+                            
+                            progress_to_save = {
+                                "correct_ids": st.session_state.correct_ids,
+                                "incorrect_ids": st.session_state.incorrect_ids,
+                                "error_counts": st.session_state.error_counts,
+                                "last_wrong_answers": st.session_state.last_wrong_answers
+                            }
+                            save_progress(st.session_state.user_id, progress_to_save, st.session_state.user_row_id)
                         st.success(f"✅ 已标记错题 {q['id']} 为已掌握！")
                         st.rerun()
                 
@@ -1090,5 +1629,9 @@ def main():
         else:
             st.info("🎉 暂无错题！继续保持优秀的答题状态～")
 
+    # 模拟考试标签页
+    with tab3:
+        render_exam_tab()
+
 if __name__ == "__main__":
-    main()
+    session_trace.run(st.session_state, main)
@@ -0,0 +1,70 @@
+"""题目卡片渲染缓存：选项乱序排列和答题结果HTML按题目与作答状态预计算"""
+import random
+from functools import lru_cache
+
+# 答题结果中每个选项的样式：正确答案 / 选错的选项 / 其他选项
+_CORRECT_STYLE = "background-color: #d1fae5; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0; font-weight: bold;"
+_WRONG_STYLE = "background-color: #fee2e2; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0;"
+_PLAIN_STYLE = "background-color: #f3f4f6; padding: 0.5rem; border-radius: 0.5rem; margin: 0.25rem 0;"
+
+
+def option_letter(opt):
+    "提取选项前缀字母，如 'A. xxx' -> 'A'"
+    return opt.split(".")[0].strip().upper()
+
+
+@lru_cache(maxsize=4096)
+def _shuffled(question_id, content_key, options):
+    # 使用独立的随机数生成器，不影响全局 random 的状态
+    shuffled = list(options)
+    random.Random(question_id).shuffle(shuffled)
+    return tuple(shuffled), tuple(option_letter(opt) for opt in shuffled)
+
+
+def shuffled_options(question):
+    "按题目ID确定的固定乱序排列选项（每道题每次显示顺序一致）"
+    return _shuffled(question['id'], question['content_key'], tuple(question['options']))[0]
+
+
+@lru_cache(maxsize=8192)
+def _result_view(question_id, content_key, options, answer, is_multiple, user_answer):
+    shuffled, letters = _shuffled(question_id, content_key, options)
+    if is_multiple:
+        correct_letters = set(answer)
+        selected = set(user_answer)
+        is_correct = {option_letter(opt) for opt in user_answer} == correct_letters
+    else:
+        correct_letters = {answer}
+        selected = {user_answer}
+        is_correct = option_letter(user_answer) == answer
+
+    parts = []
+    for opt, letter in zip(shuffled, letters):
+        if letter in correct_letters:
+            # 正确答案，使用绿色背景和加粗字体
+            parts.append(f"<div style='{_CORRECT_STYLE}'>✅ {opt}</div>")
+        elif opt in selected:
+            # 用户选择的错误答案，使用红色背景
+            parts.append(f"<div style='{_WRONG_STYLE}'>❌ {opt}</div>")
+        else:
+            # 未选择的错误答案，使用灰色背景
+            parts.append(f"<div style='{_PLAIN_STYLE}'>{opt}</div>")
+    return is_correct, "".join(parts)
+
+
+def result_view(question, user_answer):
+    "返回 (是否答对, 答题情况HTML)；同一道题同一作答的结果只构建一次"
+    if question['is_multiple']:
+        answer = tuple(sorted(question['answer']))
+        user_answer = tuple(sorted(user_answer))
+    else:
+        answer = question['answer']
+    return _result_view(
+        question['id'], question['content_key'], tuple(question['options']),
+        answer, question['is_multiple'], user_answer
+    )
+
+
+def stats():
+    "渲染缓存命中情况，供管理面板展示"
+    return {'options': _shuffled.cache_info(), 'results': _result_view.cache_info()}
@@ -0,0 +1,256 @@
+"""会话重放：把 session_trace 记录的会话在内存表格存储上全速重新执行（可多进程并行），统计每一步的耗时并与基准比较
+
+用法：
+    python replay_traces.py traces/trace-*.jsonl --jobs 4 --out replay.json
+    python replay_traces.py traces/trace-*.jsonl --baseline replay.json        # 与上次结果比较，有回退时退出码为 1
+
+每个会话在新的本地缓存目录中、以 Streamlit AppTest 驱动页面重放：存储中预置追踪记录的初始进度行，
+批次生成按记录的种子取用随机数，因此会得到与原会话相同的批次和题目；重放出的题目与记录不一致时计为分歧，
+此时按记录的对错选择答案继续重放（工作量相同）。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import session_trace
+import sheets_scheduler
+
+APP_PATH = Path(__file__).with_name("quiz_app.py")
+# 重放的页面操作（batch、start 是操作的结果和初始数据，不单独重放）
+REPLAYED_ACTIONS = ("login", "type", "answer", "goto", "refresh", "continue", "error_practice", "master")
+REGRESSION_THRESHOLD = 1.25  # 耗时超过基准该倍数视为回退
+REGRESSION_MIN_MS = 5.0  # 且至少慢这么多毫秒（避免极短操作的抖动）
+
+
+def load_sessions(paths):
+    "读取追踪日志，按会话分组并按序号排序"
+    sessions = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    sessions[record['s']].append(record)
+    return {sid: sorted(records, key=lambda r: r['n']) for sid, records in sessions.items()}
+
+
+# --- 单个会话的重放（在工作进程中执行）---
+def _init_worker(cache_root):
+    # 必须在导入应用模块之前设置：本地缓存目录在模块导入时确定
+    os.environ["QUIZ_CACHE_DIR"] = tempfile.mkdtemp(prefix="worker-", dir=cache_root)
+    os.environ[sheets_scheduler.BACKEND_ENV] = "memory"
+    # 重放时同样开启追踪（与线上的执行路径一致），并用重放出的批次哈希核对是否与原会话相同
+    os.environ[session_trace.TRACE_DIR_ENV] = os.path.join(os.environ["QUIZ_CACHE_DIR"], "traces")
+    os.environ.pop("QUIZ_SIDECAR_ADDRESS", None)
+
+
+def _option_for(question, is_correct, recorded_answer):
+    "题目与记录不一致时，按记录的对错选出答案（单选为选项文本，多选为选项列表）"
+    letter_of = {opt.split(".")[0].strip().upper(): opt for opt in question['options']}
+    if question['is_multiple']:
+        if is_correct:
+            return [letter_of[letter] for letter in sorted(question['answer']) if letter in letter_of]
+        wrong = [opt for letter, opt in letter_of.items() if letter not in question['answer']]
+        return wrong[:1] or list(letter_of.values())[:1]
+    if is_correct:
+        return letter_of.get(question['answer'], question['options'][0])
+    return next((opt for letter, opt in letter_of.items() if letter != question['answer']), question['options'][0])
+
+
+def _answer(at, record, counters):
+    batch = at.session_state['current_batch']
+    idx = at.session_state['current_question_idx']
+    if idx >= len(batch):
+        raise RuntimeError("当前批次已答完，无法重放作答")
+    question = batch[idx]
+    answer = record['ans']
+    if question['id'] != record['q']:
+        counters['diverged'] += 1
+        answer = _option_for(question, record['ok'], answer)
+    if question['is_multiple']:
+        chosen = set(answer)
+        for box in at.checkbox:
+            if box.label in chosen:
+                box.check()
+        next(b for b in at.button if "提交答案" in b.label).click()
+    else:
+        next(r for r in at.radio if r.label == "请选择答案：").set_value(answer)
+
+
+def _perform(at, record, counters):
+    "执行一步页面操作（不含 at.run）"
+    action = record['a']
+    if action == "login":
+        at.text_input[0].input(record['u'])
+        at.button[0].click()
+    elif action == "type":
+        next(r for r in at.radio if r.label == "选择题目类型：").set_value(record['v'])
+    elif action == "answer":
+        _answer(at, record, counters)
+    elif action == "goto":
+        next(b for b in at.button if "下一题" in b.label).click()
+    elif action == "refresh":
+        next(b for b in at.button if "刷新批次" in b.label).click()
+    elif action == "continue":
+        next(b for b in at.button if "继续练习" in b.label).click()
+    elif action == "error_practice":
+        next(b for b in at.button if "专项练习错题" in b.label).click()
+    elif action == "master":
+        at.button(key=f"master_{record['q']}").click()
+
+
+def replay_session(session_id, records):
+    "重放一个会话，返回每一步的耗时和分歧统计"
+    import memory_sheets
+    import progress_rows
+    from streamlit.testing.v1 import AppTest
+
+    client = memory_sheets.reset()
+    start = next((r for r in records if r['a'] == "start"), None)
+    if start is not None:
+        client.open_by_key(progress_rows.SPREADSHEET_ID).sheet1.append_row(start['row'])
+    seeds = [r['seed'] for r in records if r['a'] == "batch"]
+    batch_hashes = [r['h'] for r in records if r['a'] == "batch"]
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=120)
+    at.secrets['google_credentials'] = "{}"
+    at.session_state[session_trace.REPLAY_SEEDS_KEY] = list(seeds)
+    at.run()
+
+    counters = {'diverged': 0}
+    steps = []
+    errors = []
+    for record in records:
+        if record['a'] not in REPLAYED_ACTIONS:
+            continue
+        try:
+            _perform(at, record, counters)
+        except (StopIteration, KeyError, IndexError, RuntimeError) as e:
+            errors.append(f"第 {record['n']} 步 {record['a']}: {e!r}")
+            break
+        started = time.perf_counter()
+        at.run()
+        elapsed = (time.perf_counter() - started) * 1000
+        if at.exception:
+            errors.append(f"第 {record['n']} 步 {record['a']}: {at.exception[0].value}")
+            break
+        steps.append({'n': record['n'], 'a': record['a'], 'ms': round(elapsed, 2), 'recorded_run_ms': record.get('run')})
+
+    replayed = load_sessions(Path(os.environ[session_trace.TRACE_DIR_ENV]).glob("trace-*.jsonl")).get(
+        at.session_state['_trace_session'] if '_trace_session' in at.session_state else None, []
+    )
+    replayed_hashes = [r['h'] for r in replayed if r['a'] == "batch"]
+    return {
+        'session': session_id,
+        'steps': steps,
+        'diverged': counters['diverged'],
+        'batch_mismatches': sum(1 for a, b in zip(batch_hashes, replayed_hashes) if a != b) + abs(len(batch_hashes) - len(replayed_hashes)),
+        'errors': errors
+    }
+
+
+# --- 汇总与比较 ---
+def summarize(results):
+    "按操作类型汇总耗时（毫秒）"
+    by_action = defaultdict(list)
+    for result in results:
+        for step in result['steps']:
+            by_action[step['a']].append(step['ms'])
+    return {
+        action: {
+            'count': len(values),
+            'p50': round(statistics.median(values), 2),
+            'p95': round(sorted(values)[min(len(values) - 1, int(len(values) * 0.95))], 2)
+        }
+        for action, values in sorted(by_action.items())
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    "与基准逐步比较（同一会话的同一序号），返回 (按操作类型的回退, 最慢的逐步回退)"
+    current = summarize(results)
+    base = baseline['summary']
+    regressed_actions = {
+        action: (base[action]['p50'], item['p50'])
+        for action, item in current.items()
+        if action in base and item['p50'] > base[action]['p50'] * threshold and item['p50'] - base[action]['p50'] > REGRESSION_MIN_MS
+    }
+    base_steps = {(r['session'], s['n']): s['ms'] for r in baseline['results'] for s in r['steps']}
+    step_regressions = []
+    for result in results:
+        for step in result['steps']:
+            before = base_steps.get((result['session'], step['n']))
+            if before is not None and step['ms'] > before * threshold and step['ms'] - before > REGRESSION_MIN_MS:
+                step_regressions.append((step['ms'] - before, result['session'], step['n'], step['a'], before, step['ms']))
+    step_regressions.sort(reverse=True)
+    return regressed_actions, step_regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="重放会话追踪并比较每一步的耗时")
+    parser.add_argument("traces", nargs="+", help="追踪日志文件（trace-*.jsonl）")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="并行的工作进程数")
+    parser.add_argument("--session", action="append", help="只重放指定会话ID（可多次指定）")
+    parser.add_argument("--out", help="把重放结果写入 JSON 文件（可作为之后比较的基准）")
+    parser.add_argument("--baseline", help="与之前的重放结果比较")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="耗时超过基准的倍数视为回退")
+    args = parser.parse_args(argv)
+
+    sessions = load_sessions(args.traces)
+    if args.session:
+        sessions = {sid: records for sid, records in sessions.items() if sid in args.session}
+    if not sessions:
+        print("追踪日志中没有会话", file=sys.stderr)
+        return 2
+
+    started = time.time()
+    with tempfile.TemporaryDirectory(prefix="quiz-replay-") as cache_root:
+        # 每个工作进程只重放一个会话：本地缓存目录和进程内的缓存都是新的，前一个会话（可能是同一用户）留下的
+        # 检查点、进度缓存不会改变后一个会话的执行路径；AppTest 替换掉的 __main__ 也随进程一起丢弃
+        with ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=_init_worker, initargs=(cache_root,), max_tasks_per_child=1
+        ) as pool:
+            futures = [pool.submit(replay_session, sid, records) for sid, records in sessions.items()]
+            results = [future.result() for future in futures]
+
+    summary = summarize(results)
+    steps = sum(len(r['steps']) for r in results)
+    print(f"重放 {len(results)} 个会话、{steps} 步，用时 {time.time() - started:.1f} 秒")
+    for action, item in summary.items():
+        print(f"  {action:<15} {item['count']:>6} 次   p50 {item['p50']:8.1f} ms   p95 {item['p95']:8.1f} ms")
+    diverged = [r for r in results if r['diverged'] or r['batch_mismatches']]
+    if diverged:
+        print(
+            f"{len(diverged)} 个会话与记录不一致：{sum(r['batch_mismatches'] for r in diverged)} 个批次不同，"
+            f"{sum(r['diverged'] for r in diverged)} 题已按记录的对错作答", file=sys.stderr
+        )
+    for result in results:
+        for error in result['errors']:
+            print(f"会话 {result['session']} 重放中断：{error}", file=sys.stderr)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({'summary': summary, 'results': results}, ensure_ascii=False), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressed_actions, step_regressions = compare(results, baseline, args.threshold)
+        for action, (before, after) in regressed_actions.items():
+            print(f"回退：{action} p50 {before:.1f} ms -> {after:.1f} ms")
+        for _, session_id, n, action, before, after in step_regressions[:10]:
+            print(f"  会话 {session_id} 第 {n} 步 {action}: {before:.1f} ms -> {after:.1f} ms")
+        if regressed_actions:
+            return 1
+        print("与基准相比没有回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""会话状态内存管理：清理过期控件键和缓存、估算每个会话占用的内存"""
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+
+# 答题控件键：单选 q_{id}，多选 q_{id}_opt_{选项前缀}
+WIDGET_KEY_RE = re.compile(r"^q_(\d+)(?:_opt_.*)?$")
+# 模拟考试控件键：单选 exam_{id}，多选 exam_{id}_opt_{选项前缀}
+EXAM_WIDGET_KEY_RE = re.compile(r"^exam_(\d+)(?:_opt_.*)?$")
+# 按题目类型缓存的过滤结果
+TYPE_CACHE_PREFIXES = ("filtered_questions_", "error_questions_")
+
+SESSION_STALE_SECONDS = 6 * 3600  # 超过该时间未上报的会话从统计中移除
+
+
+# --- 进度指纹（替代 last_saved_data 深拷贝）---
+def progress_fingerprint(progress_data):
+    "对进度数据做稳定序列化后取哈希，用于判断是否需要保存"
+    payload = json.dumps([
+        sorted(progress_data["correct_ids"]),
+        sorted(progress_data["incorrect_ids"]),
+        progress_data["error_counts"],
+        progress_data["last_wrong_answers"]
+    ], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# --- 会话状态清理 ---
+def evict_stale_widget_keys(state, batch_ids):
+    "批次变化后删除不属于当前批次题目的答题控件键，返回删除数量"
+    batch_ids = set(batch_ids)
+    stale = []
+    for key in list(state.keys()):
+        match = WIDGET_KEY_RE.match(str(key))
+        if match and int(match.group(1)) not in batch_ids:
+            stale.append(key)
+    for key in stale:
+        del state[key]
+    return len(stale)
+
+
+def evict_exam_widget_keys(state, paper_ids=()):
+    "删除不属于当前试卷的考试控件键（交卷或放弃考试后试卷为空，全部删除），返回删除数量"
+    paper_ids = set(paper_ids)
+    stale = []
+    for key in list(state.keys()):
+        match = EXAM_WIDGET_KEY_RE.match(str(key))
+        if match and int(match.group(1)) not in paper_ids:
+            stale.append(key)
+    for key in stale:
+        del state[key]
+    return len(stale)
+
+
+def evict_inactive_type_caches(state, active_type):
+    "只保留当前题目类型的过滤缓存，其余类型的缓存删除，返回删除数量"
+    stale = [
+        key for key in list(state.keys())
+        if str(key).startswith(TYPE_CACHE_PREFIXES) and not str(key).endswith(f"_{active_type}")
+    ]
+    for key in stale:
+        del state[key]
+    return len(stale)
+
+
+# --- 内存估算 ---
+_shared_cache = {'version': None, 'ids': frozenset()}
+
+
+def shared_object_ids(index):
+    "共享题库索引中所有对象的 id（按版本缓存），估算会话内存时不计入"
+    if _shared_cache['version'] == index['version']:
+        return _shared_cache['ids']
+    ids = set()
+    stack = [index]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in ids:
+            continue
+        ids.add(id(obj))
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    _shared_cache['version'] = index['version']
+    _shared_cache['ids'] = frozenset(ids)
+    return _shared_cache['ids']
+
+
+def estimate_bytes(obj, shared_ids=frozenset(), seen=None):
+    "递归估算对象占用的字节数，共享对象和已统计对象不重复计入"
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        obj_id = id(item)
+        if obj_id in seen or obj_id in shared_ids:
+            continue
+        seen.add(obj_id)
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+def measure_session(state, index):
+    "统计一个会话的状态键数量、总字节数以及占用最大的几个键"
+    shared_ids = shared_object_ids(index)
+    seen = set()
+    per_key = []
+    for key in list(state.keys()):
+        try:
+            value = state[key]
+        except KeyError:
+            continue
+        per_key.append((str(key), estimate_bytes(value, shared_ids, seen)))
+    per_key.sort(key=lambda item: item[1], reverse=True)
+    return {
+        'bytes': sum(size for _, size in per_key),
+        'keys': len(per_key),
+        'widget_keys': sum(1 for key, _ in per_key if WIDGET_KEY_RE.match(key) or EXAM_WIDGET_KEY_RE.match(key)),
+        'largest': per_key[:5]
+    }
+
+
+# --- 进程内会话统计 ---
+class SessionRegistry:
+    "记录本进程各会话最近一次的内存测量结果，供管理面板展示"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def record(self, session_id, user_id, stats):
+        with self._lock:
+            self._sessions[session_id] = dict(stats, user_id=user_id, updated_at=time.time())
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def snapshot(self):
+        "返回仍在活跃期内的会话统计（按占用从大到小）"
+        cutoff = time.time() - SESSION_STALE_SECONDS
+        with self._lock:
+            for session_id in [sid for sid, s in self._sessions.items() if s['updated_at'] < cutoff]:
+                del self._sessions[session_id]
+            sessions = [dict(s, session_id=sid) for sid, s in self._sessions.items()]
+        sessions.sort(key=lambda s: s['bytes'], reverse=True)
+        return sessions
+
+    def capacity_estimate(self, concurrent_sessions):
+        "按当前会话平均占用估算 N 个并发会话所需内存（字节）"
+        sessions = self.snapshot()
+        if not sessions:
+            return 0
+        average = sum(s['bytes'] for s in sessions) / len(sessions)
+        return int(average * concurrent_sessions)
+
+
+registry = SessionRegistry()
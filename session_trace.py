@@ -0,0 +1,104 @@
+"""会话操作追踪（可选）：记录每个会话的操作序列、耗时和批次随机种子，写入紧凑的追加式日志，供 replay_traces.py 离线重放
+
+设置环境变量 QUIZ_TRACE_DIR 即开启，每个进程每天一个文件 trace-<日期>-<进程号>.jsonl，每行一条操作：
+    s 会话ID  n 会话内序号  t 距会话第一条操作的毫秒数  a 操作名  ms 操作本身耗时  run 所在脚本运行的总耗时，其余为操作参数
+操作：login、start（登录后的初始进度行）、type（切换题型）、answer、goto（翻题）、refresh（刷新批次）、
+continue（继续练习）、error_practice（错题专项练习）、master（错题本中标记已掌握）、batch（生成批次：模式、种子、题目ID哈希）
+"""
+import contextlib
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+TRACE_DIR_ENV = "QUIZ_TRACE_DIR"
+# 重放时由重放工具放入会话状态的种子队列，批次生成按顺序取用，使重放得到与原会话相同的批次
+REPLAY_SEEDS_KEY = "_trace_replay_seeds"
+
+
+def enabled():
+    return bool(os.environ.get(TRACE_DIR_ENV))
+
+
+class TraceLog:
+    "追加式日志文件（进程内共享，按日期换文件）"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+
+    def write(self, records):
+        path = Path(os.environ[TRACE_DIR_ENV]) / f"trace-{time.strftime('%Y%m%d')}-{os.getpid()}.jsonl"
+        lines = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+        with self._lock:
+            if self._path != path:
+                if self._file is not None:
+                    self._file.close()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(path, "a", encoding="utf-8")
+                self._path = path
+            self._file.write(lines)
+            self._file.flush()
+
+
+log = TraceLog()
+
+
+def action(state, name, ms=None, **fields):
+    "记录一次操作（先放入会话缓冲区，本次脚本运行结束时连同运行耗时一起写入日志）"
+    if not enabled():
+        return
+    now = time.time()
+    if '_trace_session' not in state:
+        state['_trace_session'] = uuid.uuid4().hex[:12]
+        state['_trace_started'] = now
+        state['_trace_seq'] = 0
+    record = {'s': state['_trace_session'], 'n': state['_trace_seq'], 't': int((now - state['_trace_started']) * 1000), 'a': name}
+    if ms is not None:
+        record['ms'] = round(ms, 2)
+    record.update(fields)
+    state['_trace_seq'] += 1
+    state.setdefault('_trace_buffer', []).append(record)
+
+
+@contextlib.contextmanager
+def step(state, name, **fields):
+    "记录一次操作及其处理耗时"
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        action(state, name, ms=(time.perf_counter() - started) * 1000, **fields)
+
+
+def batch_seed(state):
+    "批次生成使用的随机种子：重放时取自种子队列，否则随机生成"
+    seeds = state.get(REPLAY_SEEDS_KEY)
+    if seeds:
+        return seeds.pop(0)
+    return random.SystemRandom().getrandbits(32)
+
+
+def batch_fingerprint(batch):
+    "批次题目ID的短哈希，重放时用于确认生成了相同的批次"
+    return hashlib.sha1(json.dumps([q['id'] for q in batch]).encode()).hexdigest()[:10]
+
+
+def run(state, main):
+    "执行一次脚本运行，结束后把本次运行中的操作（包括运行前控件回调中的操作）写入日志"
+    started = time.perf_counter()
+    try:
+        main()
+    finally:
+        buffer = state.get('_trace_buffer') if enabled() else None
+        if buffer:
+            run_ms = round((time.perf_counter() - started) * 1000, 2)
+            for record in buffer:
+                record['run'] = run_ms
+            state['_trace_buffer'] = []
+            log.write(buffer)
@@ -0,0 +1,265 @@
+"""Google Sheets 请求调度：令牌桶限流、优先级排队（登录优先于后台保存）、429 退避重试和配额统计"""
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+# 优先级（数值越小越优先）
+LOGIN = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {LOGIN: "登录", INTERACTIVE: "答题", BACKGROUND: "后台"}
+
+# Sheets API 配额为每分钟读、写各 60 次（同一服务账号），留出余量
+REQUESTS_PER_MINUTE = {'read': 55, 'write': 55}
+BURST = 5  # 令牌桶容量，允许的短时突发请求数
+# 低优先级请求取令牌后至少要给更高优先级留下的令牌数
+RESERVED_TOKENS = {LOGIN: 0, INTERACTIVE: 1, BACKGROUND: 2}
+MAX_ATTEMPTS = {LOGIN: 3, INTERACTIVE: 3, BACKGROUND: 6}
+BACKOFF_BASE = 1.0  # 秒，第 n 次重试前随机等待 0 ~ BACKOFF_BASE * 2^n 秒
+BACKOFF_MAX = 32.0
+# 设为 memory 时使用进程内存中的表格存储（memory_sheets，会话重放和离线压测用）
+BACKEND_ENV = "QUIZ_SHEETS_BACKEND"
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 对表格对象的方法调用按读/写计入配额；返回值仍是表格对象的调用需要继续包装
+READ_CALLS = {
+    'open_by_key', 'sheet1', 'worksheet', 'get_worksheet', 'worksheets',
+    'find', 'findall', 'row_values', 'col_values', 'batch_get', 'get', 'get_all_values', 'get_all_records'
+}
+WRITE_CALLS = {'update', 'batch_update', 'append_row', 'append_rows', 'add_worksheet'}
+WRAP_RESULT = {'open_by_key', 'sheet1', 'worksheet', 'get_worksheet', 'add_worksheet'}
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+_priority = contextvars.ContextVar("sheets_priority", default=INTERACTIVE)
+
+
+class SheetsQuotaError(Exception):
+    "等待配额超时"
+
+
+@contextlib.contextmanager
+def priority(level):
+    "在 with 块内发出的表格请求使用指定优先级（线程池中的任务需要自行设置）"
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def with_priority(level, fn, *args, **kwargs):
+    "以指定优先级执行 fn，用于提交到线程池的任务（上下文变量不会传入线程池）"
+    with priority(level):
+        return fn(*args, **kwargs)
+
+
+def error_status(exc):
+    "从 gspread 的 APIError 中取出 HTTP 状态码，其他异常返回 None"
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status if status is not None else getattr(exc, 'code', None)
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, needed):
+        "还需等待多少秒才能有 needed 个令牌"
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+
+class SheetsScheduler:
+    "所有表格请求的统一入口：按读/写各一个令牌桶限流，排队时高优先级先取令牌，遇到 429 和 5xx 退避重试"
+
+    def __init__(self, per_minute=None, burst=BURST):
+        per_minute = per_minute or REQUESTS_PER_MINUTE
+        self._cond = threading.Condition()
+        self._buckets = {kind: TokenBucket(limit, burst) for kind, limit in per_minute.items()}
+        self._waiting = {kind: [] for kind in per_minute}  # kind -> 堆 [(优先级, 序号)]
+        self._seq = itertools.count()
+        self._recent = {kind: deque() for kind in per_minute}  # 最近一分钟的请求时间
+        self._stats = {
+            level: {'calls': 0, 'throttled': 0, 'wait_s': 0.0, 'retries': 0, 'quota_errors': 0, 'failures': 0}
+            for level in PRIORITY_NAMES
+        }
+
+    def _acquire(self, kind, level, timeout):
+        bucket = self._buckets[kind]
+        ticket = (level, next(self._seq))
+        needed = min(1 + RESERVED_TOKENS[level], bucket.capacity)
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting[kind], ticket)
+            try:
+                while True:
+                    bucket.refill()
+                    if self._waiting[kind][0] == ticket and bucket.tokens >= needed:
+                        bucket.tokens -= 1
+                        break
+                    remaining = timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        raise SheetsQuotaError(f"等待 Google Sheets {kind} 配额超时")
+                    self._cond.wait(min(max(bucket.wait_time(needed), 0.05), remaining))
+            finally:
+                self._waiting[kind].remove(ticket)
+                heapq.heapify(self._waiting[kind])
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            stats = self._stats[level]
+            stats['calls'] += 1
+            if waited > 0.01:
+                stats['throttled'] += 1
+                stats['wait_s'] += waited
+            recent = self._recent[kind]
+            recent.append(time.monotonic())
+            while recent and recent[0] < time.monotonic() - 60:
+                recent.popleft()
+
+    def _penalize(self, kind):
+        # 收到 429 说明配额已用完，清空令牌让所有排队请求一起放慢
+        with self._cond:
+            self._buckets[kind].refill()
+            self._buckets[kind].tokens = 0.0
+
+    def call(self, kind, fn, *args, timeout=60, **kwargs):
+        "在配额内执行一次表格请求，失败时按指数退避（全抖动）重试；优先级取自 priority() 上下文"
+        level = _priority.get()
+        attempts = MAX_ATTEMPTS[level]
+        for attempt in range(attempts):
+            self._acquire(kind, level, timeout)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                status = error_status(e)
+                if status == 429:
+                    self._stats[level]['quota_errors'] += 1
+                    self._penalize(kind)
+                if status not in RETRY_STATUS or attempt == attempts - 1:
+                    if status in RETRY_STATUS:
+                        self._stats[level]['failures'] += 1
+                    raise
+                self._stats[level]['retries'] += 1
+                time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+    def metrics(self):
+        "配额余量和各优先级的请求统计，供管理面板展示"
+        now = time.monotonic()
+        with self._cond:
+            quota = {}
+            for kind, bucket in self._buckets.items():
+                bucket.refill()
+                recent = self._recent[kind]
+                while recent and recent[0] < now - 60:
+                    recent.popleft()
+                limit = round(bucket.rate * 60)
+                quota[kind] = {
+                    'per_minute': limit,
+                    'used_last_minute': len(recent),
+                    'headroom': max(0, limit - len(recent)),
+                    'tokens': round(bucket.tokens, 1),
+                    'waiting': len(self._waiting[kind])
+                }
+            by_priority = {PRIORITY_NAMES[level]: dict(stats, wait_s=round(stats['wait_s'], 1)) for level, stats in self._stats.items()}
+        return {'quota': quota, 'by_priority': by_priority}
+
+
+class Scheduled:
+    "包装 gspread 的客户端、表格和工作表对象，使其所有网络请求都经过调度器"
+
+    def __init__(self, target, scheduler):
+        self._target = target
+        self._scheduler = scheduler
+
+    def _wrap(self, name, value):
+        return Scheduled(value, self._scheduler) if name in WRAP_RESULT else value
+
+    def __getattr__(self, name):
+        if name == 'sheet1':
+            # sheet1 是属性，读取时会请求表格元数据
+            return self._wrap(name, self._scheduler.call('read', getattr, self._target, name))
+        attr = getattr(self._target, name)
+        if name in READ_CALLS or name in WRITE_CALLS:
+            kind = 'read' if name in READ_CALLS else 'write'
+
+            def scheduled_call(*args, **kwargs):
+                return self._wrap(name, self._scheduler.call(kind, attr, *args, **kwargs))
+            return scheduled_call
+        return attr
+
+
+scheduler = SheetsScheduler()
+
+
+def scheduled(client):
+    return Scheduled(client, scheduler)
+
+
+def load_credentials(path=None):
+    "命令行工具读取服务账号凭据：指定的 JSON 文件，或环境变量 GOOGLE_CREDENTIALS，或 .streamlit/secrets.toml"
+    if path:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    if os.environ.get("GOOGLE_CREDENTIALS"):
+        return json.loads(os.environ["GOOGLE_CREDENTIALS"])
+    secrets_path = Path(".streamlit") / "secrets.toml"
+    if secrets_path.exists():
+        import tomllib
+        secrets = tomllib.loads(secrets_path.read_text(encoding="utf-8"))
+        if "google_credentials" in secrets:
+            return json.loads(secrets["google_credentials"])
+    raise SystemExit("请通过 --credentials、环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml 提供服务账号凭据")
+
+
+def authorize(creds_dict, use_sidecar=True):
+    """用服务账号凭据创建经过调度的 gspread 客户端（页面和命令行工具共用）；
+    多进程部署时返回边车进程的客户端，认证和配额调度都由边车进程统一负责；
+    会话重放时（QUIZ_SHEETS_BACKEND=memory）返回进程内存中的表格存储"""
+    if os.environ.get(BACKEND_ENV) == "memory":
+        import memory_sheets
+        return memory_sheets.client
+    if use_sidecar:
+        import sheets_sidecar
+        if sheets_sidecar.enabled():
+            return sheets_sidecar.connect()
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+    return scheduled(gspread.authorize(creds))
+
+
+_sheet1_handles = {}
+_sheet1_lock = threading.Lock()
+
+
+def open_sheet1(open_client, spreadsheet_id):
+    """表格的第一个工作表（进度表）句柄，每个进程只打开一次：打开表格和读取 sheet1 各消耗一次读配额，
+    登录高峰中每次校验都重新打开会使读取次数翻三倍。open_client() 只在首次打开时调用。
+    会话重放时内存表格存储每个会话都会重建，不缓存"""
+    if os.environ.get(BACKEND_ENV) == "memory":
+        return open_client().open_by_key(spreadsheet_id).sheet1
+    with _sheet1_lock:
+        if spreadsheet_id not in _sheet1_handles:
+            _sheet1_handles[spreadsheet_id] = open_client().open_by_key(spreadsheet_id).sheet1
+        return _sheet1_handles[spreadsheet_id]
@@ -0,0 +1,237 @@
+"""Google Sheets 边车进程：多进程部署时独占 Sheets 连接（只认证一次、缓存已打开的工作表），
+所有工作进程的表格请求经它统一限流调度，并由它负责重试队列中保存失败的进度的写回。
+
+工作进程通过 multiprocessing.connection 访问边车进程，地址和认证密钥由部署脚本（deploy.py）通过环境变量传入。
+"""
+import argparse
+import os
+import pickle
+import sys
+import threading
+from multiprocessing.connection import Client, Listener
+
+import local_store
+import progress_rows
+import progress_store
+import sheets_scheduler
+
+ADDRESS_ENV = "QUIZ_SIDECAR_ADDRESS"
+AUTHKEY_ENV = "QUIZ_SIDECAR_AUTHKEY"
+
+
+class RemoteSheetsError(Exception):
+    "边车进程中发生、无法原样传回的错误；code 为 HTTP 状态码（如 429），供重试判断"
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def enabled():
+    return bool(os.environ.get(ADDRESS_ENV))
+
+
+def parse_address(text):
+    "'host:port' 为 TCP 地址，其他为 Unix 套接字路径"
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit() and "/" not in text:
+        return host, int(port)
+    return text
+
+
+def portable_error(exc):
+    "把异常转换为可传回工作进程的形式（gspread 的 APIError 带有响应对象，改为只保留状态码）"
+    status = sheets_scheduler.error_status(exc)
+    if status is not None:
+        return RemoteSheetsError(str(exc), status)
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:
+        return RemoteSheetsError(repr(exc))
+
+
+# --- 边车进程（服务端）---
+class SidecarServer:
+    "持有唯一的 gspread 客户端；表格和工作表对象打开一次后缓存复用，省去每次请求的元数据读取"
+
+    def __init__(self, creds_dict):
+        self._client = sheets_scheduler.authorize(creds_dict, use_sidecar=False)
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+        self._worksheets = {}
+
+    def _spreadsheet(self, spreadsheet_id):
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(spreadsheet_id)
+        if spreadsheet is None:
+            spreadsheet = self._client.open_by_key(spreadsheet_id)
+            with self._lock:
+                self._spreadsheets[spreadsheet_id] = spreadsheet
+        return spreadsheet
+
+    def worksheet(self, spreadsheet_id, title=None):
+        "title 为 None 时是第一个工作表（sheet1）"
+        key = (spreadsheet_id, title)
+        with self._lock:
+            worksheet = self._worksheets.get(key)
+        if worksheet is None:
+            spreadsheet = self._spreadsheet(spreadsheet_id)
+            worksheet = spreadsheet.sheet1 if title is None else spreadsheet.worksheet(title)
+            with self._lock:
+                self._worksheets[key] = worksheet
+        return worksheet
+
+    def handle(self, request):
+        op, spreadsheet_id, title, method, args, kwargs, level = request
+        with sheets_scheduler.priority(level):
+            if op == 'worksheet':
+                self.worksheet(spreadsheet_id, title)
+                return title
+            if op == 'add_worksheet':
+                worksheet = self._spreadsheet(spreadsheet_id).add_worksheet(*args, **kwargs)
+                with self._lock:
+                    self._worksheets[(spreadsheet_id, kwargs.get('title', args[0] if args else None))] = worksheet
+                return None
+            if op == 'call' and (method in sheets_scheduler.READ_CALLS or method in sheets_scheduler.WRITE_CALLS):
+                return getattr(self.worksheet(spreadsheet_id, title), method)(*args, **kwargs)
+            if op == 'metrics':
+                return sheets_scheduler.scheduler.metrics()
+        raise RemoteSheetsError(f"不支持的请求: {op} {method}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ('ok', self.handle(request))
+                except Exception as e:
+                    reply = ('error', portable_error(e))
+                try:
+                    conn.send(reply)
+                except (OSError, pickle.PicklingError) as e:
+                    conn.send(('error', RemoteSheetsError(repr(e))))
+
+    def replay_pending_save(self, user_id, payload):
+        "重试队列的写回（后台优先级）"
+        with sheets_scheduler.priority(sheets_scheduler.BACKGROUND):
+            sheet = self.worksheet(progress_rows.SPREADSHEET_ID)
+            progress_store.write_progress(sheet, user_id, payload['row'], payload['crdt'], payload['last_wrong'], payload['revision'])
+
+    def serve(self, address, authkey):
+        local_store.pending_saves.start(self.replay_pending_save)
+        with Listener(address, authkey=authkey) as listener:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._serve_connection, args=(conn,), name="sidecar-connection", daemon=True).start()
+
+
+# --- 工作进程（客户端）：与 gspread 客户端、表格、工作表接口一致的代理对象 ---
+class RemoteClient:
+    "每个线程一条到边车进程的连接（Connection 对象不是线程安全的）"
+
+    def __init__(self, address, authkey):
+        self._address = address
+        self._authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self._address, authkey=self._authkey)
+            self._local.conn = conn
+        return conn
+
+    def request(self, op, spreadsheet_id, title=None, method=None, args=(), kwargs=None):
+        message = (op, spreadsheet_id, title, method, tuple(args), dict(kwargs or {}), sheets_scheduler.current_priority())
+        for attempt in range(2):
+            sent = False
+            try:
+                conn = self._connection()
+                conn.send(message)
+                sent = True
+                status, value = conn.recv()
+                break
+            except (EOFError, OSError) as e:
+                self._local.conn = None
+                # 请求未发出时（如边车进程重启后旧连接失效）重新连接一次；已发出的请求不重发，避免重复写入
+                if sent or attempt == 1:
+                    raise RemoteSheetsError(f"无法连接 Google Sheets 边车进程: {e}", 503)
+        if status == 'error':
+            raise value
+        return value
+
+    def open_by_key(self, spreadsheet_id):
+        return RemoteSpreadsheet(self, spreadsheet_id)
+
+    def metrics(self):
+        return self.request('metrics', None)
+
+
+class RemoteSpreadsheet:
+    def __init__(self, client, spreadsheet_id):
+        self._client = client
+        self.id = spreadsheet_id
+
+    @property
+    def sheet1(self):
+        return RemoteWorksheet(self._client, self.id, None)
+
+    def worksheet(self, title):
+        self._client.request('worksheet', self.id, title)
+        return RemoteWorksheet(self._client, self.id, title)
+
+    def add_worksheet(self, title, rows, cols):
+        self._client.request('add_worksheet', self.id, kwargs={'title': title, 'rows': rows, 'cols': cols})
+        return RemoteWorksheet(self._client, self.id, title)
+
+
+class RemoteWorksheet:
+    def __init__(self, client, spreadsheet_id, title):
+        self._client = client
+        self._spreadsheet_id = spreadsheet_id
+        self.title = title
+
+    def __getattr__(self, method):
+        if method not in sheets_scheduler.READ_CALLS and method not in sheets_scheduler.WRITE_CALLS:
+            raise AttributeError(method)
+
+        def remote_call(*args, **kwargs):
+            return self._client.request('call', self._spreadsheet_id, self.title, method, args, kwargs)
+        return remote_call
+
+
+_remote_client = None
+
+
+def connect():
+    "工作进程使用的边车客户端（进程内共享）"
+    global _remote_client
+    if _remote_client is None:
+        _remote_client = RemoteClient(parse_address(os.environ[ADDRESS_ENV]), bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    return _remote_client
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Google Sheets 边车进程（由 deploy.py 启动）")
+    parser.add_argument("--address", required=True, help="监听地址：Unix 套接字路径或 host:port")
+    parser.add_argument("--credentials", help="服务账号 JSON 文件（默认读取环境变量 GOOGLE_CREDENTIALS 或 .streamlit/secrets.toml）")
+    args = parser.parse_args(argv)
+
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    # 边车进程自身直接访问 Google，不能再把请求转发给自己
+    os.environ.pop(ADDRESS_ENV, None)
+    address = parse_address(args.address)
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)
+    server = SidecarServer(sheets_scheduler.load_credentials(args.credentials))
+    print(f"Google Sheets 边车进程已启动：{args.address}", flush=True)
+    server.serve(address, authkey)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
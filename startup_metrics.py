@@ -0,0 +1,33 @@
+"""启动耗时统计：登录到显示第一题的时间（time-to-first-question）及登录阶段各步骤耗时，进程内汇总供管理面板和基准测试使用"""
+import threading
+from collections import deque
+
+MAX_SAMPLES = 500  # 每项指标保留的最近样本数
+
+
+class StartupMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}  # 指标名 -> deque[秒]
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+    def summary(self):
+        "各指标的样本数、中位数、P95 和最近一次（秒）"
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            last = {name: values[-1] for name, values in self._samples.items()}
+        return {
+            name: {
+                'count': len(values),
+                'p50': round(values[len(values) // 2], 3),
+                'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                'last': round(last[name], 3)
+            }
+            for name, values in samples.items()
+        }
+
+
+metrics = StartupMetrics()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 测试使用临时的本地缓存目录（本地存储在模块导入时确定目录），并从仓库根目录导入模块
+os.environ.setdefault("QUIZ_CACHE_DIR", tempfile.mkdtemp(prefix="quiz-test-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,78 @@
+import pytest
+
+import bank_validator
+
+
+def item(seq=1, question="题干", options=("A. 是", "B. 否"), answer="A"):
+    return {'序号': seq, 'question': question, 'options': list(options), 'answer': answer}
+
+
+def codes(diagnostics):
+    return sorted(d['code'] for d in diagnostics)
+
+
+def test_valid_item_has_no_diagnostics():
+    assert bank_validator.check_item(0, item()) == []
+    assert bank_validator.check_item(0, item(options=("A. 1", "B. 2", "C. 3"), answer=["A", "C"])) == []
+    assert bank_validator.check_item(0, item(options=("A. 1", "B. 2", "C. 3"), answer="A|B")) == []
+
+
+@pytest.mark.parametrize("bad, expected", [
+    ("不是对象", ["E101"]),
+    (item(question="  "), ["E102"]),
+    (item(options=()), ["E103"]),
+    (item(answer=""), ["E104"]),
+    (item(options=("是", "B. 否"), answer="B"), ["E105", "W201"]),
+    (item(options=("A. 是", "A. 否")), ["E106", "W201"]),
+    (item(answer="C"), ["E107"]),
+    (item(answer="AB"), ["E108"]),
+    (item(answer=["A"]), ["W202"]),
+    (item(options=("A. 是", "C. 否")), ["W201"]),
+    (item(options=("A. 是", "B.  ")), ["W203"]),
+    (item(seq=None), ["W204"]),
+    (item(seq=-1), ["W204"]),
+])
+def test_check_item_codes(bad, expected):
+    assert codes(bank_validator.check_item(3, bad)) == sorted(expected)
+
+
+def test_diagnostics_carry_index_and_seq():
+    [d] = bank_validator.check_item(3, item(seq=12, answer="C"))
+    assert (d['index'], d['seq'], d['severity']) == (3, 12, bank_validator.ERROR)
+
+
+def test_cross_item_checks_run_on_every_pass():
+    items = [item(1, "甲"), item(1, "乙"), item(2, "甲")]
+    for use_cache in (False, True, True):
+        diagnostics, stats = bank_validator.validate_items(enumerate(items), use_cache=use_cache)
+        assert [(d['index'], d['code']) for d in diagnostics] == [(1, "E301"), (2, "W302")]
+        assert (stats['errors'], stats['warnings']) == (1, 1)
+
+
+def test_cached_results_are_reused_and_reindexed():
+    items = [item(101, "缓存一", answer="C"), item(102, "缓存二")]
+    _, stats = bank_validator.validate_items(enumerate(items))
+    assert stats['rechecked'] == 2
+    # 插入一道新题后只检查新题，缓存中的诊断按新位置改写下标
+    items.insert(0, item(100, "缓存零"))
+    diagnostics, stats = bank_validator.validate_items(enumerate(items))
+    assert (stats['items'], stats['rechecked']) == (3, 1)
+    assert [(d['index'], d['code']) for d in diagnostics] == [(1, "E107")]
+
+
+def test_checked_items_yields_every_item_in_order():
+    items = [item(seq) for seq in range(bank_validator.CHUNK_SIZE + 3)]
+    report = {}
+    seen = [index for index, _ in bank_validator.checked_items(enumerate(items), report, use_cache=False)]
+    assert seen == list(range(len(items)))
+    assert report['stats']['items'] == len(items)
+    assert codes(report['diagnostics']) == ["W302"] * (len(items) - 1)
+
+
+def test_iter_items():
+    assert list(bank_validator.iter_items(' [ {"a": 1} ,\n[2] ] ')) == [(0, {"a": 1}), (1, [2])]
+    assert list(bank_validator.iter_items("[]")) == []
+    with pytest.raises(ValueError):
+        list(bank_validator.iter_items('{"a": 1}'))
+    with pytest.raises(ValueError):
+        list(bank_validator.iter_items('[{"a": 1} {"b": 2}]'))
@@ -0,0 +1,129 @@
+import copy
+import random
+
+import progress_crdt
+
+
+def random_state(rng, device, ops=30, questions=8):
+    "一个设备上的随机作答序列（时间戳递增）"
+    state = progress_crdt.new_state()
+    wrong = {}
+    ts = 0
+    for _ in range(ops):
+        ts += rng.randint(1, 5)
+        q_id = rng.randrange(questions)
+        is_correct = rng.random() < 0.4
+        progress_crdt.record(state, q_id, is_correct, device, ts)
+        if not is_correct:
+            wrong[str(q_id)] = f"{device}-{ts}"
+    return state, wrong
+
+
+def test_merge_is_commutative():
+    for seed in range(50):
+        rng = random.Random(seed)
+        a, wrong_a = random_state(rng, "A")
+        b, wrong_b = random_state(rng, "B")
+        assert progress_crdt.merge(a, b, wrong_a, wrong_b) == progress_crdt.merge(b, a, wrong_b, wrong_a)
+
+
+def test_merge_is_associative():
+    for seed in range(50):
+        rng = random.Random(seed)
+        (a, wa), (b, wb), (c, wc) = (random_state(rng, device) for device in "ABC")
+        ab, wab = progress_crdt.merge(a, b, wa, wb)
+        left = progress_crdt.merge(ab, c, wab, wc)
+        bc, wbc = progress_crdt.merge(b, c, wb, wc)
+        right = progress_crdt.merge(a, bc, wa, wbc)
+        assert left == right
+
+
+def test_merge_is_idempotent():
+    for seed in range(50):
+        rng = random.Random(seed)
+        a, wrong_a = random_state(rng, "A")
+        b, wrong_b = random_state(rng, "B")
+        assert progress_crdt.merge(a, a, wrong_a, wrong_a)[0] == a
+        merged, wrong = progress_crdt.merge(a, b, wrong_a, wrong_b)
+        assert progress_crdt.merge(merged, b, wrong, wrong_b) == (merged, wrong)
+
+
+def test_merge_does_not_mutate_inputs():
+    rng = random.Random(1)
+    a, wrong_a = random_state(rng, "A")
+    b, wrong_b = random_state(rng, "B")
+    before = copy.deepcopy((a, b))
+    progress_crdt.merge(a, b, wrong_a, wrong_b)
+    assert (a, b) == before
+
+
+def test_wrong_counts_add_up_across_devices():
+    a = progress_crdt.new_state()
+    b = progress_crdt.new_state()
+    progress_crdt.record(a, 1, False, "A", 10)
+    progress_crdt.record(a, 1, False, "A", 11)
+    progress_crdt.record(b, 1, False, "B", 12)
+    merged, _ = progress_crdt.merge(a, b)
+    assert progress_crdt.materialize(merged, {})["error_counts"] == {"1": 3}
+
+
+def test_correct_answer_starts_new_epoch():
+    a = progress_crdt.new_state()
+    progress_crdt.record(a, 1, False, "A", 10)
+    b = copy.deepcopy(a)
+    progress_crdt.record(b, 1, True, "B", 20)
+    progress_crdt.record(b, 1, False, "B", 30)
+    merged, _ = progress_crdt.merge(a, b)
+    # A 设备在答对之前的错误次数属于旧纪元，不再计入
+    assert progress_crdt.materialize(merged, {})["error_counts"] == {"1": 1}
+
+
+def test_reset_on_one_device_races_answer_on_another():
+    base = progress_crdt.new_state()
+    progress_crdt.record(base, 1, False, "B", 10)
+    progress_crdt.record(base, 1, False, "B", 20)
+    progress_crdt.record(base, 2, True, "B", 30)
+
+    # A 设备在 100 时重置进度；B 设备没看到重置，之后又答错了第 1 题，重置之前还答过第 3 题
+    device_a = progress_crdt.reset(copy.deepcopy(base), ts=100)
+    device_b = copy.deepcopy(base)
+    progress_crdt.record(device_b, 3, False, "B", 50)
+    progress_crdt.record(device_b, 1, False, "B", 110)
+    wrong_b = {"1": "C", "3": "D"}
+
+    merged, last_wrong = progress_crdt.merge(device_a, device_b, {}, wrong_b)
+    assert (merged, last_wrong) == progress_crdt.merge(device_b, device_a, wrong_b, {})
+    progress_data = progress_crdt.materialize(merged, last_wrong)
+    # 重置之前的条目全部作废；重置之后的作答保留，但重置前累计的错误次数不再计入
+    assert merged['r'] == 100
+    assert progress_data["correct_ids"] == set()
+    assert progress_data["incorrect_ids"] == {1}
+    assert progress_data["error_counts"] == {"1": 1}
+    assert progress_data["last_wrong_answers"] == {"1": "C"}
+
+
+def test_record_after_reset_is_newer_than_reset():
+    state = progress_crdt.reset(progress_crdt.new_state(), ts=100)
+    # 本设备时钟落后于重置时间时，新写入仍排在重置之后
+    progress_crdt.record(state, 5, True, "A", 40)
+    merged, _ = progress_crdt.merge(state, progress_crdt.new_state())
+    assert progress_crdt.materialize(merged, {})["correct_ids"] == {5}
+
+
+def test_encode_decode_roundtrip():
+    rng = random.Random(7)
+    a, _ = random_state(rng, "A")
+    b, _ = random_state(rng, "B")
+    merged, _ = progress_crdt.merge(a, b)
+    progress_crdt.reset(merged, ts=5)
+    progress_crdt.record(merged, 3, False, "C", 200)
+    assert progress_crdt.decode(progress_crdt.encode(merged)) == merged
+
+
+def test_encode_compresses_large_states():
+    state = progress_crdt.new_state()
+    for q_id in range(5000):
+        progress_crdt.record(state, q_id, q_id % 3 == 0, f"device-{q_id % 4}", q_id + 1)
+    text = progress_crdt.encode(state)
+    assert text.startswith("z:") and len(text) <= progress_crdt.COMPRESS_OVER
+    assert progress_crdt.decode(text) == state
@@ -0,0 +1,47 @@
+import json
+
+import progress_crdt
+import progress_rows
+
+
+def test_roundtrip_current_row():
+    progress = {
+        "correct_ids": {1},
+        "incorrect_ids": {2},
+        "error_counts": {"2": 3},
+        "last_wrong_answers": {"2": "C"}
+    }
+    state = progress_crdt.from_progress(progress)
+    row = progress_rows.encode_progress_row("u1", progress, 4, state)
+    decoded, migrated = progress_rows.decode_progress_row(row, legacy_ids={})
+    assert (decoded, migrated) == (progress, False)
+    assert progress_rows.decode_progress_crdt(row, decoded) == state
+    assert progress_rows.row_revision(row) == 4
+
+
+def test_legacy_row_is_migrated_from_array_indexes():
+    # 旧版记录只有 A~E 列，题目ID是题库数组下标
+    row = ["u1", json.dumps([0]), json.dumps([1]), json.dumps({"1": 2}), json.dumps({"1": "B"})]
+    decoded, migrated = progress_rows.decode_progress_row(row, legacy_ids={0: 100, 1: 101})
+    assert migrated
+    assert decoded == {
+        "correct_ids": {100},
+        "incorrect_ids": {101},
+        "error_counts": {"101": 2},
+        "last_wrong_answers": {"101": "B"}
+    }
+    # 没有 H 列时由进度转换出 CRDT 状态
+    state = progress_rows.decode_progress_crdt(row, decoded)
+    assert progress_crdt.materialize(state, decoded["last_wrong_answers"]) == decoded
+    assert progress_rows.row_revision(row) == 0
+
+
+def test_empty_and_malformed_cells():
+    decoded, migrated = progress_rows.decode_progress_row(["u1", "[]", "", "{}", ""], legacy_ids={})
+    assert decoded == progress_rows.empty_progress() and migrated
+    assert progress_rows.row_revision(["u1", "", "", "", "", "2", "x"]) == 0
+
+
+def test_appended_row_number():
+    assert progress_rows.appended_row_number({'updates': {'updatedRange': "Sheet1!A12:H12"}}) == 12
+    assert progress_rows.appended_row_number({}) is None
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import question_index
+
+
+def question(seq, text, answer="A"):
+    return {'序号': seq, 'question': text, 'options': ["A. 是", "B. 否"], 'answer': answer}
+
+
+def write_bank(path, items):
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def fresh_index(monkeypatch):
+    "隔离进程级的共享索引和迁移链"
+    monkeypatch.setattr(question_index, "_current_index", None)
+    monkeypatch.setattr(question_index, "_migrations", {})
+
+
+def test_ids_prefer_sequence_number_and_fall_back_to_content_hash(tmp_path):
+    index = question_index.build_index(write_bank(tmp_path / "bank.json", [
+        question(7, "甲"), {'question': "乙", 'options': ["A. 1", "B. 2"], 'answer': "B"}
+    ]))
+    ids = [q['id'] for q in index['all']]
+    assert ids[0] == 7
+    assert ids[1] == int(question_index.content_key("乙", ["A. 1", "B. 2"])[:12], 16)
+    assert index['legacy_ids'] == {0: ids[0], 1: ids[1]}
+
+
+def test_rejects_bank_with_validation_errors(tmp_path):
+    with pytest.raises(question_index.QuestionBankError):
+        question_index.build_index(write_bank(tmp_path / "bank.json", [question(1, "甲", answer="C")]))
+
+
+def test_reload_maps_renumbered_questions_by_content(tmp_path, fresh_index):
+    bank = tmp_path / "bank.json"
+    question_index.reload_index(write_bank(bank, [question(1, "甲"), question(2, "乙"), question(3, "丙")]))
+    v1 = question_index.get_index()['version']
+    # 乙 改了序号，丙 被删除，新增 丁
+    question_index.reload_index(write_bank(bank, [question(1, "甲"), question(5, "乙"), question(6, "丁")]))
+    assert question_index.migration_map(v1) == {2: 5}
+
+
+def test_duplicate_questions_are_claimed_one_to_one(tmp_path, fresh_index):
+    bank = tmp_path / "bank.json"
+    question_index.reload_index(write_bank(bank, [question(1, "甲"), question(2, "甲")]))
+    v1 = question_index.get_index()['version']
+    question_index.reload_index(write_bank(bank, [question(3, "甲"), question(4, "甲")]))
+    assert question_index.migration_map(v1) == {1: 3, 2: 4}
+
+
+def test_migration_map_follows_version_chain(monkeypatch):
+    monkeypatch.setattr(question_index, "_migrations", {
+        "v1": ("v2", {1: 10, 2: 20}),
+        "v2": ("v3", {10: 100, 3: 30}),
+    })
+    # v1 中未变的题目 10、3 在 v3 中也改了ID
+    assert question_index.migration_map("v1") == {1: 100, 2: 20, 10: 100, 3: 30}
+    assert question_index.migration_map("v2") == {10: 100, 3: 30}
+    assert question_index.migration_map("unknown") == {}
+
+
+def test_migration_map_stops_on_cycles(monkeypatch):
+    # 题库改回旧版本时版本链成环，不会死循环
+    monkeypatch.setattr(question_index, "_migrations", {"a": ("b", {1: 2}), "b": ("a", {2: 1})})
+    assert question_index.migration_map("a") == {1: 1, 2: 1}
+
+
+def test_remap_progress_rewrites_sets_and_string_keys():
+    progress = {
+        "correct_ids": {1, 2},
+        "incorrect_ids": {3},
+        "error_counts": {"3": 2, "legacy-key": 1},
+        "last_wrong_answers": {"3": "B"}
+    }
+    question_index.remap_progress(progress, {1: 10, 3: 30})
+    assert progress == {
+        "correct_ids": {10, 2},
+        "incorrect_ids": {30},
+        "error_counts": {"30": 2, "legacy-key": 1},
+        "last_wrong_answers": {"30": "B"}
+    }
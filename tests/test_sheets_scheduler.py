@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+import sheets_scheduler
+from sheets_scheduler import BACKGROUND, INTERACTIVE, LOGIN
+
+
+class APIError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.code = status
+
+
+def drained(per_minute, burst=sheets_scheduler.BURST, tokens=0.0):
+    scheduler = sheets_scheduler.SheetsScheduler({'read': per_minute, 'write': per_minute}, burst)
+    scheduler._buckets['read'].tokens = tokens
+    return scheduler
+
+
+def test_login_is_served_before_queued_background_requests():
+    # 每 0.5 秒补充一个令牌：后台请求先排队，随后到达的登录请求仍先取得令牌
+    scheduler = drained(120, burst=1)
+    order = []
+
+    def request(level, name):
+        sheets_scheduler.with_priority(level, scheduler.call, 'read', order.append, name, timeout=10)
+
+    threads = [threading.Thread(target=request, args=(BACKGROUND, f"后台{i}")) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    login = threading.Thread(target=request, args=(LOGIN, "登录"))
+    login.start()
+    for thread in threads + [login]:
+        thread.join()
+    assert order[0] == "登录"
+    assert sorted(order[1:]) == ["后台0", "后台1"]
+
+
+def test_lower_priorities_leave_reserved_tokens():
+    scheduler = drained(1, tokens=2.0)
+    with sheets_scheduler.priority(BACKGROUND), pytest.raises(sheets_scheduler.SheetsQuotaError):
+        scheduler.call('read', lambda: None, timeout=0.1)
+    with sheets_scheduler.priority(INTERACTIVE):
+        assert scheduler.call('read', lambda: "答题", timeout=0.1) == "答题"
+    with sheets_scheduler.priority(LOGIN):
+        assert scheduler.call('read', lambda: "登录", timeout=0.1) == "登录"
+    # 写请求使用独立的令牌桶
+    with sheets_scheduler.priority(BACKGROUND):
+        assert scheduler.call('write', lambda: "保存", timeout=0.1) == "保存"
+
+
+def test_quota_errors_are_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(sheets_scheduler.time, "sleep", lambda seconds: None)
+    # 429 会清空令牌桶，用较高的速率使测试不必等待补充
+    scheduler = sheets_scheduler.SheetsScheduler({'read': 6000, 'write': 6000})
+    failures = [APIError(429), APIError(503)]
+
+    def flaky():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    with sheets_scheduler.priority(LOGIN):
+        assert scheduler.call('read', flaky) == "ok"
+    stats = scheduler.metrics()['by_priority'][sheets_scheduler.PRIORITY_NAMES[LOGIN]]
+    assert (stats['calls'], stats['retries'], stats['quota_errors'], stats['failures']) == (3, 2, 1, 0)
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(sheets_scheduler.time, "sleep", lambda seconds: None)
+    scheduler = sheets_scheduler.SheetsScheduler()
+    calls = []
+
+    def forbidden():
+        calls.append(1)
+        raise APIError(403)
+
+    with pytest.raises(APIError):
+        scheduler.call('read', forbidden)
+    assert len(calls) == 1